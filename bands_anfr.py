@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Table fixe des bandes ANFR et représentation des technologies d'un support en masque de bits.
+
+Chaque bande connue occupe un bit d'un entier 64 bits, dans l'ordre d'affichage du champ
+technologie (GSM, UMTS, LTE puis 5G NR, par fréquence croissante). Les libellés inconnus
+partagent le bit BAND_OTHER, ce qui suffit à les exclure des tests d'inclusion.
+"""
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+
+# Ordre identique au tri de pretrait.sort_technologies_optimized
+BANDS = (
+    "GSM 900", "GSM 1800",
+    "UMTS 900", "UMTS 2100",
+    "LTE 700", "LTE 800", "LTE 900", "LTE 1800", "LTE 2100", "LTE 2600", "LTE 3500",
+    "5G NR 700", "5G NR 1800", "5G NR 2100", "5G NR 3500", "5G NR 26000",
+)
+BAND_BITS = {band: np.uint64(1 << i) for i, band in enumerate(BANDS)}
+# Bit commun à toutes les technologies absentes de la table
+BAND_OTHER = np.uint64(1 << 63)
+
+SUPPORT_KEYS = ["id_support", "operateur"]
+
+
+def band_mask(bands) -> np.uint64:
+    """Masque d'un ensemble de libellés de bandes."""
+    mask = np.uint64(0)
+    for band in bands:
+        mask |= BAND_BITS.get(band, BAND_OTHER)
+    return mask
+
+
+def band_bits(technologies: pd.Series) -> np.ndarray:
+    """Bit de chaque ligne (une bande par émetteur), 0 pour une technologie manquante."""
+    if isinstance(technologies.dtype, pd.CategoricalDtype):
+        # Un bit par catégorie, puis simple indexation par les codes (-1 pour les manquants)
+        category_bits = np.append(band_bits(pd.Series(technologies.cat.categories)), np.uint64(0))
+        return category_bits[technologies.cat.codes.to_numpy()]
+    bits = technologies.map(BAND_BITS)
+    bits[bits.isna() & technologies.notna()] = BAND_OTHER
+    return bits.fillna(0).to_numpy(dtype=np.uint64)
+
+
+def only_in(masks, allowed: np.uint64):
+    """Vrai pour les masques non vides dont toutes les bandes sont dans allowed (inclusion d'ensembles)."""
+    masks = np.asarray(masks, dtype=np.uint64)
+    return (masks != 0) & ((masks & ~allowed) == 0)
+
+
+@lru_cache(maxsize=None)
+def bands_label(mask: int) -> str:
+    """Champ technologie trié d'un masque sans bande inconnue."""
+    return ", ".join(band for i, band in enumerate(BANDS) if mask >> i & 1)
+
+
+def support_bands(df: pd.DataFrame) -> pd.DataFrame:
+    """Réduit un instantané (une ligne par émetteur) à une ligne par (id_support, operateur).
+
+    Args:
+        df: Instantané avec au moins id_support, operateur et technologie
+
+    Returns:
+        DataFrame indexé par (id_support, operateur) avec la colonne 'bandes' (uint64)
+    """
+    df = df.dropna(subset=SUPPORT_KEYS + ["technologie"])
+    keys = df[SUPPORT_KEYS].assign(bandes=band_bits(df["technologie"]))
+    # Bits distincts par support : leur somme vaut leur OU
+    return keys.drop_duplicates().groupby(SUPPORT_KEYS, observed=True)["bandes"].sum().astype(np.uint64).to_frame()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""Catalogue persistant (SQLite) des instantanés de files/from_anfr.
+
+Chaque fichier du dossier y a une ligne : horodatage ANFR ou période (MM_AAAA, TX_AAAA) lus une
+seule fois depuis le nom, puis, à l'ingestion, SHA-256, nombre de lignes, colonnes, séparateur et
+chemin du cache colonnaire. Le choix du fichier de référence devient une requête indexée.
+Le premier instantané de chaque mois et trimestre (ancre des diffs composés, deltas_anfr) y est
+retenu, et conservé dans le dossier tant que sa période peut servir de référence.
+"""
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "snapshots.sqlite")
+# À incrémenter si le schéma change : les tables reconstructibles sont alors recréées depuis le dossier
+CATALOG_VERSION = 3
+# Recréées vides à chaque changement de version (noms et faits d'ingestion se relisent sur les fichiers)
+REBUILT_TABLES = ("snapshots",)
+# Tables d'anciennes versions, supprimées au changement de version
+RETIRED_TABLES = ("ignored",)
+# Conservées d'une version à l'autre (une ancre ne se retrouve pas depuis le dossier) : tout changement
+# de leur schéma doit être migré dans SnapshotCatalog._upgrade
+DURABLE_TABLES = {"anchors": ("directory", "period", "filename")}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    directory TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    anfr_ts TEXT,
+    period_year INTEGER,
+    month INTEGER,
+    quarter INTEGER,
+    sha256 TEXT,
+    rows INTEGER,
+    columns TEXT,
+    separator TEXT,
+    columnar_path TEXT,
+    fingerprint TEXT,
+    canonical_fingerprint TEXT,
+    PRIMARY KEY (directory, filename)
+);
+CREATE TABLE IF NOT EXISTS anchors (
+    directory TEXT NOT NULL,
+    period TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    PRIMARY KEY (directory, period)
+);
+CREATE INDEX IF NOT EXISTS snapshots_anfr_ts ON snapshots (directory, anfr_ts);
+CREATE INDEX IF NOT EXISTS snapshots_month ON snapshots (directory, period_year, month);
+CREATE INDEX IF NOT EXISTS snapshots_quarter ON snapshots (directory, period_year, quarter);
+"""
+# Faits mis en cache par fichier, valables tant que taille et date de modification sont inchangées
+FACT_COLUMNS = ("sha256", "fingerprint", "canonical_fingerprint")
+
+
+def anfr_timestamp(filename: str):
+    """Horodatage AAAAMMJJHHMMSS en tête du nom (avant le premier '_'), None sinon."""
+    try:
+        return datetime.strptime(filename.split('_')[0], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+
+
+def period_fields(filename: str) -> tuple:
+    """(année, mois, trimestre) d'un nom MM_AAAA.csv ou TX_AAAA.csv, comme compare.is_older_file les lisait."""
+    try:
+        if filename[0].isdigit() and "_" in filename:
+            return int(filename.split("_")[1].split(".")[0]), int(filename.split("_")[0]), None
+        if filename.startswith("T") and "_" in filename:
+            return int(filename.split("_")[1].split(".")[0]), None, int(filename[1:2])
+    except (ValueError, IndexError):
+        pass
+    return None, None, None
+
+
+def _ts_text(value: datetime) -> str:
+    # Microsecondes toujours présentes : l'ordre des chaînes est celui des dates
+    return value.isoformat(sep=' ', timespec='microseconds')
+
+
+class SnapshotCatalog:
+    """Accès au catalogue ; chaque opération ouvre sa propre connexion (utilisable depuis plusieurs threads)."""
+
+    def __init__(self, db_path: str = CATALOG_PATH):
+        self.db_path = db_path
+        self._ready = False
+
+    @contextmanager
+    def _connect(self):
+        """Connexion validée (ou annulée sur erreur) puis fermée ; schéma vérifié une fois par instance."""
+        if not self._ready:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                if not self._ready:
+                    if conn.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+                        self._upgrade(conn)
+                    conn.executescript(_SCHEMA)
+                    self._ready = True
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _upgrade(conn: sqlite3.Connection) -> None:
+        """Passage à CATALOG_VERSION : tables reconstructibles et retirées supprimées, tables durables vérifiées."""
+        for table in REBUILT_TABLES + RETIRED_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        for table, columns in DURABLE_TABLES.items():
+            existing = tuple(row[1] for row in conn.execute(f"PRAGMA table_info({table})"))
+            if existing and existing != columns:
+                raise sqlite3.DatabaseError(
+                    f"Table {table} du catalogue au schéma inattendu {existing} : migration à écrire dans _upgrade.")
+        conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+
+    def sync(self, dir_path: str) -> None:
+        """Aligne le catalogue sur le contenu du dossier (ajouts, fichiers modifiés, disparus).
+
+        Le nom n'est analysé que pour les fichiers nouveaux ou modifiés ; les faits d'ingestion
+        d'un fichier modifié sont effacés.
+        """
+        directory = os.path.abspath(dir_path)
+        with self._connect() as conn:
+            known = {name: (size, mtime_ns) for name, size, mtime_ns in conn.execute(
+                "SELECT filename, size, mtime_ns FROM snapshots WHERE directory = ?", (directory,))}
+            names = set(os.listdir(directory))
+            conn.executemany("DELETE FROM snapshots WHERE directory = ? AND filename = ?",
+                             [(directory, name) for name in known.keys() - names])
+            for name in names:
+                stat = os.stat(os.path.join(directory, name))
+                if known.get(name) != (stat.st_size, stat.st_mtime_ns):
+                    self._register(conn, directory, name, stat)
+
+    @staticmethod
+    def _register(conn: sqlite3.Connection, directory: str, name: str, stat: os.stat_result) -> None:
+        """(Ré)inscrit un fichier d'après son nom, sans fait d'ingestion."""
+        ts = anfr_timestamp(name)
+        conn.execute(
+            "INSERT OR REPLACE INTO snapshots (directory, filename, size, mtime_ns, anfr_ts, "
+            "period_year, month, quarter) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (directory, name, stat.st_size, stat.st_mtime_ns, _ts_text(ts) if ts else None,
+             *period_fields(name))
+        )
+
+    def record_ingest(self, file_path: str, sha256: str, rows: int, columns: list, separator: str,
+                      columnar_path: str = None) -> None:
+        """Enregistre les faits calculés à l'ingestion d'un instantané."""
+        directory, name = os.path.split(os.path.abspath(file_path))
+        stat = os.stat(file_path)
+        ts = anfr_timestamp(name)
+        with self._connect() as conn:
+            known = conn.execute(
+                "SELECT fingerprint, canonical_fingerprint FROM snapshots WHERE directory = ? AND filename = ? "
+                "AND size = ? AND mtime_ns = ?", (directory, name, stat.st_size, stat.st_mtime_ns)
+            ).fetchone() or (None, None)
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (directory, name, stat.st_size, stat.st_mtime_ns, _ts_text(ts) if ts else None,
+                 *period_fields(name), sha256, rows, json.dumps(columns), separator, columnar_path, *known)
+            )
+
+    def fact(self, file_path: str, column: str):
+        """Valeur en cache de column (FACT_COLUMNS) pour ce fichier, None si absente ou périmée."""
+        if column not in FACT_COLUMNS:
+            raise ValueError(f"Fait inconnu : {column}")
+        directory, name = os.path.split(os.path.abspath(file_path))
+        stat = os.stat(file_path)
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {column} FROM snapshots WHERE directory = ? AND filename = ? AND size = ? AND mtime_ns = ?",
+                (directory, name, stat.st_size, stat.st_mtime_ns)
+            ).fetchone()
+        return row[0] if row else None
+
+    def record_fact(self, file_path: str, column: str, value: str) -> None:
+        """Met en cache column (FACT_COLUMNS) pour ce fichier, en le (ré)inscrivant s'il a changé."""
+        if column not in FACT_COLUMNS:
+            raise ValueError(f"Fait inconnu : {column}")
+        directory, name = os.path.split(os.path.abspath(file_path))
+        stat = os.stat(file_path)
+        with self._connect() as conn:
+            current = conn.execute(
+                "SELECT size, mtime_ns FROM snapshots WHERE directory = ? AND filename = ?", (directory, name)
+            ).fetchone()
+            if current != (stat.st_size, stat.st_mtime_ns):
+                self._register(conn, directory, name, stat)
+            conn.execute(f"UPDATE snapshots SET {column} = ? WHERE directory = ? AND filename = ?",
+                         (value, directory, name))
+
+    def record_anchor(self, dir_path: str, period: str, filename: str) -> bool:
+        """Retient filename comme instantané de début de la période (MM_AAAA, TX_AAAA) s'il n'y en a pas déjà un."""
+        with self._connect() as conn:
+            return conn.execute("INSERT OR IGNORE INTO anchors VALUES (?, ?, ?)",
+                                (os.path.abspath(dir_path), period, filename)).rowcount == 1
+
+    def anchor(self, dir_path: str, period: str) -> str:
+        """Instantané de début de la période, None si aucun n'a été retenu."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT filename FROM anchors WHERE directory = ? AND period = ?",
+                               (os.path.abspath(dir_path), period)).fetchone()
+        return row[0] if row else None
+
+    def anchored(self, dir_path: str) -> set:
+        """Instantanés retenus comme ancre d'une période : gardés pour une comparaison complète de secours."""
+        with self._connect() as conn:
+            return {name for (name,) in conn.execute("SELECT filename FROM anchors WHERE directory = ?",
+                                                     (os.path.abspath(dir_path),))}
+
+    def forget_anchors_before(self, dir_path: str, reference_filename: str) -> None:
+        """Oublie les ancres des périodes de même type (mensuelles ou trimestrielles) antérieures à reference_filename."""
+        year, month, quarter = period_fields(reference_filename)
+        if year is None:
+            return
+        reference = (year, month if month is not None else quarter)
+        with self._connect() as conn:
+            periods = [period for (period,) in conn.execute("SELECT period FROM anchors WHERE directory = ?",
+                                                            (os.path.abspath(dir_path),))]
+            for period in periods:
+                p_year, p_month, p_quarter = period_fields(f"{period}.csv")
+                same_type = p_year is not None and (p_month is None) == (month is None)
+                if same_type and (p_year, p_month if p_month is not None else p_quarter) < reference:
+                    conn.execute("DELETE FROM anchors WHERE directory = ? AND period = ?",
+                                 (os.path.abspath(dir_path), period))
+
+    def entry(self, file_path: str) -> dict:
+        """Ligne du catalogue pour ce fichier (colonnes décodées), None s'il n'y figure pas."""
+        directory, name = os.path.split(os.path.abspath(file_path))
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM snapshots WHERE directory = ? AND filename = ?",
+                               (directory, name)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry['columns'] = json.loads(entry['columns']) if entry['columns'] else None
+        return entry
+
+    def latest_between(self, dir_path: str, start: datetime, end: datetime, exclude: str = None) -> str:
+        """Fichier horodaté le plus récent dans [start, end] (hors exclude), None si aucun."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT filename FROM snapshots WHERE directory = ? AND anfr_ts BETWEEN ? AND ? "
+                "AND filename != ? ORDER BY anfr_ts DESC, filename LIMIT 1",
+                (os.path.abspath(dir_path), _ts_text(start), _ts_text(end), exclude or "")
+            ).fetchone()
+        return row[0] if row else None
+
+    def timestamped_before(self, dir_path: str, limit: datetime) -> list:
+        """Fichiers horodatés strictement avant limit."""
+        with self._connect() as conn:
+            return [name for (name,) in conn.execute(
+                "SELECT filename FROM snapshots WHERE directory = ? AND anfr_ts < ? ORDER BY anfr_ts",
+                (os.path.abspath(dir_path), _ts_text(limit)))]
+
+    def contains(self, dir_path: str, filename: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM snapshots WHERE directory = ? AND filename = ?",
+                                (os.path.abspath(dir_path), filename)).fetchone() is not None
+
+    def periods_before(self, dir_path: str, reference_filename: str) -> list:
+        """Fichiers .csv de même type (mensuel ou trimestriel) que reference_filename et plus anciens."""
+        year, month, quarter = period_fields(reference_filename)
+        if year is None:
+            return []
+        period_col, period = ("month", month) if month is not None else ("quarter", quarter)
+        with self._connect() as conn:
+            return [name for (name,) in conn.execute(
+                f"SELECT filename FROM snapshots WHERE directory = ? AND {period_col} IS NOT NULL "
+                f"AND (period_year < ? OR (period_year = ? AND {period_col} < ?)) AND filename LIKE '%.csv' "
+                "ORDER BY filename",
+                (os.path.abspath(dir_path), year, year, period))]
+
+    def forget(self, dir_path: str, filename: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM snapshots WHERE directory = ? AND filename = ?",
+                         (os.path.abspath(dir_path), filename))
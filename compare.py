@@ -1,28 +1,55 @@
 #!/usr/bin/env python
 import argparse
 import pandas as pd
+import numpy as np
 import time
 import os
+import sys
+import math
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
 import functions_anfr
+import schema_anfr
+import catalog_anfr
+import deltas_anfr
+import report_anfr
+
+# Colonnes identifiant une ligne (clé de comparaison) et colonnes dont on suit l'évolution
+ID_COLUMNS = functions_anfr.IDENTITY_COLUMNS
+PAYLOAD_COLUMNS = functions_anfr.PAYLOAD_COLUMNS
+DIFF_ENGINES = ["hash", "merge"]
+ANFR_URL = (
+    "https://data.anfr.fr/d4c/api/records/2.0/downloadfile/"
+    "format=csv&resource_id=88ef0887-6b0f-4d3f-8545-6d64c8f597da"
+    "&use_labels_for_header=true"
+)
+
+# Mode hors mémoire (--max-memory) : estimations volontairement pessimistes (chaînes Python)
+MEMORY_EXPANSION = 8        # Mémoire d'un instantané chargé / taille du CSV
+ROW_MEMORY = 1024           # Octets par ligne normalisée chargée
+PARTITION_BUDGET_SHARE = 4  # Un quart du budget pour une paire de partitions, le reste pour le diff
 
 def download_data(url, save_path, max_retries=3, delay=60):
-    for attempt in range(1, max_retries + 1):
-        try:
-            response = requests.get(url, timeout=180)
-            response.raise_for_status()
-            with open(save_path, 'wb') as file:
-                file.write(response.content)
+    try:
+        save_path, digest = functions_anfr.download_file(url, save_path, max_retries=max_retries, delay=delay)
+        functions_anfr.log_message(f"Téléchargement des données terminé avec succès (sha256 {digest[:12]}).")
+        return save_path
+    except requests.exceptions.RequestException:
+        functions_anfr.log_message(f"Échec du téléchargement après {max_retries} tentatives.", "ERROR")
+        raise SystemExit(1)
+
+def fetch_data(url, download_path, max_retries=3, delay=60):
+    """Récupère le fichier ANFR via le cache HTTP partagé (une seule requête conditionnelle)."""
+    try:
+        save_path, downloaded = functions_anfr.fetch_snapshot(url, download_path, max_retries=max_retries, delay=delay)
+        if downloaded:
             functions_anfr.log_message("Téléchargement des données terminé avec succès.")
-            return save_path
-        except requests.exceptions.RequestException as e:
-            functions_anfr.log_message(f"Tentative {attempt}/{max_retries} échouée - {e}", "WARN")
-            if attempt < max_retries:
-                time.sleep(delay)
-            else:
-                functions_anfr.log_message(f"Échec du téléchargement après {max_retries} tentatives.", "ERROR")
-                raise SystemExit(1)
+        return save_path
+    except requests.exceptions.RequestException as e:
+        functions_anfr.log_message(f"Échec du téléchargement - {e}", "ERROR")
+        raise SystemExit(1)
 
 def get_previous_period_filename(update_type):
     now = datetime.now()
@@ -41,76 +68,45 @@ def csv_files_update(path_new_csv, update_type):
     date = datetime.now()
     old_csv_path = None
 
+    # Horodatages et périodes lus une fois à l'inscription au catalogue : la sélection est une requête indexée
+    catalog = catalog_anfr.SnapshotCatalog()
+    catalog.sync(dir_path)
+
     if update_type == "hebdo":
         date_limite_sup = date - timedelta(days=1)
         date_limite_inf = date - timedelta(days=31)
-        min_diff = timedelta.max
-        for fichier in os.listdir(dir_path):
-            path_check_file = os.path.join(dir_path, fichier)
-            try:
-                file_timestamp_str = fichier.split('_')[0]
-                file_timestamp = datetime.strptime(file_timestamp_str, "%Y%m%d%H%M%S")
-            except ValueError:
+        # Les ancres de période restent : comparaison complète si la chaîne de diffs est rompue
+        anchored = catalog.anchored(dir_path)
+        for fichier in catalog.timestamped_before(dir_path, date_limite_inf):
+            if fichier in anchored:
                 continue
-
-            if file_timestamp < date_limite_inf:
-                os.remove(path_check_file)
-            elif date_limite_inf <= file_timestamp <= date_limite_sup:
-                diff = date - file_timestamp
-                if diff < min_diff and path_check_file != path_new_csv:
-                    min_diff = diff
-                    old_csv_path = path_check_file
+            os.remove(os.path.join(dir_path, fichier))
+            catalog.forget(dir_path, fichier)
+        reference = catalog.latest_between(dir_path, date_limite_inf, date_limite_sup,
+                                           exclude=os.path.basename(path_new_csv))
+        if reference is not None:
+            old_csv_path = os.path.join(dir_path, reference)
     else:
         expected_filename = get_previous_period_filename(update_type)
-        # Trouver le fichier de la période précédente
-        for fichier in os.listdir(dir_path):
-            if fichier == expected_filename:
-                old_csv_path = os.path.join(dir_path, fichier)
-                break
-        
-        # Supprimer les fichiers antérieurs à la période précédente
-        def is_older_file(filename, reference_filename):
-            # Gestion des fichiers mensuels (format: MM_YYYY.csv)
-            if reference_filename[0].isdigit() and "_" in reference_filename:
-                ref_month = int(reference_filename.split("_")[0])
-                ref_year = int(reference_filename.split("_")[1].split(".")[0])
-                
-                # Vérifier si le fichier est au format mensuel
-                if filename[0].isdigit() and "_" in filename:
-                    try:
-                        month = int(filename.split("_")[0])
-                        year = int(filename.split("_")[1].split(".")[0])
-                        # Le fichier est plus ancien si l'année est plus petite ou si même année mais mois plus petit
-                        return (year < ref_year) or (year == ref_year and month < ref_month)
-                    except (ValueError, IndexError):
-                        return False
-            
-            # Gestion des fichiers trimestriels (format: TX_YYYY.csv)
-            elif reference_filename.startswith("T") and "_" in reference_filename:
-                ref_quarter = int(reference_filename[1:2])
-                ref_year = int(reference_filename.split("_")[1].split(".")[0])
-                
-                # Vérifier si le fichier est au format trimestriel
-                if filename.startswith("T") and "_" in filename:
-                    try:
-                        quarter = int(filename[1:2])
-                        year = int(filename.split("_")[1].split(".")[0])
-                        # Le fichier est plus ancien si l'année est plus petite ou si même année mais trimestre plus petit
-                        return (year < ref_year) or (year == ref_year and quarter < ref_quarter)
-                    except (ValueError, IndexError):
-                        return False
-            
-            return False
-        
-        # Supprimer tous les fichiers plus anciens
-        for fichier in os.listdir(dir_path):
-            if fichier.endswith(".csv") and is_older_file(fichier, expected_filename):
-                file_to_delete = os.path.join(dir_path, fichier)
-                try:
-                    os.remove(file_to_delete)
-                    functions_anfr.log_message(f"Fichier supprimé : {fichier}")
-                except Exception as e:
-                    functions_anfr.log_message(f"Erreur lors de la suppression de {fichier}: {e}", "ERROR")
+        # Fichier de la période précédente
+        if catalog.contains(dir_path, expected_filename):
+            old_csv_path = os.path.join(dir_path, expected_filename)
+        else:
+            # Sans copie de la période : son premier instantané, atteint en composant les diffs hebdo archivés
+            anchor = catalog.anchor(dir_path, os.path.splitext(expected_filename)[0])
+            if anchor is not None:
+                old_csv_path = os.path.join(dir_path, anchor)
+
+        # Supprimer les fichiers (mensuels ou trimestriels, selon la référence) antérieurs à la période précédente
+        for fichier in catalog.periods_before(dir_path, expected_filename):
+            try:
+                os.remove(os.path.join(dir_path, fichier))
+                catalog.forget(dir_path, fichier)
+                functions_anfr.log_message(f"Fichier supprimé : {fichier}")
+            except Exception as e:
+                functions_anfr.log_message(f"Erreur lors de la suppression de {fichier}: {e}", "ERROR")
+        # Leurs instantanés d'ancre seront supprimés par la prochaine MAJ hebdo
+        catalog.forget_anchors_before(dir_path, expected_filename)
 
     if old_csv_path is None:
         raise FileNotFoundError("Aucun fichier de référence trouvé pour le type de mise à jour spécifié.")
@@ -132,37 +128,12 @@ def rename_old_file(old_path, new_path):
     except OSError as e:
         functions_anfr.log_message(f"Échec du renommage des fichiers - {e}", "ERROR")
 
-def load_and_process_csv(file_path):
+def load_and_process_csv(file_path, workers=None, step_name="compare.load_snapshot"):
     try:
-        sep = functions_anfr.detect_separator(file_path)
-        df = pd.read_csv(file_path, sep=sep, engine='c', on_bad_lines='skip', dtype=str)
-        df = df[['adm_lb_nom', 'sup_id', 'emr_lb_systeme', 'nat_id', 'sup_nm_haut', 'tpo_id', 'adr_lb_lieu', 'adr_lb_add1', 'adr_lb_add2', 'adr_lb_add3', 'com_cd_insee', 'coordonnees', 'statut', 'emr_dt']]
-        df = df.rename(columns={
-            'adm_lb_nom': 'operateur',
-            'sup_id': 'id_support',
-            'emr_lb_systeme': 'technologie',
-            'nat_id': 'type_support',
-            'sup_nm_haut': 'hauteur_support',
-            'tpo_id': 'proprietaire_support',
-            'adr_lb_lieu': 'adresse0',
-            'adr_lb_add1': 'adresse1',
-            'adr_lb_add2': 'adresse2',
-            'adr_lb_add3': 'adresse3',
-            'com_cd_insee': 'code_insee',
-            'coordonnees': 'coordonnees',
-            'statut': 'statut',
-            'emr_dt': 'date_activ'
-        })
-        
-        # === NORMALISATION DES COLONNES CLÉ ===
-        # Normaliser code_insee: zfill(5) pour préserver les zéros en tête (06073 vs 6073)
-        df['code_insee'] = df['code_insee'].astype(str).str.zfill(5)
-        
-        # Normaliser coordonnees: format "lat , lon" avec espaces consistants
-        df['coordonnees'] = (df['coordonnees'].astype(str)
-                            .str.split(r'\s*,\s*', regex=True)
-                            .str.join(' , '))
-        
+        # Colonnes renommées et normalisées (code_insee, coordonnees) depuis le cache colonnaire
+        with report_anfr.step(step_name) as record:
+            df = functions_anfr.load_snapshot(file_path, workers=workers)
+            record['rows_out'] = len(df)
         return df
     except FileNotFoundError:
         functions_anfr.log_message(f"Le fichier '{file_path}' est introuvable.", "FATAL")
@@ -174,8 +145,49 @@ def load_and_process_csv(file_path):
         functions_anfr.log_message(f"Problème lors du chargement du fichier CSV '{file_path}' - {e}", "ERROR")
         return None
 
-def compare_data(df_old, df_current):
+def classify_merged(df_merged, with_dates=False):
+    """Répartit un résultat de jointure externe en lignes ajoutées, supprimées et modifiées.
+
+    with_dates : renvoyer aussi les lignes dont seule la date_activ a changé hors "Projet approuvé"
+    (ignorées par la MAJ, mais archivées avec les diffs hebdo pour que leur composition soit exacte).
+    """
+    # Lignes ajoutées (présentes seulement dans le nouveau CSV)
+    df_added = df_merged[df_merged['statut_old'].isna()]
+    
+    # Lignes supprimées (présentes seulement dans l'ancien CSV)
+    df_removed = df_merged[df_merged['statut_last'].isna()]
+    
+    # Lignes modifiées : soit le statut a changé, soit la date_activ a changé pour les "Projet approuvé"
+    mask_statut = df_merged['statut_old'] != df_merged['statut_last']
+
+    dates_differ = (df_merged['date_activ_old'].fillna('').astype(str).str.strip() !=
+                    df_merged['date_activ_last'].fillna('').astype(str).str.strip())
+    mask_date = (
+        (df_merged['statut_old'] == 'Projet approuvé') &
+        (df_merged['statut_last'] == 'Projet approuvé') &
+        dates_differ
+    )
+
+    df_modified = df_merged[mask_statut | mask_date]
+    
+    # Supprimer les lignes ajoutées et supprimées des modifications
+    df_modified = df_modified.drop(df_removed.index)
+    df_modified = df_modified.drop(df_added.index)
+    
+    if with_dates:
+        return df_added, df_removed, df_modified, df_merged[~(mask_statut | mask_date) & dates_differ]
+    return df_added, df_removed, df_modified
+
+def compare_data_merge(df_old, df_current, with_dates=False):
+    """Comparaison historique : jointure externe sur les 12 colonnes identifiantes.
+
+    Les clés repassent en texte : sur des Categorical, pd.merge placerait les clés manquantes en
+    tête au lieu de la fin, et l'ordre des lignes différerait de celui du moteur par empreintes.
+    """
     try:
+        df_old = schema_anfr.to_plain(df_old[ID_COLUMNS + PAYLOAD_COLUMNS]).copy()
+        df_current = schema_anfr.to_plain(df_current[ID_COLUMNS + PAYLOAD_COLUMNS]).copy()
+
         # Préparation des colonnes pour la comparaison
         df_old['statut_old'] = df_old['statut']
         df_old['date_activ_old'] = df_old['date_activ']
@@ -187,80 +199,359 @@ def compare_data(df_old, df_current):
         df_merged = pd.merge(
             df_old, 
             df_current, 
-            on=[
-                'operateur', 
-                'id_support', 
-                'technologie', 
-                'type_support',
-                'hauteur_support',
-                'proprietaire_support',
-                'adresse0', 
-                'adresse1', 
-                'adresse2', 
-                'adresse3', 
-                'code_insee', 
-                'coordonnees'
-            ], 
+            on=ID_COLUMNS, 
             how='outer'
         )
         
-        # Lignes ajoutées (présentes seulement dans le nouveau CSV)
-        df_added = df_merged[df_merged['statut_old'].isna()]
-        
-        # Lignes supprimées (présentes seulement dans l'ancien CSV)
-        df_removed = df_merged[df_merged['statut_last'].isna()]
-        
-        # Lignes modifiées : soit le statut a changé, soit la date_activ a changé pour les "Projet approuvé"
-        mask_statut = df_merged['statut_old'] != df_merged['statut_last']
-
-        mask_date = (
-            (df_merged['statut_old'] == 'Projet approuvé') &
-            (df_merged['statut_last'] == 'Projet approuvé') &
-            (df_merged['date_activ_old'].fillna('').astype(str).str.strip() !=
-            df_merged['date_activ_last'].fillna('').astype(str).str.strip())
-        )
+        return classify_merged(df_merged, with_dates)
+    except KeyError as e:
+        functions_anfr.log_message(f"Clé manquante lors de la comparaison des données - {e}", "ERROR")
+        return (None,) * (4 if with_dates else 3)
+    except Exception as e:
+        functions_anfr.log_message(f"Erreur lors de la comparaison des données - {e}", "ERROR")
+        return (None,) * (4 if with_dates else 3)
+
+def row_fingerprints(df):
+    """Empreintes (identité, statut/date) de chaque ligne, lues dans l'instantané si déjà calculées."""
+    if all(col in df.columns for col in functions_anfr.FINGERPRINT_COLUMNS):
+        return df['empreinte_id'].to_numpy(), df['empreinte_statut'].to_numpy()
+    return functions_anfr.fingerprint(df, ID_COLUMNS), functions_anfr.fingerprint(df, PAYLOAD_COLUMNS)
+
+def _take_rows(df, positions):
+    """Lignes de df aux positions données, une ligne de NaN là où la position vaut -1."""
+    rows = df.iloc[np.where(positions >= 0, positions, 0)].reset_index(drop=True)
+    return rows.where(pd.Series(positions >= 0), np.nan)
+
+def _build_merged(df_old, df_current, pos_old, pos_new):
+    """Reconstruit, pour les seules paires données, les colonnes de pd.merge(how='outer').
+
+    Même ordre de colonnes (clés à leur place dans l'ancien CSV, suffixes _x/_y)
+    et même ordre de lignes (clés triées, puis ordre d'origine) que la jointure externe.
+    """
+    left = _take_rows(df_old, pos_old)
+    right = _take_rows(df_current, pos_new)
+    for col in PAYLOAD_COLUMNS:
+        left[f"{col}_old"] = left[col]
+        right[f"{col}_last"] = right[col]
+    keys_from_left = pd.Series(pos_old >= 0)
+
+    merged = {}
+    for col in left.columns:
+        if col in ID_COLUMNS:
+            merged[col] = left[col].where(keys_from_left, right[col])
+        else:
+            merged[f"{col}_x" if col in right.columns else col] = left[col]
+    for col in right.columns:
+        if col not in ID_COLUMNS:
+            merged[f"{col}_y" if col in left.columns else col] = right[col]
 
-        df_modified = df_merged[mask_statut | mask_date]
-        
-        # Supprimer les lignes ajoutées et supprimées des modifications
-        df_modified = df_modified.drop(df_removed.index)
-        df_modified = df_modified.drop(df_added.index)
-        
-        return df_added, df_removed, df_modified
+    return sort_like_merge(pd.DataFrame(merged))
+
+def sort_like_merge(df):
+    """Trie les lignes comme la jointure externe : clés croissantes, NaN en dernier, ordre stable."""
+    return df.sort_values(ID_COLUMNS, kind='mergesort', na_position='last').reset_index(drop=True)
+
+def compare_data_hash(df_old, df_current, with_dates=False):
+    """Comparaison par empreintes : jointure sur une clé entière au lieu de 12 colonnes texte.
+
+    Seules les lignes sans correspondance et les paires dont l'empreinte statut/date
+    (ou un statut manquant) diffère sont matérialisées, puis classées comme le fait
+    la jointure externe historique.
+    """
+    try:
+        old_key, old_payload = row_fingerprints(df_old)
+        new_key, new_payload = row_fingerprints(df_current)
+        df_old = df_old[ID_COLUMNS + PAYLOAD_COLUMNS]
+        df_current = df_current[ID_COLUMNS + PAYLOAD_COLUMNS]
+
+        only_old = np.flatnonzero(~pd.Series(old_key).isin(new_key).to_numpy())
+        only_new = np.flatnonzero(~pd.Series(new_key).isin(old_key).to_numpy())
+
+        # Paires appariées (produit cartésien en cas de clés dupliquées, comme pd.merge)
+        pairs = pd.merge(
+            pd.DataFrame({'key': old_key, 'pos_old': np.arange(len(df_old))}),
+            pd.DataFrame({'key': new_key, 'pos_new': np.arange(len(df_current))}),
+            on='key',
+            how='inner'
+        )
+        pos_old = pairs['pos_old'].to_numpy()
+        pos_new = pairs['pos_new'].to_numpy()
+        payload_changed = old_payload[pos_old] != new_payload[pos_new]
+        statut_missing = (df_old['statut'].isna().to_numpy()[pos_old] |
+                          df_current['statut'].isna().to_numpy()[pos_new])
+        candidates = payload_changed | statut_missing
+
+        df_merged = _build_merged(
+            df_old,
+            df_current,
+            np.concatenate([pos_old[candidates], only_old, np.full(len(only_new), -1)]),
+            np.concatenate([pos_new[candidates], np.full(len(only_old), -1), only_new])
+        )
+        return classify_merged(df_merged, with_dates)
     except KeyError as e:
         functions_anfr.log_message(f"Clé manquante lors de la comparaison des données - {e}", "ERROR")
-        return None, None, None
+        return (None,) * (4 if with_dates else 3)
     except Exception as e:
         functions_anfr.log_message(f"Erreur lors de la comparaison des données - {e}", "ERROR")
-        return None, None, None
+        return (None,) * (4 if with_dates else 3)
+
+def compare_data(df_old, df_current, engine="hash", with_dates=False):
+    """Compare deux instantanés ; engine='merge' conserve l'ancienne jointure externe pour contrôle.
 
-def write_results(df, file_path, message):
+    Les résultats repassent en texte (schema_anfr.to_plain) avant écriture et passage à pretrait.
+    with_dates ajoute un quatrième résultat, les changements de date seuls (voir classify_merged).
+    """
+    if engine == "merge":
+        results = compare_data_merge(df_old, df_current, with_dates)
+    else:
+        results = compare_data_hash(df_old, df_current, with_dates)
+    return tuple(schema_anfr.to_plain(df) for df in results)
+
+def compose_diffs(deltas):
+    """Compose des diffs successifs (du plus ancien au plus récent) en un diff net, classé comme compare_data.
+
+    Chaque identité garde son état avant dans le premier diff où elle apparaît et son état après
+    dans le dernier : un ajout suivi d'une suppression disparaît, des changements de statut
+    successifs se réduisent au premier et au dernier statut. Les diffs archivés contenant aussi
+    les changements de date seuls (with_dates), le résultat est celui de compare_data entre le
+    premier et le dernier instantané.
+    """
+    deltas = [df for df in deltas if not df.empty]
+    if not deltas:
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+    rows = pd.concat(deltas, ignore_index=True)
+    key = pd.Series(functions_anfr.fingerprint(rows, ID_COLUMNS))
+    after_columns = [f"{col}_y" for col in PAYLOAD_COLUMNS] + [f"{col}_last" for col in PAYLOAD_COLUMNS]
+
+    first = ~key.duplicated(keep='first').to_numpy()
+    last = ~key.duplicated(keep='last').to_numpy()
+    after = pd.DataFrame(rows.loc[last, after_columns].to_numpy(), columns=after_columns, index=key[last])
+    net = rows[first].reset_index(drop=True)
+    net[after_columns] = after.loc[key[first]].to_numpy()
+
+    # Lignes absentes avant comme après (ajoutées puis supprimées)
+    net = net[net['statut_old'].notna() | net['statut_last'].notna()]
+    return classify_merged(sort_like_merge(net))
+
+def parse_memory_size(value):
+    """Convertit une taille type '2G', '512M' ou '800' (Mo par défaut) en octets, pour argparse."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = str(value).strip().upper().removesuffix('O').removesuffix('B')
+    factor = units.get(text[-1:], None)
+    try:
+        size = float(text[:-1] if factor else text) * (factor or units['M'])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Taille mémoire invalide : '{value}' (ex. 2G, 512M)")
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"Taille mémoire invalide : '{value}'")
+    return int(size)
+
+def resident_memory():
+    """Pic de mémoire résidente du processus jusqu'ici, en octets (0 si non mesurable)."""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    factor = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor
+
+def spill_partitions(file_path, spill_dir, prefix, n_partitions, chunk_rows):
+    """Répartit un instantané, par blocs, dans n_partitions CSV selon l'empreinte d'identité.
+
+    Toutes les lignes d'une même clé tombent dans la même partition, dans leur ordre d'origine.
+    """
+    paths = [os.path.join(spill_dir, f"{prefix}_{i:04d}.csv") for i in range(n_partitions)]
+    for chunk in functions_anfr.iter_snapshot_chunks(file_path, chunk_rows):
+        if 'empreinte_id' not in chunk.columns:
+            chunk['empreinte_id'] = functions_anfr.fingerprint(chunk, ID_COLUMNS)
+            chunk['empreinte_statut'] = functions_anfr.fingerprint(chunk, PAYLOAD_COLUMNS)
+        partition = chunk['empreinte_id'].to_numpy() % np.uint64(n_partitions)
+        for i, part in chunk.groupby(partition, sort=False):
+            path = paths[int(i)]
+            part.to_csv(path, mode='a', header=not os.path.exists(path), index=False)
+    return paths
+
+def read_partition(path):
+    """Relit une partition écrite par spill_partitions (DataFrame vide si aucune ligne n'y est tombée)."""
+    columns = ID_COLUMNS + PAYLOAD_COLUMNS + functions_anfr.FINGERPRINT_COLUMNS
+    if not os.path.exists(path):
+        return pd.DataFrame({col: pd.Series(dtype='uint64' if col in functions_anfr.FINGERPRINT_COLUMNS else str)
+                             for col in columns})
+    # Seule la chaîne vide est un manquant : "nan" dans coordonnees est une valeur normalisée
+    return pd.read_csv(path, keep_default_na=False, na_values=[''],
+                       dtype={col: ('uint64' if col in functions_anfr.FINGERPRINT_COLUMNS else str)
+                              for col in columns})
+
+def compare_partitioned(old_csv_path, new_csv_path, max_memory, engine="hash", spill_root=None, with_dates=False):
+    """Comparaison hors mémoire : partitions sur disque par empreinte d'identité, diff partition par partition.
+
+    Le nombre de partitions et la taille des blocs lus sont déduits de max_memory (octets).
+    Les résultats, limités aux lignes qui changent, sont triés à la fin comme la jointure
+    globale : les fichiers comp_* sont identiques à ceux du mode en mémoire.
+    """
+    # L'interpréteur et les bibliothèques déjà chargées comptent dans le budget
+    usable = max_memory - resident_memory()
+    if usable < max_memory / PARTITION_BUDGET_SHARE:
+        functions_anfr.log_message(
+            f"Budget mémoire très serré ({max_memory / 1024 ** 2:.0f} Mo dont "
+            f"{resident_memory() / 1024 ** 2:.0f} Mo déjà utilisés), il risque d'être dépassé.", "WARN"
+        )
+        usable = max_memory / PARTITION_BUDGET_SHARE
+    part_budget = usable / PARTITION_BUDGET_SHARE
+    snapshot_bytes = (os.path.getsize(old_csv_path) + os.path.getsize(new_csv_path)) * MEMORY_EXPANSION
+    n_partitions = max(1, math.ceil(snapshot_bytes / part_budget))
+    chunk_rows = max(1000, int(part_budget / ROW_MEMORY))
+    functions_anfr.log_message(
+        f"Comparaison hors mémoire : {n_partitions} partition(s), blocs de {chunk_rows:,} lignes "
+        f"(budget {max_memory / 1024 ** 2:.0f} Mo)."
+    )
+
+    results = tuple([] for _ in range(4 if with_dates else 3))
+    with tempfile.TemporaryDirectory(prefix="partitions_", dir=spill_root) as spill_dir:
+        old_parts = spill_partitions(old_csv_path, spill_dir, "old", n_partitions, chunk_rows)
+        new_parts = spill_partitions(new_csv_path, spill_dir, "new", n_partitions, chunk_rows)
+        for old_part, new_part in zip(old_parts, new_parts):
+            diff = compare_data(read_partition(old_part), read_partition(new_part), engine=engine,
+                                with_dates=with_dates)
+            if any(df is None for df in diff):
+                return (None,) * len(results)
+            for acc, df in zip(results, diff):
+                if not df.empty:
+                    acc.append(df)
+
+    return tuple(sort_like_merge(pd.concat(acc, ignore_index=True)) if acc else pd.DataFrame()
+                 for acc in results)
+
+def write_results(df, file_path, message, csv_debug=False):
+    """Écrit un résultat pour pretrait.py : Arrow à côté de file_path, le CSV seulement si csv_debug.
+
+    Sans pyarrow, seul le CSV est écrit (et pretrait.py le relit comme avant).
+    """
     try:
-        df.to_csv(file_path, index=False, sep=",")
+        arrow_path = functions_anfr.intermediate_path(file_path)
+        with report_anfr.step(f"compare.write_{os.path.splitext(os.path.basename(file_path))[0]}", rows_in=len(df)):
+            if functions_anfr.write_intermediate(df, arrow_path):
+                stale_path = None if csv_debug else file_path
+            else:
+                csv_debug, stale_path = True, arrow_path
+            if csv_debug:
+                df.to_csv(file_path, index=False, sep=",")
+        # Pas de fichier d'une MAJ précédente à côté du résultat courant
+        if stale_path and os.path.exists(stale_path):
+            os.remove(stale_path)
         nb_rows = len(df)
         functions_anfr.log_message(f"{message}{nb_rows}.")
         return f"{message}{nb_rows}."
     except IOError as e:
         functions_anfr.log_message(f"Impossible d'écrire dans le fichier '{file_path}' - {e}", "ERROR")
 
+def write_diffs(df_added, df_removed, df_modified, compared_dir, csv_debug=False, debug=False):
+    """Écrit les trois résultats non vides dans compared_dir et renvoie le texte du SMS de synthèse."""
+    functions_anfr.log_message("Début écriture des résultats")
+    string_sms = ""
+    if df_removed is not None and not df_removed.empty:
+        if debug:
+            functions_anfr.log_message("Début écriture résultats df_removed", "DEBUG")
+        result = write_results(df_removed, os.path.join(compared_dir, 'comp_removed.csv'), "Lignes supprimées : ", csv_debug)
+        if result:
+            string_sms += result
+    if df_modified is not None and not df_modified.empty:
+        if debug:
+            functions_anfr.log_message("Début écriture résultats df_modified", "DEBUG")
+        result = write_results(df_modified, os.path.join(compared_dir, 'comp_modified.csv'), "Lignes modifiées : ", csv_debug)
+        if result:
+            string_sms += " " + result
+    if df_added is not None and not df_added.empty:
+        if debug:
+            functions_anfr.log_message("Début écriture résultats df_added", "DEBUG")
+        result = write_results(df_added, os.path.join(compared_dir, 'comp_added.csv'), "Nouvelles lignes : ", csv_debug)
+        if result:
+            string_sms += " " + result
+    functions_anfr.log_message("Ecriture des résultats terminée")
+    return string_sms
+
+def abort_empty_update(path_app, curr_csv_path, string_sms):
+    """Fin d'une MAJ ANFR vide : fichier ignoré (ignores.txt), SMS, suppression puis sortie en erreur."""
+    functions_anfr.log_message("MAJ ANFR vide, fin du programme", "FATAL")
+
+    # Ajouter le fichier courant à ignores.txt
+    if curr_csv_path:
+        functions_anfr.ignore_snapshot(curr_csv_path, os.path.join(path_app, 'files', 'ignores.txt'))
+
+    # Envoyer les SMS
+    functions_anfr.send_sms(string_sms, "INFO")
+    functions_anfr.send_sms("MAJ vide... (sûr au moins 1 df)", "FATAL")
+
+    # Supprimer le fichier de la MAJ vide
+    try:
+        if curr_csv_path:
+            os.remove(curr_csv_path)
+            functions_anfr.log_message(f"Fichier supprimé : {curr_csv_path}", "INFO")
+    except Exception as e:
+        functions_anfr.log_message(f"Erreur lors de la suppression du fichier : {e}", "ERROR")
+
+    raise SystemExit(1)
+
+def anchored_reference(update_type, reference_path):
+    """Vrai si la référence d'une MAJ mensu/trim est l'ancre de la période (pas de copie MM_AAAA/TX_AAAA)."""
+    return update_type != "hebdo" and catalog_anfr.anfr_timestamp(os.path.basename(reference_path)) is not None
+
+def compose_period_diff(anchor_path, current_csv_path):
+    """Diff net entre l'ancre d'une période et le nouvel instantané, composé des diffs hebdo archivés.
+
+    Returns:
+        (ajoutés, supprimés, modifiés), None si une comparaison complète avec l'ancre est nécessaire :
+        chaîne de diffs incomplète, ou identité dupliquée dans un diff (les paires multiples d'une
+        même identité ne se composent pas exactement)
+    """
+    delta_paths = deltas_anfr.delta_chain(anchor_path, current_csv_path)
+    if delta_paths is None:
+        functions_anfr.log_message(f"Chaîne de diffs hebdomadaires incomplète entre {os.path.basename(anchor_path)} "
+                                   f"et {os.path.basename(current_csv_path)}.", "WARN")
+        return None
+    with report_anfr.step("compare.compose_deltas") as record:
+        deltas = [deltas_anfr.read_delta(path) for path in delta_paths]
+        record['rows_in'] = sum(len(df) for df in deltas)
+        if any(pd.Series(functions_anfr.fingerprint(df, ID_COLUMNS)).duplicated().any() for df in deltas if not df.empty):
+            functions_anfr.log_message("Identités dupliquées dans les diffs hebdomadaires, composition impossible.", "WARN")
+            return None
+        diff = compose_diffs(deltas)
+        record['rows_out'] = sum(len(df) for df in diff)
+    functions_anfr.log_message(f"Diff net composé de {len(delta_paths)} diff(s) hebdomadaire(s).")
+    return diff
+
+def archive_weekly_delta(old_csv_path, new_csv_path, diff, df_dates):
+    """Archive le diff d'une MAJ hebdo (avec ses changements de date seuls) et supprime ceux qui
+    précèdent l'ancre du mois et du trimestre précédents."""
+    if any(df is None or df.empty for df in diff):
+        return
+    deltas_anfr.archive_delta(old_csv_path, new_csv_path, (*diff, df_dates))
+    dir_path = os.path.dirname(new_csv_path)
+    catalog = catalog_anfr.SnapshotCatalog()
+    anchors = [catalog.anchor(dir_path, os.path.splitext(get_previous_period_filename(period))[0])
+               for period in ("mensu", "trim")]
+    # Tant qu'une période n'a pas d'ancre (copie complète encore utilisée), rien n'est supprimé
+    if None not in anchors:
+        deltas_anfr.prune_deltas(min(anchors))
+
 def main(no_file_update, no_download, no_compare, no_write,
          old_csv_name, new_csv_name, timestamp_a,
-         debug, update_type):
+         debug, update_type, downloaded_csv_name=None, diff_engine="hash", max_memory=None,
+         csv_debug=False, canonical_check=False):
 
     path_app = os.path.dirname(os.path.abspath(__file__))
     download_path = os.path.join(path_app, 'files', 'from_anfr')
 
-    url = (
-        "https://data.anfr.fr/d4c/api/records/2.0/downloadfile/"
-        "format=csv&resource_id=88ef0887-6b0f-4d3f-8545-6d64c8f597da"
-        "&use_labels_for_header=true"
-    )
+    url = ANFR_URL
 
     # Initialisation
     curr_csv_path = None
     old_csv_path = None
     current_csv_path = None
     timestamp = None
+    composed = None
+    df_dates = None
 
     # ==========================
     # MODE FORÇAGE COMPLET
@@ -299,24 +590,30 @@ def main(no_file_update, no_download, no_compare, no_write,
         # ==========================
         # TELECHARGEMENT
         # ==========================
-        if not no_download:
-
-            filename_from_anfr = functions_anfr.get_filename_from_server(url)
+        if downloaded_csv_name:
 
-            download_path_r = os.path.join(
+            # Fichier déjà récupéré par determine_maj via le cache HTTP
+            curr_csv_path = os.path.join(
                 download_path,
-                filename_from_anfr
+                downloaded_csv_name
             )
 
             functions_anfr.log_message(
-                "Début du téléchargement du fichier de data.anfr.fr"
+                f"Fichier déjà téléchargé : {curr_csv_path}"
             )
 
-            curr_csv_path = download_data(
-                url,
-                download_path_r
+        elif not no_download:
+
+            functions_anfr.log_message(
+                "Début du téléchargement du fichier de data.anfr.fr"
             )
 
+            with report_anfr.step("compare.download"):
+                curr_csv_path = fetch_data(
+                    url,
+                    download_path
+                )
+
             functions_anfr.log_message(
                 "Téléchargement terminé"
             )
@@ -348,6 +645,21 @@ def main(no_file_update, no_download, no_compare, no_write,
                     f"{current_csv_path}"
                 )
 
+                functions_anfr.prune_columnar_cache(download_path)
+
+                # Période sans copie complète : diff net des diffs hebdo archivés depuis son ancre,
+                # sinon comparaison complète avec l'instantané d'ancre
+                if anchored_reference(update_type, old_csv_path) and not no_compare:
+                    composed = compose_period_diff(old_csv_path, current_csv_path)
+                    if composed is None and not os.path.exists(old_csv_path):
+                        functions_anfr.log_message(
+                            f"Instantané d'ancre {os.path.basename(old_csv_path)} absent : "
+                            f"aucune comparaison possible.", "FATAL")
+                        raise SystemExit(1)
+                    if composed is None:
+                        functions_anfr.log_message(
+                            f"Comparaison complète avec l'instantané d'ancre {os.path.basename(old_csv_path)}.", "WARN")
+
         else:
 
             current_csv_path = curr_csv_path
@@ -360,67 +672,79 @@ def main(no_file_update, no_download, no_compare, no_write,
                 "ERROR"
             )
 
+    # Contenu identique à la référence ou à une MAJ déjà ignorée : arrêt avant tout chargement
+    if curr_csv_path and old_csv_path and not no_compare and not no_write:
+        with report_anfr.step("compare.fingerprint_check"):
+            match = functions_anfr.matching_snapshot(curr_csv_path, [old_csv_path], canonical=canonical_check)
+        if match:
+            abort_empty_update(path_app, curr_csv_path, f"Contenu identique à {match}.")
+
+    # Conversion colonnaire à l'arrivée, une seule fois par contenu (charge tout le CSV : pas en mode hors mémoire)
+    if curr_csv_path and not (old_csv_name and new_csv_name) and not no_compare and not max_memory:
+        try:
+            with report_anfr.step("compare.ingest_snapshot"):
+                functions_anfr.ingest_snapshot(curr_csv_path)
+        except Exception as e:
+            functions_anfr.log_message(f"Conversion colonnaire impossible pour '{curr_csv_path}' - {e}", "WARN")
+
     start_time = time.time()
+    snapshots = None
 
     if not no_compare:
         functions_anfr.log_message(f"Début de la comparaison entre {old_csv_path} & {current_csv_path}")
-        df_old = load_and_process_csv(old_csv_path)
-        if debug:
-            functions_anfr.log_message("Ancien CSV chargé", "DEBUG")
-        df_current = load_and_process_csv(current_csv_path)
-        if debug:
-            functions_anfr.log_message("Nouveau CSV chargé", "DEBUG")
-        df_added, df_removed, df_modified = compare_data(df_old, df_current)
+        if composed is not None:
+            df_current = load_and_process_csv(current_csv_path, step_name="compare.load_new")
+            df_added, df_removed, df_modified = composed
+            snapshots = (deltas_anfr.reference_snapshot(df_current, df_added, df_removed, df_modified), df_current)
+        elif max_memory:
+            try:
+                with report_anfr.step("compare.compare_partitioned") as record:
+                    df_added, df_removed, df_modified, df_dates = compare_partitioned(
+                        old_csv_path, current_csv_path, max_memory,
+                        engine=diff_engine, spill_root=os.path.join(path_app, 'files'), with_dates=True
+                    )
+                    record['rows_out'] = sum(report_anfr.rows(df) or 0 for df in (df_added, df_removed, df_modified))
+            except FileNotFoundError as e:
+                functions_anfr.log_message(f"Fichier introuvable - {e}", "FATAL")
+                raise SystemExit(1)
+            except pd.errors.ParserError as e:
+                functions_anfr.log_message(f"Erreur lors de l'analyse d'un fichier CSV - {e}", "FATAL")
+                raise SystemExit(1)
+        else:
+            # Les deux instantanés sont chargés en même temps, les cœurs partagés entre eux
+            workers = max(1, (os.cpu_count() or 1) // 2)
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                future_old = pool.submit(load_and_process_csv, old_csv_path, workers, "compare.load_old")
+                future_current = pool.submit(load_and_process_csv, current_csv_path, workers, "compare.load_new")
+                df_old = future_old.result()
+                if debug:
+                    functions_anfr.log_message("Ancien CSV chargé", "DEBUG")
+                df_current = future_current.result()
+                if debug:
+                    functions_anfr.log_message("Nouveau CSV chargé", "DEBUG")
+            # Colonnes à faible cardinalité en Categorical aux catégories communes aux deux instantanés
+            if df_old is not None and df_current is not None:
+                df_old, df_current = schema_anfr.to_categorical([df_old, df_current])
+            with report_anfr.step("compare.compare_data",
+                                  rows_in=(report_anfr.rows(df_old) or 0) + (report_anfr.rows(df_current) or 0)) as record:
+                df_added, df_removed, df_modified, df_dates = compare_data(df_old, df_current, engine=diff_engine,
+                                                                           with_dates=True)
+                record['rows_out'] = sum(report_anfr.rows(df) or 0 for df in (df_added, df_removed, df_modified))
+            snapshots = (df_old, df_current)
         functions_anfr.log_message("Comparaison terminée")
     else:
         df_added, df_removed, df_modified = None, None, None
         functions_anfr.log_message("Comparaison sautée : demandé par argument", "WARN")
 
     if not no_write:
-        functions_anfr.log_message("Début écriture des résultats")
-        string_sms = ""
-        if df_removed is not None and not df_removed.empty:
-            if debug:
-                functions_anfr.log_message("Début écriture résultats df_removed", "DEBUG")
-            result = write_results(df_removed, os.path.join(path_app, 'files', 'compared', 'comp_removed.csv'), "Lignes supprimées : ")
-            if result:
-                string_sms += result
-        if df_modified is not None and not df_modified.empty:
-            if debug:
-                functions_anfr.log_message("Début écriture résultats df_modified", "DEBUG")
-            result = write_results(df_modified, os.path.join(path_app, 'files', 'compared', 'comp_modified.csv'), "Lignes modifiées : ")
-            if result:
-                string_sms += " " + result
-        if df_added is not None and not df_added.empty:
-            if debug:
-                functions_anfr.log_message("Début écriture résultats df_added", "DEBUG")
-            result = write_results(df_added, os.path.join(path_app, 'files', 'compared', 'comp_added.csv'), "Nouvelles lignes : ")
-            if result:
-                string_sms += " " + result
-        functions_anfr.log_message("Ecriture des résultats terminée")
+        string_sms = write_diffs(df_added, df_removed, df_modified, os.path.join(path_app, 'files', 'compared'),
+                                 csv_debug, debug)
         if any(x is not None and x.empty for x in (df_removed, df_modified, df_added)):
-            functions_anfr.log_message("MAJ ANFR vide, fin du programme", "FATAL")
-
-            # Ajouter le nom du fichier courant à ignores.txt
-            if curr_csv_path:
-                with open(os.path.join(path_app, 'files', 'ignores.txt'), "a", encoding="utf-8") as f:
-                    f.write(os.path.basename(curr_csv_path) + "\n")
-
-            # Envoyer les SMS
-            functions_anfr.send_sms(string_sms, "INFO")
-            functions_anfr.send_sms("MAJ vide... (sûr au moins 1 df)", "FATAL")
-
-            # Supprimer le fichier de la MAJ vide
-            try:
-                if curr_csv_path:
-                    os.remove(curr_csv_path)
-                    functions_anfr.log_message(f"Fichier supprimé : {curr_csv_path}", "INFO")
-            except Exception as e:
-                functions_anfr.log_message(f"Erreur lors de la suppression du fichier : {e}", "ERROR")
-
-            raise SystemExit(1)
+            abort_empty_update(path_app, curr_csv_path, string_sms)
         else:
             functions_anfr.send_sms(string_sms, "INFO")
+            if update_type == "hebdo":
+                archive_weekly_delta(old_csv_path, current_csv_path, (df_added, df_removed, df_modified), df_dates)
 
     else:
         functions_anfr.log_message("Ecriture des résultats sautée : demandé par argument", "WARN")
@@ -438,6 +762,168 @@ def main(no_file_update, no_download, no_compare, no_write,
     duration = end_time - start_time
     functions_anfr.log_message(f"La comparaison est terminée et a pris {time.strftime('%H:%M:%S', time.gmtime(duration))} à se faire.")
 
+    # Ce que pretrait.main relirait sinon depuis files/compared (mode in-process de core.py)
+    return {
+        'timestamp': str(timestamp),
+        'old_csv_path': str(old_csv_path),
+        'new_csv_path': str(current_csv_path),
+        'snapshots': snapshots,
+        'diffs': None if any(df is None for df in (df_added, df_modified, df_removed)) else {
+            'comp_added.csv': df_added,
+            'comp_modified.csv': df_modified,
+            'comp_removed.csv': df_removed
+        }
+    }
+
+
+def main_periods(periods, no_download=False, downloaded_csv_name=None, diff_engine="hash",
+                 csv_debug=False, canonical_check=False, debug=False):
+    """Mode multi-périodes (core.py --with-periods) : un seul chargement du nouvel instantané.
+
+    Chaque période garde sa référence (csv_files_update) ; tous les instantanés sont chargés
+    ensemble avec des Categorical communs, puis les diffs sont calculés en parallèle. Une période
+    sans copie complète compose ensuite les diffs hebdo archivés, dont celui de cette exécution.
+    La première période est la principale : une MAJ vide l'arrête comme en mode simple.
+    Les résultats des autres périodes sont écrits dans files/compared/<période>, et une période
+    sans changement est simplement écartée.
+
+    Returns:
+        Dict pour pretrait.main_periods : timestamp, new_csv_path, snapshot_new et, par période
+        retenue, old_csv_path, snapshot_old et diffs
+    """
+    path_app = os.path.dirname(os.path.abspath(__file__))
+    download_path = os.path.join(path_app, 'files', 'from_anfr')
+    compared_path = os.path.join(path_app, 'files', 'compared')
+    primary = periods[0]
+
+    if downloaded_csv_name:
+        curr_csv_path = os.path.join(download_path, downloaded_csv_name)
+        functions_anfr.log_message(f"Fichier déjà téléchargé : {curr_csv_path}")
+    elif not no_download:
+        functions_anfr.log_message("Début du téléchargement du fichier de data.anfr.fr")
+        with report_anfr.step("compare.download"):
+            curr_csv_path = fetch_data(ANFR_URL, download_path)
+        functions_anfr.log_message("Téléchargement terminé")
+    else:
+        functions_anfr.log_message("Mode multi-périodes : aucun fichier à comparer sans téléchargement.", "FATAL")
+        raise SystemExit(1)
+
+    # Références de toutes les périodes (et leurs suppressions) avant de charger quoi que ce soit
+    references = {}
+    for period in periods:
+        try:
+            references[period], _, timestamp = csv_files_update(curr_csv_path, period)
+        except FileNotFoundError as e:
+            if period == primary:
+                functions_anfr.log_message(f"{period} : {e}", "FATAL")
+                raise SystemExit(1)
+            functions_anfr.log_message(f"{period} : {e} Période écartée.", "WARN")
+            continue
+        functions_anfr.log_message(f"{period} : comparaison entre {references[period]} et {curr_csv_path}")
+    functions_anfr.prune_columnar_cache(download_path)
+
+    with report_anfr.step("compare.fingerprint_check"):
+        match = functions_anfr.matching_snapshot(curr_csv_path, [references[primary]], canonical=canonical_check)
+    if match:
+        abort_empty_update(path_app, curr_csv_path, f"Contenu identique à {match}.")
+    try:
+        with report_anfr.step("compare.ingest_snapshot"):
+            functions_anfr.ingest_snapshot(curr_csv_path)
+    except Exception as e:
+        functions_anfr.log_message(f"Conversion colonnaire impossible pour '{curr_csv_path}' - {e}", "WARN")
+
+    start_time = time.time()
+    # Une période ancrée compose d'abord les diffs hebdo archivés (dont celui de cette exécution) ;
+    # une référence partagée par deux périodes n'est chargée qu'une fois
+    direct = [period for period in references if not anchored_reference(period, references[period])]
+    paths = list(dict.fromkeys([curr_csv_path, *(references[period] for period in direct)]))
+    try:
+        with report_anfr.step("compare.load_snapshots") as record:
+            frames = dict(zip(paths, functions_anfr.load_snapshots(paths)))
+            record['rows_out'] = sum(len(df) for df in frames.values())
+    except FileNotFoundError as e:
+        functions_anfr.log_message(f"Fichier introuvable - {e}", "FATAL")
+        raise SystemExit(1)
+    except pd.errors.ParserError as e:
+        functions_anfr.log_message(f"Erreur lors de l'analyse d'un fichier CSV - {e}", "FATAL")
+        raise SystemExit(1)
+    df_current = frames[curr_csv_path]
+
+    def diff_period(period):
+        df_old = frames[references[period]]
+        with report_anfr.step(f"compare.compare_data_{period}", rows_in=len(df_old) + len(df_current)) as record:
+            *diff, df_dates = compare_data(df_old, df_current, engine=diff_engine, with_dates=True)
+            record['rows_out'] = sum(report_anfr.rows(df) or 0 for df in diff)
+        return tuple(diff), df_dates
+
+    computed, olds = {}, {period: frames[references[period]] for period in direct}
+    if direct:
+        with ThreadPoolExecutor(max_workers=len(direct)) as pool:
+            computed = dict(zip(direct, pool.map(diff_period, direct)))
+    diffs = {period: diff for period, (diff, _) in computed.items()}
+    if "hebdo" in computed:
+        archive_weekly_delta(references["hebdo"], curr_csv_path, *computed["hebdo"])
+    for period in [period for period in references if period not in diffs]:
+        composed = compose_period_diff(references[period], curr_csv_path)
+        if composed is not None:
+            diffs[period] = composed
+            olds[period] = deltas_anfr.reference_snapshot(df_current, *composed)
+        elif os.path.exists(references[period]):
+            functions_anfr.log_message(
+                f"{period} : comparaison complète avec l'instantané d'ancre {os.path.basename(references[period])}.", "WARN")
+            # Chargée à part, l'ancre n'a pas les catégories communes : comparaison sur le texte
+            df_old = load_and_process_csv(references[period], step_name=f"compare.load_anchor_{period}")
+            with report_anfr.step(f"compare.compare_data_{period}") as record:
+                *diff, _ = compare_data(df_old, schema_anfr.to_plain(df_current), engine=diff_engine, with_dates=True)
+                record['rows_out'] = sum(report_anfr.rows(df) or 0 for df in diff)
+            diffs[period], olds[period] = tuple(diff), df_old
+        else:
+            message = f"{period} : instantané d'ancre {os.path.basename(references[period])} absent, aucune comparaison possible."
+            if period == primary:
+                functions_anfr.log_message(message, "FATAL")
+                raise SystemExit(1)
+            functions_anfr.log_message(f"{message} Période écartée.", "WARN")
+    functions_anfr.log_message("Comparaison terminée")
+
+    results = {}
+    for period in [period for period in references if period in diffs]:
+        df_added, df_removed, df_modified = diffs[period]
+        period_dir = compared_path if period == primary else os.path.join(compared_path, period)
+        os.makedirs(period_dir, exist_ok=True)
+        string_sms = write_diffs(df_added, df_removed, df_modified, period_dir, csv_debug, debug)
+        if any(x is not None and x.empty for x in (df_removed, df_modified, df_added)):
+            if period == primary:
+                abort_empty_update(path_app, curr_csv_path, string_sms)
+            functions_anfr.log_message(f"{period} : MAJ vide, période écartée.", "WARN")
+            continue
+        functions_anfr.send_sms(f"{period} : {string_sms}", "INFO")
+        results[period] = {
+            'old_csv_path': references[period],
+            'snapshot_old': olds[period],
+            'diffs': {
+                'comp_added.csv': df_added,
+                'comp_modified.csv': df_modified,
+                'comp_removed.csv': df_removed
+            }
+        }
+
+    with open(os.path.join(compared_path, 'timestamp.txt'), 'w', encoding="utf-8") as f1:
+        f1.write(str(timestamp) + "\n")
+        f1.write(str(references[primary]) + "\n")
+        f1.write(str(curr_csv_path))
+    with open(os.path.join(path_app, 'files', 'pretraite', 'timestamp.txt'), 'w', encoding="utf-8") as f2:
+        f2.write(str(timestamp))
+
+    duration = time.time() - start_time
+    functions_anfr.log_message(f"Les comparaisons ({', '.join(results)}) sont terminées et ont pris "
+                               f"{time.strftime('%H:%M:%S', time.gmtime(duration))} à se faire.")
+    return {
+        'timestamp': str(timestamp),
+        'new_csv_path': str(curr_csv_path),
+        'snapshot_new': df_current,
+        'periods': results
+    }
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Control which functions to skip.")
     parser.add_argument('--no-file-update', action='store_true')
@@ -447,18 +933,30 @@ if __name__ == "__main__":
     parser.add_argument('--old-csv-name', type=str, help="Nom de l'ancien fichier CSV avec lequel faire la MAJ")
     parser.add_argument('--new-csv-name', type=str, help="Nom du nouveau fichier CSV avec lequel faire la MAJ, préciser --timestamp SVP")
     parser.add_argument('--timestamp', type=str, help="Timestamp à donner à la MAJ")
+    parser.add_argument('--downloaded-csv-name', type=str, help="Nom du fichier déjà téléchargé dans files/from_anfr (par determine_maj)")
+    parser.add_argument('--diff-engine', choices=DIFF_ENGINES, default="hash", help="Moteur de comparaison : empreintes (hash) ou jointure externe historique (merge)")
+    parser.add_argument('--max-memory', type=parse_memory_size, help="Budget mémoire (ex. 2G, 512M) : comparaison par partitions sur disque")
+    parser.add_argument('--csv-debug', action='store_true', help="Écrire aussi les résultats comp_*.csv (débogage)")
+    parser.add_argument('--canonical-check', action='store_true', help="Détecter aussi une MAJ vide aux lignes seulement réordonnées (tri de toutes les lignes)")
     parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--profile', action='store_true', help="Profiler l'étape (cProfile, tracemalloc) : fichiers à côté du rapport d'exécution")
     parser.add_argument('update_type', choices=["hebdo", "mensu", "trim"])
     args = parser.parse_args()
 
-    main(
-        no_file_update=args.no_file_update,
-        no_download=args.no_download,
-        no_compare=args.no_compare,
-        no_write=args.no_write,
-        old_csv_name=args.old_csv_name,
-        new_csv_name=args.new_csv_name,
-        timestamp_a=args.timestamp,
-        debug=args.debug,
-        update_type=args.update_type
-    )
\ No newline at end of file
+    with report_anfr.profiled("compare", args.profile):
+        main(
+            no_file_update=args.no_file_update,
+            no_download=args.no_download,
+            no_compare=args.no_compare,
+            no_write=args.no_write,
+            old_csv_name=args.old_csv_name,
+            new_csv_name=args.new_csv_name,
+            timestamp_a=args.timestamp,
+            debug=args.debug,
+            update_type=args.update_type,
+            downloaded_csv_name=args.downloaded_csv_name,
+            diff_engine=args.diff_engine,
+            max_memory=args.max_memory,
+            csv_debug=args.csv_debug,
+            canonical_check=args.canonical_check
+        )
\ No newline at end of file
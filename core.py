@@ -5,11 +5,13 @@ import sys
 import os
 from pathlib import Path
 import functions_anfr
+import report_anfr
 
 def run_script(script_name, *args):
     """Exécute un script Python avec des arguments optionnels."""
     try:
-        result = subprocess.run([sys.executable, script_name, *args], check=True)
+        with report_anfr.step(f"core.{Path(script_name).stem}"):
+            result = subprocess.run([sys.executable, script_name, *args], check=True)
         return result.returncode
     except subprocess.CalledProcessError as e:
         functions_anfr.log_message(f"Le script {script_name} a échoué avec le code de retour {e.returncode}. Erreur: {e}", "FATAL")
@@ -19,8 +21,134 @@ def run_script(script_name, *args):
         functions_anfr.log_message(f"Une erreur inattendue est survenue lors de l'exécution de {script_name}: {e}", "FATAL")
         sys.exit(1)
 
+def run_stage(stage_name, func, *args, profile=False, **kwargs):
+    """Exécute une étape dans le processus courant, avec les mêmes alertes que run_script (profilée si profile)."""
+    try:
+        with report_anfr.step(f"core.{stage_name}"), report_anfr.profiled(stage_name, profile):
+            return func(*args, **kwargs)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+        if code:
+            functions_anfr.log_message(f"L'étape {stage_name} a échoué avec le code de retour {code}.", "FATAL")
+            functions_anfr.send_sms(f"{stage_name} - code {code}", "FATAL")
+            sys.exit(code)
+        return None
+    except Exception as e:
+        functions_anfr.log_message(f"Une erreur inattendue est survenue lors de l'étape {stage_name}: {e}", "FATAL")
+        functions_anfr.send_sms(f"{stage_name} - {e}", "FATAL")
+        sys.exit(1)
+
+def run_in_process(args):
+    """Enchaîne les étapes dans ce processus : instantanés et résultats passent en mémoire.
+
+    compare.py écrit toujours ses fichiers, mais pretrait.py, historique.py et github.py
+    reçoivent directement ce qu'ils reliraient sinon depuis files/compared.
+    """
+    import compare
+    import pretrait
+
+    handover = {}
+    if not args.skip_compare:
+        functions_anfr.log_message("Exécution de la comparaison des données (compare.main)")
+        handover = run_stage(
+            "compare", compare.main,
+            profile=args.profile,
+            no_file_update=args.no_file_update,
+            no_download=args.no_download,
+            no_compare=args.no_compare,
+            no_write=args.no_write,
+            old_csv_name=args.old_csv_name,
+            new_csv_name=args.new_csv_name,
+            timestamp_a=args.timestamp,
+            debug=args.debug,
+            update_type=args.update_type,
+            downloaded_csv_name=args.downloaded_csv_name,
+            diff_engine=args.diff_engine or "hash",
+            max_memory=compare.parse_memory_size(args.max_memory) if args.max_memory else None,
+            csv_debug=args.csv_debug,
+            canonical_check=args.canonical_check
+        ) or {}
+
+    if not args.skip_pretrait:
+        functions_anfr.log_message("Exécution du prétraitement des données (pretrait.main)")
+        run_stage(
+            "pretrait", pretrait.main,
+            profile=args.profile,
+            no_insee=args.no_insee,
+            no_process=args.no_process,
+            debug=args.debug,
+            update_type=args.update_type,
+            **handover
+        )
+    # Les frames ne servent plus : on libère la mémoire avant les étapes suivantes
+    timestamp, new_csv_path = handover.get('timestamp'), handover.get('new_csv_path')
+    handover.clear()
+
+    if not args.skip_histo:
+        import historique
+        functions_anfr.log_message("Exécution de la MAJ de l'historique (historique.main)")
+        run_stage("historique", historique.main, args.update_type, timestamp, new_csv_path, profile=args.profile)
+
+    if not args.skip_github:
+        import github
+        functions_anfr.log_message("Push vers GitHub (github.main)")
+        run_stage("github", github.main, args.update_type, timestamp, profile=args.profile)
+
+def run_periods(args, periods):
+    """Mode multi-périodes : une seule passe, dans ce processus, pour plusieurs types de MAJ.
+
+    Le nouvel instantané est chargé une fois et comparé en parallèle à la référence de chaque
+    période ; le prétraitement partage les index du nouvel instantané, puis historique et
+    publication GitHub traitent toutes les périodes retenues en une fois.
+    """
+    import compare
+    import pretrait
+
+    handover = {}
+    if not args.skip_compare:
+        functions_anfr.log_message(f"Exécution des comparaisons {', '.join(periods)} (compare.main_periods)")
+        handover = run_stage(
+            "compare", compare.main_periods, periods,
+            profile=args.profile,
+            no_download=args.no_download,
+            downloaded_csv_name=args.downloaded_csv_name,
+            diff_engine=args.diff_engine or "hash",
+            csv_debug=args.csv_debug,
+            canonical_check=args.canonical_check,
+            debug=args.debug
+        ) or {}
+
+    if not args.skip_pretrait:
+        functions_anfr.log_message("Exécution des prétraitements (pretrait.main_periods)")
+        run_stage("pretrait", pretrait.main_periods, args.no_insee, args.no_process, args.debug,
+                  profile=args.profile, **handover)
+    # Périodes sans changement écartées par compare.main_periods
+    published = list(handover.get('periods') or periods)
+    timestamp, new_csv_path = handover.get('timestamp'), handover.get('new_csv_path')
+    handover.clear()
+
+    if not args.skip_histo:
+        import historique
+        functions_anfr.log_message("Exécution de la MAJ de l'historique (historique.main_periods)")
+        run_stage("historique", historique.main_periods, published, timestamp, new_csv_path, profile=args.profile)
+
+    if not args.skip_github:
+        import github
+        functions_anfr.log_message("Push vers GitHub (github.main_periods)")
+        run_stage("github", github.main_periods, published, timestamp, profile=args.profile)
+
 def main(args):
-    """Fonction principale pour orchestrer l'exécution des différents scripts."""
+    """Fonction principale : exécution complète, mesurée dans un rapport JSON (files/reports)."""
+    report_anfr.begin_run(args.update_type, {k: v for k, v in vars(args).items() if k != 'update_type'})
+    status = "error"
+    try:
+        run_pipeline(args)
+        status = "ok"
+    finally:
+        report_anfr.end_run(status)
+
+def run_pipeline(args):
+    """Orchestre l'exécution des différents scripts."""
     # Spécifie les chemins des fichiers
     path_app = Path(__file__).resolve().parent
     repo_dir = path_app.parent / "fraetech.github.io"
@@ -34,6 +162,15 @@ def main(args):
     subprocess.run(['git', '-C', str(repo_dir), 'clean', '-fd'], check=True)
     subprocess.run(['git', '-C', str(repo_dir), 'pull', '--rebase'], check=True)
 
+    periods = list(dict.fromkeys([args.update_type, *(args.with_periods or [])]))
+    if len(periods) > 1:
+        run_periods(args, periods)
+        return
+
+    if args.in_process:
+        run_in_process(args)
+        return
+
     if not args.skip_compare:
         functions_anfr.log_message("Exécution de la comparaison des données avec compare.py")
         compare_args = []
@@ -52,8 +189,20 @@ def main(args):
             compare_args.append(f'--new-csv-name={args.new_csv_name}')
         if args.timestamp:
             compare_args.append(f'--timestamp={args.timestamp}')
+        if args.downloaded_csv_name:
+            compare_args.append(f'--downloaded-csv-name={args.downloaded_csv_name}')
+        if args.diff_engine:
+            compare_args.append(f'--diff-engine={args.diff_engine}')
+        if args.max_memory:
+            compare_args.append(f'--max-memory={args.max_memory}')
+        if args.csv_debug:
+            compare_args.append('--csv-debug')
+        if args.canonical_check:
+            compare_args.append('--canonical-check')
         if args.debug:
             compare_args.append('--debug')
+        if args.profile:
+            compare_args.append('--profile')
 
         run_script(path_compare, *compare_args)
 
@@ -67,6 +216,8 @@ def main(args):
             pretrait_args.append('--no-process')
         if args.debug:
             pretrait_args.append('--debug')
+        if args.profile:
+            pretrait_args.append('--profile')
 
         run_script(path_pretrait, *pretrait_args)
     
@@ -76,6 +227,8 @@ def main(args):
         historique_args.append(args.update_type)
         if args.debug:
             historique_args.append('--debug')
+        if args.profile:
+            historique_args.append('--profile')
         
         run_script(path_historique, *historique_args)
 
@@ -85,6 +238,8 @@ def main(args):
         github_args.append(args.update_type)
         if args.debug:
             github_args.append('--debug')
+        if args.profile:
+            github_args.append('--profile')
 
         run_script(path_github, *github_args)
 
@@ -100,6 +255,9 @@ if __name__ == "__main__":
     parser.add_argument('--skip-histo', action='store_true', help="Ne pas exécuter le script historique.py")
     parser.add_argument('--skip-github', action='store_true', help="Ne pas exécuter le script github.py")
     
+    parser.add_argument('--with-periods', nargs='+', choices=["hebdo", "mensu", "trim"],
+                        help="Autres types de MAJ traités dans la même passe (ex. hebdo --with-periods mensu trim) : un seul chargement, un seul push.")
+
     # Ajouter les arguments propres à compare.py
     parser.add_argument('--no-file-update', action='store_true', help="Ne pas mettre à jour les fichiers CSV dans compare.py.")
     parser.add_argument('--no-download', action='store_true', help="Ne pas télécharger les nouvelles données dans compare.py.")
@@ -108,6 +266,11 @@ if __name__ == "__main__":
     parser.add_argument('--old-csv-name', type=str, help="Nom de l'ancien fichier CSV avec lequel faire la MAJ")
     parser.add_argument('--new-csv-name', type=str, help="Nom du nouveau fichier CSV avec lequel faire la MAJ, préciser --timestamp SVP")
     parser.add_argument('--timestamp', type=str, help="Timestamp à donner à la MAJ")
+    parser.add_argument('--downloaded-csv-name', type=str, help="Fichier déjà téléchargé par determine_maj.py, compare.py ne le retélécharge pas")
+    parser.add_argument('--diff-engine', choices=["hash", "merge"], help="Moteur de comparaison de compare.py (hash par défaut, merge pour contrôle)")
+    parser.add_argument('--max-memory', type=str, help="Budget mémoire de compare.py (ex. 2G) : comparaison par partitions sur disque")
+    parser.add_argument('--csv-debug', action='store_true', help="compare.py écrit aussi les comp_*.csv en plus des fichiers Arrow.")
+    parser.add_argument('--canonical-check', action='store_true', help="compare.py détecte aussi une MAJ vide aux lignes réordonnées.")
 
     # Ajouter les arguments propres à pretrait.py
     parser.add_argument('--no-insee', action='store_true', help="Ne pas charger les données INSEE dans pretrait.py.")
@@ -116,8 +279,12 @@ if __name__ == "__main__":
     # Ajouter les arguments propres à github.py
     # ARGS ARGS ARGS
     
+    # Mode d'exécution : un processus par script (défaut, isolation) ou tout dans ce processus
+    parser.add_argument('--in-process', action='store_true', help="Enchaîner les étapes dans ce processus en passant les DataFrames en mémoire.")
+
     # Argument de débogage global
     parser.add_argument('--debug', action='store_true', help="Afficher les messages de debug pour tous les scripts.")
+    parser.add_argument('--profile', action='store_true', help="Profiler chaque étape (cProfile, tracemalloc) : .prof et allocations à côté du rapport d'exécution.")
 
     args = parser.parse_args()
     main(args)
\ No newline at end of file
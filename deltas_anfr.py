@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Archive des diffs hebdomadaires (files/deltas) et reconstitution d'une référence depuis un diff net.
+
+Chaque MAJ hebdo y laisse ses lignes ajoutées, supprimées et modifiées, ainsi que celles dont
+seule la date_activ a changé (un CSV par paire d'instantanés, nommé <ancien>__<nouveau>.csv).
+Une MAJ mensuelle ou trimestrielle enchaîne les diffs depuis l'instantané de début de période
+(ancre, catalog_anfr) jusqu'à l'instantané courant et les compose (compare.compose_diffs) au lieu
+de recopier puis relire un instantané complet MM_AAAA.csv / TX_AAAA.csv. L'instantané d'ancre reste
+dans files/from_anfr : si la chaîne est rompue, compare.py le compare en entier.
+"""
+import os
+import pandas as pd
+import functions_anfr
+import catalog_anfr
+import schema_anfr
+
+DELTAS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "deltas")
+# Séparateur ancien/nouveau dans le nom d'un diff (absent des noms d'instantanés ANFR)
+LINK_SEPARATOR = "__"
+DELTA_SUFFIX = ".csv"
+
+# Colonnes des résultats de compare.py : identité, puis états avant (_old) et après (_last)
+ID_COLUMNS = functions_anfr.IDENTITY_COLUMNS
+PAYLOAD_COLUMNS = functions_anfr.PAYLOAD_COLUMNS
+
+
+def _stem(file_path: str) -> str:
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def delta_path(old_csv_path: str, new_csv_path: str, deltas_dir: str = DELTAS_DIR) -> str:
+    """Chemin du diff entre deux instantanés de files/from_anfr."""
+    return os.path.join(deltas_dir, f"{_stem(old_csv_path)}{LINK_SEPARATOR}{_stem(new_csv_path)}{DELTA_SUFFIX}")
+
+
+def archive_delta(old_csv_path: str, new_csv_path: str, diff: tuple, deltas_dir: str = DELTAS_DIR) -> str:
+    """Archive les résultats d'une MAJ hebdo (ajoutés, supprimés, modifiés, dates seules) dans un seul CSV.
+
+    Les ensembles ont les mêmes colonnes et sont disjoints : l'état avant/après de chaque ligne
+    suffit à les distinguer à la relecture.
+    """
+    path = delta_path(old_csv_path, new_csv_path, deltas_dir)
+    rows = pd.concat([df for df in diff if df is not None and not df.empty], ignore_index=True)
+    os.makedirs(deltas_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    rows.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    functions_anfr.log_message(f"Diff hebdomadaire archivé : {os.path.basename(path)} ({len(rows):,} lignes).")
+    return path
+
+
+def read_delta(path: str) -> pd.DataFrame:
+    """Relit un diff archivé, tout en texte (seule la chaîne vide est un manquant, comme dans les résultats)."""
+    return pd.read_csv(path, dtype=str, keep_default_na=False, na_values=[''])
+
+
+def _links(deltas_dir: str) -> dict:
+    """Nouvel instantané -> anciens instantanés depuis lesquels un diff archivé y mène (noms sans extension)."""
+    links = {}
+    if not os.path.isdir(deltas_dir):
+        return links
+    for fichier in os.listdir(deltas_dir):
+        old, sep, new = fichier.removesuffix(DELTA_SUFFIX).partition(LINK_SEPARATOR)
+        if fichier.endswith(DELTA_SUFFIX) and sep:
+            links.setdefault(new, []).append(old)
+    return links
+
+
+def delta_chain(start_name: str, end_name: str, deltas_dir: str = DELTAS_DIR) -> list:
+    """Diffs archivés menant de l'instantané start_name à end_name, du plus ancien au plus récent.
+
+    Les noms commencent par l'horodatage ANFR : on remonte depuis end_name en essayant d'abord
+    la référence la plus récente, sans jamais passer avant start_name.
+
+    Returns:
+        Liste des chemins (vide si start_name == end_name), None si la chaîne est incomplète
+    """
+    start, end = _stem(start_name), _stem(end_name)
+    links = _links(deltas_dir)
+    seen = set()
+
+    def walk(node):
+        if node == start:
+            return []
+        for old in sorted(links.get(node, []), reverse=True):
+            if old < start or old in seen:
+                continue
+            seen.add(old)
+            chain = walk(old)
+            if chain is not None:
+                return chain + [os.path.join(deltas_dir, f"{old}{LINK_SEPARATOR}{node}{DELTA_SUFFIX}")]
+        return None
+
+    return walk(end)
+
+
+def prune_deltas(keep_from: str, deltas_dir: str = DELTAS_DIR) -> None:
+    """Supprime les diffs arrivant à un instantané antérieur ou égal à keep_from (plus aucune chaîne n'en part)."""
+    limit = catalog_anfr.anfr_timestamp(os.path.basename(keep_from))
+    if limit is None or not os.path.isdir(deltas_dir):
+        return
+    for fichier in os.listdir(deltas_dir):
+        _, sep, new = fichier.removesuffix(DELTA_SUFFIX).partition(LINK_SEPARATOR)
+        new_ts = catalog_anfr.anfr_timestamp(new) if sep else None
+        if new_ts is not None and new_ts <= limit:
+            os.remove(os.path.join(deltas_dir, fichier))
+            functions_anfr.log_message(f"Diff hebdomadaire supprimé : {fichier}")
+
+
+def read_compared(compared_dir: str) -> tuple:
+    """Résultats bruts (ajoutés, supprimés, modifiés) écrits par compare.py : Arrow si présent, sinon CSV."""
+    frames = []
+    for name in ('comp_added.csv', 'comp_removed.csv', 'comp_modified.csv'):
+        csv_path = os.path.join(compared_dir, name)
+        arrow_path = functions_anfr.intermediate_path(csv_path)
+        if os.path.exists(arrow_path):
+            frames.append(functions_anfr.read_intermediate(arrow_path))
+        elif os.path.exists(csv_path):
+            frames.append(read_delta(csv_path))
+        else:
+            frames.append(pd.DataFrame())
+    return tuple(frames)
+
+
+def reference_snapshot(df_current: pd.DataFrame, df_added: pd.DataFrame, df_removed: pd.DataFrame,
+                       df_modified: pd.DataFrame) -> pd.DataFrame:
+    """Reconstitue l'instantané de référence d'un diff : le courant, moins les ajouts, plus les
+    suppressions, avec l'ancien statut et l'ancienne date des lignes modifiées.
+
+    Écarts avec l'instantané complet, sans effet sur les index technologies et statuts de pretrait
+    (ensembles par support, sans date) :
+    - une date_activ changée seule hors "Projet approuvé" n'est pas dans le diff net et garde sa
+      valeur courante ;
+    - une identité dupliquée garde son nombre de lignes courant, et un diff qui en contiendrait
+      plusieurs états n'en appliquerait que le premier (compare.compose_period_diff se rabat alors
+      sur la comparaison complète).
+    """
+    columns = ID_COLUMNS + PAYLOAD_COLUMNS
+    old_columns = [f"{col}_old" for col in PAYLOAD_COLUMNS]
+    if 'empreinte_id' in df_current.columns:
+        current_key = pd.Series(df_current['empreinte_id'].to_numpy())
+    else:
+        current_key = pd.Series(functions_anfr.fingerprint(df_current, ID_COLUMNS))
+    reference = schema_anfr.to_plain(df_current[columns]).reset_index(drop=True)
+
+    if not df_added.empty:
+        reference = reference[~current_key.isin(functions_anfr.fingerprint(df_added, ID_COLUMNS)).to_numpy()]
+        current_key = current_key[reference.index]
+    if not df_modified.empty:
+        previous = pd.DataFrame(df_modified[old_columns].to_numpy(), columns=PAYLOAD_COLUMNS,
+                                index=functions_anfr.fingerprint(df_modified, ID_COLUMNS))
+        previous = previous[~previous.index.duplicated()]
+        changed = current_key.isin(previous.index).to_numpy()
+        reference = reference.copy()
+        reference.loc[changed, PAYLOAD_COLUMNS] = previous.loc[current_key[changed]].to_numpy()
+    if not df_removed.empty:
+        removed = df_removed[ID_COLUMNS + old_columns].set_axis(columns, axis=1)
+        reference = pd.concat([reference, removed], ignore_index=True)
+    return reference.reset_index(drop=True)
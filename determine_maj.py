@@ -6,10 +6,10 @@ import re
 import signal
 import functions_anfr
 
-def run_script(script_name):
+def run_script(script_name, *args):
     """Exécute un script Python avec des arguments optionnels."""
     try:
-        result = subprocess.run([sys.executable, script_name, "hebdo"], check=True)
+        result = subprocess.run([sys.executable, script_name, "hebdo", *args], check=True)
         return result.returncode
     except subprocess.CalledProcessError as e:
         functions_anfr.log_message(f"Le script {script_name} a échoué avec le code de retour {e.returncode}. Erreur: {e}", "ERROR")
@@ -30,36 +30,61 @@ def check_and_execute(url, path_app, script_to_execute, timeout=1200):
         signal.signal(signal.SIGALRM, timeout_handler)
         signal.alarm(timeout)  # Déclencher l'alarme pour le temps limite
 
-        # Récupérer le nom du fichier sur le serveur
-        filename = functions_anfr.get_filename_from_server(url)
-        local_csv_path = os.path.join(path_app, 'files', 'from_anfr', filename)
+        # GET conditionnel : un jeu de données inchangé ne coûte qu'un aller-retour 304
+        response, entry = functions_anfr.conditional_get(url)
+        if response is None:
+            functions_anfr.log_message(f"Données inchangées sur le serveur (304), dernier fichier : {entry.get('filename')}.")
+            signal.alarm(0)
+            return
 
-        # Définir le pattern à respecter
-        pattern = r'^\d{14}_observatoire(?:od)?(_2g)?(_3g)?(_4g)?(_5g)?(?:_\d{8})?\.csv$'
+        with response:
+            filename = functions_anfr.filename_from_response(response)
+            local_csv_path = os.path.join(path_app, 'files', 'from_anfr', filename)
 
-        # Vérifier si le nom du fichier respecte le pattern
-        if not re.match(pattern, filename):
-            functions_anfr.log_message(f"Le nom de fichier '{filename}' ne respecte pas le pattern requis.", "ERROR")
-            return  # Sortir de la fonction sans exécuter le script
-        
-        ignores_path = os.path.join(path_app, 'files', 'ignores.txt')
-        if os.path.exists(ignores_path):
-            with open(ignores_path, "r", encoding="utf-8") as f:
-                ignored_files = set(line.strip() for line in f if line.strip())
-            if filename in ignored_files:
-                functions_anfr.log_message(f"{filename} est listé dans ignores.txt, exécution annulée.", "WARN")
-                return
+            # Définir le pattern à respecter
+            pattern = r'^\d{14}_observatoire(?:od)?(_2g)?(_3g)?(_4g)?(_5g)?(?:_\d{8})?\.csv$'
 
-        # Vérifier si le fichier est déjà présent localement
-        if os.path.exists(local_csv_path):
-            functions_anfr.log_message(f"Le fichier {filename} est déjà présent. Aucun téléchargement nécessaire.")
-        else:
-            functions_anfr.log_message(f"Le fichier {filename} n'est pas présent. Exécution de {script_to_execute}...")
-            return_code = run_script(script_to_execute)
-            if return_code != 0:
-                functions_anfr.log_message(f"L'exécution de {script_to_execute} a échoué avec le code de retour {return_code}.", "ERROR")
+            # Vérifier si le nom du fichier respecte le pattern
+            if not re.match(pattern, filename):
+                functions_anfr.log_message(f"Le nom de fichier '{filename}' ne respecte pas le pattern requis.", "ERROR")
+                return  # Sortir de la fonction sans exécuter le script
+
+            ignores_path = os.path.join(path_app, 'files', 'ignores.txt')
+            if os.path.exists(ignores_path):
+                with open(ignores_path, "r", encoding="utf-8") as f:
+                    ignored_files = set(line.strip() for line in f if line.strip())
+                if filename in ignored_files:
+                    functions_anfr.log_message(f"{filename} est listé dans ignores.txt, exécution annulée.", "WARN")
+                    functions_anfr.update_http_cache(url, response, filename)
+                    return
+
+            # Vérifier si le fichier est déjà présent localement
+            if os.path.exists(local_csv_path):
+                functions_anfr.log_message(f"Le fichier {filename} est déjà présent. Aucun téléchargement nécessaire.")
+                functions_anfr.update_http_cache(url, response, filename)
             else:
-                functions_anfr.log_message(f"Le script {script_to_execute} a été exécuté avec succès.")
+                # Le corps de cette même réponse est écrit sur disque, compare.py ne renégocie pas
+                functions_anfr.log_message(f"Le fichier {filename} n'est pas présent. Téléchargement...")
+                os.makedirs(os.path.dirname(local_csv_path), exist_ok=True)
+                _, digest = functions_anfr.download_file(url, local_csv_path, response=response)
+                functions_anfr.update_http_cache(url, response, filename, digest)
+
+                # Même contenu que le dernier instantané : core.py n'est pas lancé
+                match = functions_anfr.matching_snapshot(local_csv_path, [functions_anfr.previous_snapshot(local_csv_path)])
+                if match:
+                    functions_anfr.log_message(f"{filename} a le même contenu que {match}, exécution annulée.", "WARN")
+                    functions_anfr.ignore_snapshot(local_csv_path, ignores_path)
+                    os.remove(local_csv_path)
+                    functions_anfr.send_sms(f"MAJ vide : {filename} identique à {match}.", "INFO")
+                    signal.alarm(0)
+                    return
+
+                functions_anfr.log_message(f"Exécution de {script_to_execute}...")
+                return_code = run_script(script_to_execute, f"--downloaded-csv-name={filename}")
+                if return_code != 0:
+                    functions_anfr.log_message(f"L'exécution de {script_to_execute} a échoué avec le code de retour {return_code}.", "ERROR")
+                else:
+                    functions_anfr.log_message(f"Le script {script_to_execute} a été exécuté avec succès.")
 
         signal.alarm(0)  # Annuler l'alarme si tout s'est bien passé
     except TimeoutError:
@@ -2,13 +2,99 @@
 from datetime import datetime
 import subprocess
 import requests
+import pandas as pd
+import schema_anfr
+import catalog_anfr
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import hashlib
+import csv
+import json
+import threading
+import time
 import sys
+import io
 import os
 
 # On remonte au /home/user pour construire le chemin vers le dossier dim_brest pour les SMS
 h_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 send_sms_path = os.path.join(h_directory, "dim_brest", "sms.py")
 
+# Taille des blocs lus/écrits lors des téléchargements en streaming
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Cache des métadonnées HTTP (ETag, Last-Modified...) partagé par determine_maj et compare
+HTTP_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "http_cache.json")
+
+# Horodatage et chemins de la MAJ en cours, écrits par compare.py pour les étapes suivantes
+COMPARED_TIMESTAMP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "compared", "timestamp.txt")
+
+# Valeurs lues comme manquantes par pd.read_csv (na_values par défaut)
+CSV_NA_VALUES = [
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'
+]
+
+# Résultats intermédiaires compare.py -> pretrait.py (Arrow IPC, relus en memory-map)
+INTERMEDIATE_SUFFIX = ".arrow"
+
+# Cache colonnaire des instantanés ANFR (Parquet, un fichier par contenu)
+COLUMNAR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "columnar")
+# À incrémenter dès que la normalisation des colonnes change, pour invalider le cache
+COLUMNAR_VERSION = 2
+# index.json du cache est mis à jour par les threads de load_snapshots
+_COLUMNAR_INDEX_LOCK = threading.Lock()
+# Groupes de lignes bornés : la lecture par blocs (iter_snapshot_chunks) ne décode pas tout le fichier
+COLUMNAR_ROW_GROUP = 65536
+
+# Table INSEE compilée (tableaux .npy relus en memory-map), à côté de cc_insee.csv
+INSEE_COMPILED_DIR = "compiled"
+# À incrémenter dès que le format ou l'analyse de cc_insee.csv change, pour forcer la recompilation
+INSEE_LOOKUP_VERSION = 1
+INSEE_ARRAYS = ("codes", "label_codes", "labels")
+
+# Lecture parallèle des CSV bruts : taille minimale d'une tranche d'octets confiée à un processus
+PARSE_MIN_RANGE = 16 * 1024 * 1024
+PARSE_READ_BLOCK = 8 * 1024 * 1024
+
+# Colonnes ANFR utilisées par le pipeline et leur nom normalisé
+SNAPSHOT_COLUMNS = {
+    'adm_lb_nom': 'operateur',
+    'sup_id': 'id_support',
+    'emr_lb_systeme': 'technologie',
+    'nat_id': 'type_support',
+    'sup_nm_haut': 'hauteur_support',
+    'tpo_id': 'proprietaire_support',
+    'adr_lb_lieu': 'adresse0',
+    'adr_lb_add1': 'adresse1',
+    'adr_lb_add2': 'adresse2',
+    'adr_lb_add3': 'adresse3',
+    'com_cd_insee': 'code_insee',
+    'coordonnees': 'coordonnees',
+    'statut': 'statut',
+    'emr_dt': 'date_activ'
+}
+
+# Colonnes identifiant une ligne (clé de comparaison) et colonnes dont on suit l'évolution
+IDENTITY_COLUMNS = [
+    'operateur',
+    'id_support',
+    'technologie',
+    'type_support',
+    'hauteur_support',
+    'proprietaire_support',
+    'adresse0',
+    'adresse1',
+    'adresse2',
+    'adresse3',
+    'code_insee',
+    'coordonnees'
+]
+PAYLOAD_COLUMNS = ['statut', 'date_activ']
+# Empreintes 64 bits calculées à l'ingestion et stockées avec l'instantané
+FINGERPRINT_COLUMNS = ['empreinte_id', 'empreinte_statut']
+
 
 def log_message(message, level="INFO"):
     """Fonction de log pour afficher un timestamp avec le niveau d'erreur."""
@@ -43,21 +129,124 @@ def send_sms(message, level="INFO"):
     """Exécute le scrpt sms.py avec le message en argument."""
     subprocess.run([sys.executable, send_sms_path, f"MAJ_ANFR - {level} - {message}"])
 
+def read_compare_timestamp(file_path: str = COMPARED_TIMESTAMP_PATH) -> tuple:
+    """Lit le timestamp.txt écrit par compare.py.
+
+    Returns:
+        Tuple (timestamp, chemin de l'ancien CSV, chemin du nouveau CSV)
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    return lines[0].strip(), lines[1].strip(), lines[2].strip()
+
+def csv_round_trip(df: pd.DataFrame) -> pd.DataFrame:
+    """Copie de df telle que la relirait pd.read_csv(dtype=str) après un to_csv(index=False).
+
+    Permet de passer un résultat en mémoire d'une étape à l'autre sans changer ce que
+    reçoit l'étape suivante (valeurs manquantes, index 0..n-1).
+    """
+    df = df.reset_index(drop=True)
+    return df.where(~df.isin(CSV_NA_VALUES) & df.notna(), np.nan)
+
+def filename_from_response(response) -> str:
+    """Extrait le nom du fichier d'une réponse HTTP (Content-Disposition ou URL finale)."""
+    content_disposition = response.headers.get('content-disposition')
+    if content_disposition:
+        return content_disposition.split("filename=")[-1].strip('"')
+    return response.url.split("/")[-1]
+
 def get_filename_from_server(url):
     """Récupère le nom du fichier depuis l'URL du serveur."""
     try:
         response = requests.head(url, allow_redirects=True)
         response.raise_for_status()
-        content_disposition = response.headers.get('content-disposition')
-        if content_disposition:
-            filename = content_disposition.split("filename=")[-1].strip('"')
-        else:
-            filename = response.url.split("/")[-1]
-        return filename
+        return filename_from_response(response)
     except requests.exceptions.RequestException as e:
         log_message(f"Échec de la récupération du nom du fichier depuis le serveur : {e}", "ERROR")
         raise
 
+def load_http_cache(cache_path: str = HTTP_CACHE_PATH) -> dict:
+    """Charge le cache des métadonnées HTTP ({url: entrée}), vide s'il est absent ou illisible."""
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def update_http_cache(url: str, response, filename: str, sha256: str = None,
+                      cache_path: str = HTTP_CACHE_PATH) -> dict:
+    """Enregistre les validateurs HTTP d'une réponse 200 pour les requêtes conditionnelles suivantes."""
+    cache = load_http_cache(cache_path)
+    entry = {
+        'etag': response.headers.get('etag'),
+        'last_modified': response.headers.get('last-modified'),
+        'content_length': response.headers.get('content-length'),
+        'filename': filename,
+        'sha256': sha256 or cache.get(url, {}).get('sha256'),
+        'checked_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    cache[url] = entry
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    return entry
+
+def conditional_get(url: str, cache_path: str = HTTP_CACHE_PATH, timeout: float = 180, session=None,
+                    conditional: bool = True) -> tuple:
+    """Envoie un GET conditionnel (If-None-Match / If-Modified-Since) à partir du cache.
+
+    Le corps n'est pas lu : l'appelant peut inspecter les en-têtes puis soit fermer la
+    réponse, soit la passer à download_file sans seconde requête.
+
+    Returns:
+        Tuple (réponse en streaming ou None si 304, entrée du cache)
+    """
+    http = session or requests
+    entry = load_http_cache(cache_path).get(url, {}) if conditional else {}
+    headers = {'Accept-Encoding': 'identity'}
+    if entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    response = http.get(url, headers=headers, stream=True, timeout=timeout)
+    if response.status_code == 304:
+        response.close()
+        return None, entry
+    try:
+        response.raise_for_status()
+    except requests.exceptions.RequestException:
+        response.close()
+        raise
+    return response, entry
+
+def fetch_snapshot(url: str, dest_dir: str, cache_path: str = HTTP_CACHE_PATH, session=None, **download_kwargs) -> tuple:
+    """Récupère le fichier ANFR avec une seule négociation HTTP.
+
+    Un 304 réutilise le fichier local connu du cache ; une réponse 200 est téléchargée
+    directement, sans HEAD préalable, puis ses validateurs sont mémorisés.
+
+    Returns:
+        Tuple (chemin local, True si le fichier vient d'être téléchargé)
+    """
+    response, entry = conditional_get(url, cache_path, session=session)
+    if response is None:
+        local_path = os.path.join(dest_dir, entry.get('filename') or '')
+        if entry.get('filename') and os.path.exists(local_path):
+            log_message(f"Données inchangées sur le serveur (304), réutilisation de {entry['filename']}.")
+            return local_path, False
+        # Le cache pointe vers un fichier disparu : on redemande le fichier sans condition
+        log_message("Données inchangées sur le serveur mais fichier local absent, nouveau téléchargement.", "WARN")
+        response, entry = conditional_get(url, cache_path, session=session, conditional=False)
+
+    filename = filename_from_response(response)
+    local_path, digest = download_file(url, os.path.join(dest_dir, filename), response=response,
+                                       session=session, **download_kwargs)
+    update_http_cache(url, response, filename, digest, cache_path)
+    return local_path, True
+
 def detect_separator(file_path: str) -> str:
         """Détecte le séparateur CSV sur la première ligne uniquement."""
         with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
@@ -65,4 +254,530 @@ def detect_separator(file_path: str) -> str:
         for sep in (';', ','):
             if sep in first_line:
                 return sep
-        return ','  # fallback
\ No newline at end of file
+        return ','  # fallback
+
+
+def file_sha256(file_path: str, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> str:
+    """Calcule le SHA-256 d'un fichier en le lisant par blocs."""
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _stream_to_part(http, url: str, part_path: str, timeout: float, chunk_size: int,
+                    validator: dict, response=None) -> str:
+    """Écrit le corps de la réponse dans part_path, en reprenant là où il s'est arrêté.
+
+    validator mémorise l'ETag/Last-Modified de la première réponse : il est renvoyé
+    en If-Range pour que le serveur renvoie tout le fichier s'il a changé entre-temps.
+
+    Returns:
+        SHA-256 du fichier partiel complet
+    """
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f"bytes={offset}-"
+        if validator.get('if_range'):
+            headers['If-Range'] = validator['if_range']
+
+    if response is None:
+        response = http.get(url, headers=headers, stream=True, timeout=timeout)
+    with response:
+        if offset and response.status_code == 416:
+            # Plage refusée (fichier partiel incohérent) : on repart de zéro
+            os.remove(part_path)
+            return _stream_to_part(http, url, part_path, timeout, chunk_size, validator)
+        response.raise_for_status()
+        if response.status_code == 200:
+            validator['if_range'] = response.headers.get('etag') or response.headers.get('last-modified')
+
+        hasher = hashlib.sha256()
+        content_range = response.headers.get('content-range', '')
+        if offset and response.status_code == 206 and content_range.startswith(f"bytes {offset}-"):
+            log_message(f"Reprise du téléchargement à l'octet {offset:,}.")
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    hasher.update(chunk)
+            mode = 'ab'
+        else:
+            # Le serveur ignore le Range : on réécrit le fichier depuis le début
+            offset = 0
+            mode = 'wb'
+
+        expected = response.headers.get('content-length')
+        received = 0
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    hasher.update(chunk)
+                    received += len(chunk)
+
+        if expected is not None and expected.isdigit() and received != int(expected):
+            raise requests.exceptions.ChunkedEncodingError(
+                f"Réponse incomplète : {offset + received:,} octets reçus sur {offset + int(expected):,}."
+            )
+    return hasher.hexdigest()
+
+def download_file(url: str, save_path: str, max_retries: int = 3, delay: float = 60,
+                  timeout: float = 180, chunk_size: int = DOWNLOAD_CHUNK_SIZE, session=None,
+                  response=None) -> tuple:
+    """Télécharge un fichier en streaming, avec reprise HTTP Range et renommage atomique.
+
+    Les blocs sont écrits dans save_path + '.part' au fil de l'eau. Après une coupure,
+    la tentative suivante reprend à l'octet déjà reçu si le serveur accepte les Range,
+    sinon elle repart de zéro. Le SHA-256 est calculé pendant le transfert.
+
+    Args:
+        session: Objet exposant get() (requests.Session...), requests par défaut
+        response: Réponse 200 déjà ouverte en streaming (GET conditionnel), consommée
+            par la première tentative au lieu d'émettre une nouvelle requête
+
+    Returns:
+        Tuple (save_path, sha256)
+    """
+    http = session or requests
+    part_path = save_path + ".part"
+    # Un fichier partiel laissé par une exécution précédente peut correspondre à une autre version
+    if os.path.exists(part_path):
+        os.remove(part_path)
+    validator = {}
+    for attempt in range(1, max_retries + 1):
+        first_response, response = response, None
+        try:
+            digest = _stream_to_part(http, url, part_path, timeout, chunk_size, validator, first_response)
+            os.replace(part_path, save_path)
+            return save_path, digest
+        except requests.exceptions.RequestException as e:
+            log_message(f"Tentative {attempt}/{max_retries} échouée - {e}", "WARN")
+            if attempt < max_retries:
+                time.sleep(delay)
+            else:
+                raise
+
+
+def csv_byte_ranges(file_path: str, n_ranges: int) -> tuple:
+    """Découpe le corps d'un CSV en tranches d'octets commençant chacune en début de ligne.
+
+    Une coupure n'est retenue qu'en dehors d'un champ entre guillemets (nombre pair de '"'
+    depuis le début du fichier), un retour à la ligne dans une adresse ne coupe donc rien.
+
+    Returns:
+        Tuple (octets de l'en-tête, liste de (début, fin)), au plus n_ranges tranches
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        while header.count(b'"') % 2:
+            line = f.readline()
+            if not line:
+                break
+            header += line
+        cuts = [f.tell()]
+        quotes = 0
+        pos = cuts[0]
+        for i in range(1, n_ranges):
+            target = cuts[0] + (size - cuts[0]) * i // n_ranges
+            if target <= pos:
+                continue
+            while pos < target:
+                block = f.read(min(PARSE_READ_BLOCK, target - pos))
+                quotes += block.count(b'"')
+                pos += len(block)
+            # Fin de la ligne en cours, puis des suivantes tant qu'un champ reste ouvert
+            line = f.readline()
+            quotes += line.count(b'"')
+            while quotes % 2 and line:
+                line = f.readline()
+                quotes += line.count(b'"')
+            pos = f.tell()
+            if pos < size:
+                cuts.append(pos)
+    cuts.append(size)
+    return header, [(start, end) for start, end in zip(cuts, cuts[1:]) if end > start]
+
+def _read_csv_range(file_path: str, header: bytes, start: int, end: int, sep: str, columns: list):
+    """Analyse une tranche d'octets précédée de l'en-tête (exécuté dans un processus du pool)."""
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(header + data), sep=sep, engine='c', on_bad_lines='skip', dtype=str)
+    # Index implicite déduit de la première ligne de la tranche : résultat différent d'une lecture complète
+    if not isinstance(df.index, pd.RangeIndex):
+        return None
+    return df[columns] if columns else df
+
+def read_csv_parallel(file_path: str, sep: str = None, columns: list = None, workers: int = None) -> pd.DataFrame:
+    """Lit un CSV ANFR brut en parallèle, par tranches d'octets alignées sur les lignes.
+
+    Renvoie le même DataFrame qu'un pd.read_csv(dtype=str, on_bad_lines='skip') du fichier
+    entier : chaque tranche est analysée avec l'en-tête et le séparateur du fichier, puis les
+    morceaux sont concaténés dans l'ordre. Les fichiers trop petits sont lus directement.
+
+    Args:
+        columns: Colonnes brutes à conserver, projetées après analyse (pas de usecols,
+            qui modifierait les lignes écartées par on_bad_lines)
+        workers: Nombre de processus, os.cpu_count() par défaut
+    """
+    sep = sep or detect_separator(file_path)
+    workers = workers or os.cpu_count() or 1
+    n_ranges = min(workers, os.path.getsize(file_path) // PARSE_MIN_RANGE)
+    if n_ranges >= 2:
+        header, ranges = csv_byte_ranges(file_path, n_ranges)
+        # spawn : le pool peut être lancé depuis un thread de load_snapshots (fork y est risqué)
+        with ProcessPoolExecutor(max_workers=len(ranges), mp_context=multiprocessing.get_context("spawn")) as pool:
+            parts = list(pool.map(_read_csv_range, *zip(*[
+                (file_path, header, start, end, sep, columns) for start, end in ranges
+            ])))
+        if all(part is not None for part in parts):
+            return pd.concat(parts, ignore_index=True)
+        log_message(f"Découpage de {os.path.basename(file_path)} impossible, lecture séquentielle.", "WARN")
+
+    df = pd.read_csv(file_path, sep=sep, engine='c', on_bad_lines='skip', dtype=str)
+    return df[columns] if columns else df
+
+def parse_snapshot_csv(file_path: str, workers: int = None) -> pd.DataFrame:
+    """Lit un CSV ANFR brut et renvoie les colonnes utiles renommées et normalisées."""
+    df = read_csv_parallel(file_path, columns=list(SNAPSHOT_COLUMNS), workers=workers)
+    return normalise_snapshot(df)
+
+def normalise_snapshot(df: pd.DataFrame) -> pd.DataFrame:
+    """Projette, renomme et normalise un DataFrame ANFR brut (ligne à ligne, utilisable par morceaux)."""
+    df = df[list(SNAPSHOT_COLUMNS)].rename(columns=SNAPSHOT_COLUMNS)
+
+    # === NORMALISATION DES COLONNES CLÉ ===
+    # Normaliser code_insee: zfill(5) pour préserver les zéros en tête (06073 vs 6073)
+    df['code_insee'] = df['code_insee'].astype(str).str.zfill(5)
+
+    # Normaliser coordonnees: format "lat , lon" avec espaces consistants
+    df['coordonnees'] = (df['coordonnees'].astype(str)
+                        .str.split(r'\s*,\s*', regex=True)
+                        .str.join(' , '))
+
+    # Empreintes calculées une fois pour toutes : compare.py joint ensuite des entiers
+    df['empreinte_id'] = fingerprint(df, IDENTITY_COLUMNS)
+    df['empreinte_statut'] = fingerprint(df, PAYLOAD_COLUMNS)
+    return df
+
+def fingerprint(df: pd.DataFrame, columns: list) -> np.ndarray:
+    """Empreinte 64 bits (stable d'une exécution à l'autre) de chaque ligne sur les colonnes données."""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+def _load_columnar_index(cache_dir: str) -> dict:
+    try:
+        with open(os.path.join(cache_dir, "index.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_columnar_index(cache_dir: str, index: dict) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, "index.json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(cache_dir, "index.json"))
+
+def columnar_cache_path(file_path: str, sha256: str = None, cache_dir: str = COLUMNAR_DIR) -> str:
+    """Chemin du fichier Parquet correspondant au contenu de file_path.
+
+    Le SHA-256 n'est recalculé que si la taille ou la date de modification du CSV
+    ont changé depuis la dernière fois (index.json du cache).
+    """
+    sha256 = snapshot_sha256(file_path, sha256, cache_dir)
+    return os.path.join(cache_dir, f"{sha256}_v{COLUMNAR_VERSION}.parquet")
+
+def snapshot_sha256(file_path: str, sha256: str = None, cache_dir: str = COLUMNAR_DIR) -> str:
+    """SHA-256 de file_path, relu dans index.json du cache tant que taille et date de modification sont inchangées."""
+    stat = os.stat(file_path)
+    name = os.path.basename(file_path)
+    with _COLUMNAR_INDEX_LOCK:
+        entry = _load_columnar_index(cache_dir).get(name)
+    if sha256 is None:
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            sha256 = entry['sha256']
+        else:
+            sha256 = file_sha256(file_path)
+    if not entry or entry['sha256'] != sha256 or entry['mtime_ns'] != stat.st_mtime_ns:
+        with _COLUMNAR_INDEX_LOCK:
+            index = _load_columnar_index(cache_dir)
+            index[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}
+            _save_columnar_index(cache_dir, index)
+    return sha256
+
+def _write_columnar(df: pd.DataFrame, cache_path: str) -> bool:
+    """Écrit df en Parquet (encodage dictionnaire) de manière atomique. False si pyarrow est absent."""
+    # Nom temporaire propre au thread : deux instantanés identiques peuvent être convertis en même temps
+    tmp_path = f"{cache_path}.{os.getpid()}_{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        df.to_parquet(tmp_path, engine='pyarrow', index=False, compression='zstd', use_dictionary=True,
+                      row_group_size=COLUMNAR_ROW_GROUP)
+        os.replace(tmp_path, cache_path)
+        return True
+    except ImportError:
+        log_message("pyarrow indisponible, cache colonnaire désactivé.", "WARN")
+        return False
+
+def ingest_snapshot(file_path: str, sha256: str = None, cache_dir: str = COLUMNAR_DIR) -> str:
+    """Convertit une seule fois un instantané ANFR en Parquet normalisé (à l'arrivée du fichier).
+
+    Returns:
+        Chemin du fichier Parquet, ou None si le cache colonnaire est indisponible
+    """
+    cache_path = columnar_cache_path(file_path, sha256, cache_dir)
+    if os.path.exists(cache_path):
+        import pyarrow.parquet as pq
+        catalog_snapshot(file_path, cache_path, pq.read_metadata(cache_path).num_rows, cache_dir)
+        return cache_path
+    df = parse_snapshot_csv(file_path)
+    if not _write_columnar(df, cache_path):
+        catalog_snapshot(file_path, None, len(df), cache_dir)
+        return None
+    log_message(f"Instantané {os.path.basename(file_path)} converti en Parquet ({len(df):,} lignes).")
+    catalog_snapshot(file_path, cache_path, len(df), cache_dir)
+    return cache_path
+
+def catalog_snapshot(file_path: str, cache_path: str, rows: int, cache_dir: str = COLUMNAR_DIR,
+                     catalog: catalog_anfr.SnapshotCatalog = None) -> None:
+    """Inscrit au catalogue les faits d'ingestion d'un instantané (empreinte, lignes, en-tête, séparateur)."""
+    sep = detect_separator(file_path)
+    with open(file_path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        columns = next(csv.reader(f, delimiter=sep), [])
+    (catalog or catalog_anfr.SnapshotCatalog()).record_ingest(
+        file_path, snapshot_sha256(file_path, cache_dir=cache_dir), rows, columns, sep, cache_path
+    )
+
+def normalised_header(line: str) -> str:
+    """En-tête ANFR comparable d'une publication à l'autre : BOM, guillemets, espaces et casse ignorés."""
+    line = line.lstrip('\ufeff').rstrip('\r\n')
+    sep = ';' if ';' in line else ','
+    fields = next(csv.reader([line], delimiter=sep), [])
+    return ';'.join(field.strip().lower() for field in fields)
+
+def content_fingerprint(file_path: str, canonical: bool = False, chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> str:
+    """Empreinte SHA-256 d'un CSV ANFR, en-tête normalisé et fins de ligne unifiées.
+
+    Args:
+        canonical: Empreinte des lignes triées (blanches ignorées) : insensible à l'ordre de publication
+
+    Returns:
+        Empreinte hexadécimale, préfixée par sa forme (raw ou canonical)
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        hasher.update(normalised_header(f.readline().decode('utf-8', errors='replace')).encode('utf-8') + b'\n')
+        if canonical:
+            hasher.update(b'\n'.join(sorted(line.rstrip(b'\r\n') for line in f if line.strip())))
+        else:
+            pending = b''
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                # Un \r en fin de bloc peut précéder le \n du bloc suivant
+                chunk = pending + chunk
+                pending = b'\r' if chunk.endswith(b'\r') else b''
+                hasher.update(chunk[:len(chunk) - len(pending)].replace(b'\r\n', b'\n'))
+            hasher.update(pending)
+    return f"{'canonical' if canonical else 'raw'}:{hasher.hexdigest()}"
+
+def snapshot_fingerprint(file_path: str, canonical: bool = False,
+                         catalog: catalog_anfr.SnapshotCatalog = None) -> str:
+    """content_fingerprint de file_path, calculée une fois par contenu puis relue dans le catalogue."""
+    catalog = catalog or catalog_anfr.SnapshotCatalog()
+    column = 'canonical_fingerprint' if canonical else 'fingerprint'
+    fingerprint = catalog.fact(file_path, column)
+    if fingerprint is None:
+        fingerprint = content_fingerprint(file_path, canonical)
+        catalog.record_fact(file_path, column, fingerprint)
+    return fingerprint
+
+def matching_snapshot(file_path: str, reference_paths: list, canonical: bool = False,
+                      catalog: catalog_anfr.SnapshotCatalog = None) -> str:
+    """Cherche, parmi les références de cette MAJ, un instantané au contenu identique à file_path.
+
+    Une MAJ ignorée n'était identique qu'à la référence alors en vigueur : c'est cette référence,
+    toujours présente, qui permet de reconnaître un contenu déjà vu, pas l'empreinte de la MAJ ignorée.
+
+    Args:
+        reference_paths: Instantanés de référence (les chemins None ou absents sont ignorés)
+        canonical: Comparer aussi les formes à lignes triées (plus coûteux : tri de toutes les lignes)
+
+    Returns:
+        Nom du fichier identique, None si les données diffèrent
+    """
+    catalog = catalog or catalog_anfr.SnapshotCatalog()
+    forms = (False, True) if canonical else (False,)
+    fingerprints = {form: snapshot_fingerprint(file_path, form, catalog) for form in forms}
+    for reference in reference_paths:
+        if not reference or not os.path.exists(reference) or os.path.abspath(reference) == os.path.abspath(file_path):
+            continue
+        if any(snapshot_fingerprint(reference, form, catalog) == fingerprints[form] for form in forms):
+            return os.path.basename(reference)
+    return None
+
+def previous_snapshot(file_path: str, catalog: catalog_anfr.SnapshotCatalog = None) -> str:
+    """Instantané horodaté le plus récent du même dossier, antérieur à file_path (None si aucun)."""
+    catalog = catalog or catalog_anfr.SnapshotCatalog()
+    dir_path, name = os.path.split(file_path)
+    timestamp = catalog_anfr.anfr_timestamp(name)
+    if timestamp is None:
+        return None
+    catalog.sync(dir_path)
+    previous = catalog.latest_between(dir_path, datetime.min, timestamp, exclude=name)
+    return os.path.join(dir_path, previous) if previous else None
+
+def ignore_snapshot(file_path: str, ignores_path: str) -> None:
+    """Ajoute file_path à ignores.txt (à appeler avant de supprimer le fichier)."""
+    with open(ignores_path, "a", encoding="utf-8") as f:
+        f.write(os.path.basename(file_path) + "\n")
+
+def load_snapshot(file_path: str, columns: list = None, cache_dir: str = COLUMNAR_DIR,
+                  workers: int = None) -> pd.DataFrame:
+    """Charge un instantané ANFR normalisé, via le cache colonnaire si possible.
+
+    Args:
+        columns: Colonnes normalisées à lire (projection), toutes par défaut
+        workers: Processus pour analyser le CSV brut s'il n'est pas encore en cache
+
+    Returns:
+        DataFrame aux colonnes de SNAPSHOT_COLUMNS renommées (valeurs manquantes à NaN)
+        suivies des empreintes FINGERPRINT_COLUMNS
+    """
+    cache_path = columnar_cache_path(file_path, cache_dir=cache_dir)
+    if os.path.exists(cache_path):
+        df = pd.read_parquet(cache_path, columns=columns)
+        # Parquet restitue les manquants en None : on revient au NaN de read_csv
+        text_cols = [col for col in df.columns if col not in FINGERPRINT_COLUMNS]
+        df[text_cols] = df[text_cols].where(df[text_cols].notna(), np.nan)
+        return df
+
+    df = parse_snapshot_csv(file_path, workers)
+    if _write_columnar(df, cache_path):
+        log_message(f"Instantané {os.path.basename(file_path)} converti en Parquet ({len(df):,} lignes).")
+        catalog_snapshot(file_path, cache_path, len(df), cache_dir)
+    return df[columns] if columns else df
+
+def load_snapshots(file_paths: list, columns: list = None, cache_dir: str = COLUMNAR_DIR) -> list:
+    """Charge plusieurs instantanés en même temps (un thread chacun, les cœurs répartis entre eux).
+
+    Returns:
+        Liste de DataFrames dans l'ordre de file_paths, colonnes de schema_anfr en Categorical communs
+    """
+    workers = max(1, (os.cpu_count() or 1) // len(file_paths))
+    with ThreadPoolExecutor(max_workers=len(file_paths)) as pool:
+        futures = [pool.submit(load_snapshot, path, columns, cache_dir, workers) for path in file_paths]
+        return schema_anfr.to_categorical([future.result() for future in futures])
+
+def iter_snapshot_chunks(file_path: str, chunk_rows: int, cache_dir: str = COLUMNAR_DIR):
+    """Parcourt un instantané normalisé par blocs d'au plus chunk_rows lignes, sans le charger en entier.
+
+    Lit le Parquet du cache colonnaire s'il existe déjà, sinon le CSV brut par morceaux.
+
+    Yields:
+        DataFrames au format de load_snapshot
+    """
+    cache_path = columnar_cache_path(file_path, cache_dir=cache_dir)
+    if os.path.exists(cache_path):
+        import pyarrow
+        import pyarrow.parquet as pq
+        # pre_buffer=False : pas de lecture anticipée de tout le groupe de lignes
+        for batch in pq.ParquetFile(cache_path, pre_buffer=False).iter_batches(batch_size=chunk_rows):
+            df = batch.to_pandas()
+            del batch
+            pyarrow.default_memory_pool().release_unused()
+            text_cols = [col for col in df.columns if col not in FINGERPRINT_COLUMNS]
+            df[text_cols] = df[text_cols].where(df[text_cols].notna(), np.nan)
+            yield df
+        return
+
+    sep = detect_separator(file_path)
+    with pd.read_csv(file_path, sep=sep, engine='c', on_bad_lines='skip', dtype=str,
+                     chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            yield normalise_snapshot(chunk)
+
+def intermediate_path(csv_path: str) -> str:
+    """Chemin du fichier Arrow correspondant à un résultat comp_*.csv."""
+    return os.path.splitext(csv_path)[0] + INTERMEDIATE_SUFFIX
+
+def write_intermediate(df: pd.DataFrame, file_path: str) -> bool:
+    """Écrit df en Arrow IPC non compressé, toutes colonnes en texte (suffixes _x/_y conservés).
+
+    Returns:
+        False si pyarrow est absent (l'appelant se replie alors sur le CSV)
+    """
+    try:
+        import pyarrow
+        import pyarrow.feather
+    except ImportError:
+        return False
+    schema = pyarrow.schema([(str(col), pyarrow.string()) for col in df.columns])
+    table = pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+    tmp_path = file_path + ".tmp"
+    pyarrow.feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, file_path)
+    return True
+
+def read_intermediate(file_path: str) -> pd.DataFrame:
+    """Relit en memory-map un fichier écrit par write_intermediate."""
+    import pyarrow.feather
+    return pyarrow.feather.read_table(file_path, memory_map=True).to_pandas()
+
+def prune_columnar_cache(dir_path: str, cache_dir: str = COLUMNAR_DIR) -> None:
+    """Supprime du cache colonnaire les instantanés dont le CSV n'existe plus dans dir_path."""
+    index = _load_columnar_index(cache_dir)
+    kept = {name: entry for name, entry in index.items() if os.path.exists(os.path.join(dir_path, name))}
+    if kept == index:
+        return
+    live = {f"{entry['sha256']}_v{COLUMNAR_VERSION}.parquet" for entry in kept.values()}
+    for fichier in os.listdir(cache_dir):
+        if fichier.endswith(".parquet") and fichier not in live:
+            os.remove(os.path.join(cache_dir, fichier))
+            log_message(f"Cache colonnaire supprimé : {fichier}")
+    _save_columnar_index(cache_dir, kept)
+
+def compile_insee_lookup(csv_path: str, encoding: str, out_dir: str, sha256: str) -> None:
+    """Compile cc_insee.csv en tableaux triés : codes (5 caractères), indice de libellé, libellés uniques.
+
+    Même lecture que l'ancien dictionnaire : ';', au moins 3 champs, code non vide complété
+    à 5 chiffres, libellé "<champ 3> <champ 2>", la dernière ligne d'un code l'emportant.
+    """
+    with open(csv_path, mode='r', encoding=encoding) as file:
+        mapping = {
+            row[0].zfill(5): f"{row[2]} {row[1]}"
+            for row in csv.reader(file, delimiter=';') if len(row) >= 3 and row[0]
+        }
+    codes = np.array(sorted(mapping), dtype=str)
+    labels, label_codes = np.unique(np.array([mapping[code] for code in codes], dtype=str), return_inverse=True)
+    arrays = {"codes": codes, "label_codes": label_codes.astype(np.int32), "labels": labels}
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name, array in arrays.items():
+        tmp_path = os.path.join(out_dir, f"{name}.tmp.npy")
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(out_dir, f"{name}.npy"))
+    # Métadonnées écrites en dernier : une compilation interrompue sera refaite
+    meta = {"version": INSEE_LOOKUP_VERSION, "sha256": sha256, "encoding": encoding, "entries": len(codes)}
+    tmp_path = os.path.join(out_dir, "meta.json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, "meta.json"))
+
+def load_insee_lookup(csv_path: str, encoding: str = 'ISO-8859-1') -> tuple:
+    """Table INSEE compilée, recompilée seulement si le SHA-256 de cc_insee.csv (ou la version) a changé.
+
+    Returns:
+        (codes, label_codes, labels) : codes triés, indice dans labels de chacun, libellés uniques,
+        tous en memory-map
+    """
+    sha256 = file_sha256(csv_path)
+    out_dir = os.path.join(os.path.dirname(csv_path), INSEE_COMPILED_DIR)
+    try:
+        with open(os.path.join(out_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        meta = {}
+    if (meta.get("version"), meta.get("sha256"), meta.get("encoding")) != (INSEE_LOOKUP_VERSION, sha256, encoding):
+        compile_insee_lookup(csv_path, encoding, out_dir, sha256)
+        log_message(f"Table INSEE compilée depuis {os.path.basename(csv_path)}.")
+    return tuple(np.load(os.path.join(out_dir, f"{name}.npy"), mmap_mode='r') for name in INSEE_ARRAYS)
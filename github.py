@@ -8,6 +8,7 @@ import datetime
 from pathlib import Path
 from dotenv import load_dotenv
 import functions_anfr
+import report_anfr
 
 def get_timestamp():
     fc_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "compared", "timestamp.txt")
@@ -37,10 +38,10 @@ def copy_files(update_type: str, path_app: Path, period_code: str):
 
     return repo_dir, dest_dir
 
-def git_push(repo_dir: Path, dest_dir: Path, timestamp: str, update_type: str, github_token: str):
+def git_push(repo_dir: Path, dest_dirs: list, timestamp: str, update_type: str, github_token: str):
     try:
         history_file = repo_dir / "files" / "history.csv"
-        subprocess.run(["git", "-C", str(repo_dir), "add", str(dest_dir), str(history_file)], check=True)
+        subprocess.run(["git", "-C", str(repo_dir), "add", *map(str, dest_dirs), str(history_file)], check=True)
         subprocess.run(["git", "-C", str(repo_dir), "commit", "-m", f"Mise à jour {update_type} du {timestamp}"], check=True)
         subprocess.run(["git", "-C", str(repo_dir), "push", "-f"], check=True)
         functions_anfr.log_message("Modifications poussées sur GitHub.", "INFO")
@@ -63,8 +64,16 @@ def clean(path_app : Path):
         if os.path.isfile(file_path):
             os.remove(file_path)
             functions_anfr.log_message(f"Fichier supprimé : {filename}", "INFO")
+        elif filename in ("hebdo", "mensu", "trim"):
+            # Résultats des périodes secondaires du mode multi-périodes
+            shutil.rmtree(file_path)
+            functions_anfr.log_message(f"Dossier supprimé : {filename}", "INFO")
 
-def main(args):
+def main(update_type: str, timestamp: str = None):
+    main_periods([update_type], timestamp)
+
+def main_periods(update_types: list, timestamp: str = None):
+    """Publie une ou plusieurs périodes en un seul commit (core.py --with-periods)."""
     # Charger les variables d'environnement
     load_dotenv()
     github_token = os.getenv("GITHUB_TOKEN")
@@ -72,15 +81,21 @@ def main(args):
         functions_anfr.log_message("GITHUB_TOKEN non défini dans le fichier .env.", "FATAL")
         sys.exit(1)
 
-    timestamp = get_timestamp()
-    period_code = functions_anfr.get_period_code(timestamp, args.update_type)
+    if timestamp is None:
+        timestamp = get_timestamp()
     path_app = Path(__file__).resolve().parent
 
     # Copier les fichiers
-    repo_dir, dest_dir = copy_files(args.update_type, path_app, period_code)
+    dest_dirs = []
+    with report_anfr.step("github.copy_files"):
+        for update_type in update_types:
+            period_code = functions_anfr.get_period_code(timestamp, update_type)
+            repo_dir, dest_dir = copy_files(update_type, path_app, period_code)
+            dest_dirs.append(dest_dir)
 
     # Git push
-    git_push(repo_dir, dest_dir, timestamp, args.update_type, github_token)
+    with report_anfr.step("github.git_push"):
+        git_push(repo_dir, dest_dirs, timestamp, "+".join(update_types), github_token)
 
     # Clean de pretraite
     clean(path_app)
@@ -88,5 +103,7 @@ def main(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Publier les fichiers ANFR vers le dépôt GitHub.")
     parser.add_argument('update_type', choices=["hebdo", "mensu", "trim"], help="Type de mise à jour")
+    parser.add_argument('--profile', action='store_true', help="Profiler l'étape (cProfile, tracemalloc) : fichiers à côté du rapport d'exécution.")
     args = parser.parse_args()
-    main(args)
+    with report_anfr.profiled("github", args.profile):
+        main(args.update_type)
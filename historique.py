@@ -3,18 +3,14 @@ import argparse
 import os
 import csv
 import locale
-import shutil
 import functions_anfr
+import catalog_anfr
+import report_anfr
 from datetime import datetime, timedelta
 from pathlib import Path
 
 locale.setlocale(locale.LC_TIME, 'fr_FR.UTF-8')
 
-fc_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "compared", "timestamp.txt")
-with open(fc_file, "r", encoding="utf-8") as f:
-    lines = f.readlines()
-    TIMESTAMP = lines[0].strip()
-
 
 def get_actual_week_for_data(timestamp_str: str) -> tuple:
     """Détermine la vraie semaine ISO des données basée sur le jour de publication.
@@ -159,32 +155,45 @@ def update_history_csv(type_: str, timestamp_str: str):
         writer.writeheader()
         writer.writerows(existing_rows)
 
-def main(args):
-    update_history_csv(args.update_type, TIMESTAMP)
+def main(update_type: str, timestamp: str = None, new_csv_path: str = None):
+    """MAJ de l'historique ; timestamp et new_csv_path sont relus depuis files/compared s'ils manquent."""
+    main_periods([update_type], timestamp, new_csv_path)
+
+def main_periods(update_types: list, timestamp: str = None, new_csv_path: str = None):
+    """MAJ de l'historique pour une ou plusieurs périodes issues du même instantané (core.py --with-periods)."""
+    if timestamp is None:
+        timestamp, _, new_csv_path = functions_anfr.read_compare_timestamp()
+    with report_anfr.step("historique.update_history_csv"):
+        for update_type in update_types:
+            update_history_csv(update_type, timestamp)
 
-    dt = datetime.strptime(TIMESTAMP, "%d/%m/%Y à %H:%M:%S")
     path_app = Path(__file__).resolve().parent
     target_dir = path_app / "files" / "from_anfr"
-    source_file = lines[2].strip()
+    source_dir, source_name = os.path.split(new_csv_path)
+    catalog = catalog_anfr.SnapshotCatalog()
 
     for period_type in ["hebdo", "mensu", "trim"]:
-        period_code = functions_anfr.get_period_code(TIMESTAMP, period_type)
+        period_code = functions_anfr.get_period_code(timestamp, period_type)
         with open(os.path.join(path_app, "files", "pretraite", f"{period_code}.txt"), "w", encoding="utf-8") as f:
-            f.write(str(TIMESTAMP))
+            f.write(str(timestamp))
             f.close()
         output_filename = f"{period_code}.csv"
         full_path = target_dir / output_filename
         if not period_type == "hebdo":
-            if not full_path.exists():
-                target_dir.mkdir(parents=True, exist_ok=True)
-                shutil.copy(source_file, full_path)
-                functions_anfr.log_message(f"Fichier copié vers {full_path}", "INFO")
-            else:
+            # Plus de copie complète : le premier instantané de la période sert d'ancre aux diffs hebdo composés
+            if full_path.exists():
                 functions_anfr.log_message(f"Fichier déjà présent : {full_path}", "WARN")
+            elif catalog.record_anchor(source_dir, period_code, source_name):
+                functions_anfr.log_message(f"Instantané de référence {period_code} : {source_name}", "INFO")
+            else:
+                functions_anfr.log_message(f"Instantané de référence {period_code} déjà retenu : "
+                                           f"{catalog.anchor(source_dir, period_code)}", "INFO")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Pilote l'ensemble des scripts du projet.")
     parser.add_argument('update_type', choices=["hebdo", "mensu", "trim"])
     parser.add_argument('--debug', action='store_true', help="Afficher les messages de debug pour tous les scripts.")
+    parser.add_argument('--profile', action='store_true', help="Profiler l'étape (cProfile, tracemalloc) : fichiers à côté du rapport d'exécution.")
     args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    with report_anfr.profiled("historique", args.profile):
+        main(args.update_type)
\ No newline at end of file
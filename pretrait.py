@@ -1,40 +1,28 @@
 #!/usr/bin/env python
 import argparse
+import copy
 import pandas as pd
 import os
-import csv
 import re
 import functions_anfr
+import bands_anfr
+import deltas_anfr
+import report_anfr
 import numpy as np
 import math
 from collections import defaultdict
 from datetime import datetime, timedelta
-from functools import lru_cache
 from typing import Dict, Set, Tuple, Optional, List
 
 # Constants optimisés avec frozenset pour des lookups O(1)
 ZB_TECHNOS = frozenset({"LTE 700", "LTE 800", "UMTS 900"})
 ZB_OPERATEURS = frozenset({"BOUYGUES TELECOM", "FREE MOBILE", "SFR", "ORANGE"})
+ZB_MASK = bands_anfr.band_mask(ZB_TECHNOS)
 
 # Pattern regex pré-compilé pour éviter la recompilation
 TECH_PATTERN = re.compile(r'\b((?:GSM|UMTS|LTE))\s(\d{3,4})\b|\b(5G NR)\s(\d{3,5})\b')
 TECH_ORDER = {"GSM": 1, "UMTS": 2, "LTE": 3, "5G NR": 4}
 
-# Chargement des chemins une seule fois
-fc_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "compared", "timestamp.txt")
-try:
-    with open(fc_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-        TIMESTAMP = lines[0].strip()
-        OLD_CSV_PATH = lines[1].strip()
-        NEW_CSV_PATH = lines[2].strip()
-except (FileNotFoundError, IndexError) as e:
-    functions_anfr.log_message(f"Erreur lecture timestamp: {e}", "FATAL")
-    raise SystemExit(1)
-
-ACTIVATION_LIMIT_DATE = (datetime.strptime(TIMESTAMP, "%d/%m/%Y à %H:%M:%S")-timedelta(days=28)).strftime("%Y-%m-%d")
-
-# Dictionnaires de correspondance optimisés
 # Dictionnaires de correspondance optimisés
 CORRESPONDANCES_TYPE_SUPPORT = {
     0: "Sans nature", 40: "Sémaphore", 41: "Phare",
@@ -91,27 +79,261 @@ CORRESPONDANCES_PROPRIETAIRE_SUPPORT = {
 }
 
 
+# Rayon terrestre en mètres (distance de Haversine)
+EARTH_RADIUS_M = 6371000
+# Côté des cellules de la grille 3D des candidats CHI géographiques : un peu plus que le rayon
+# de 100 m, pour que deux points à moins de 100 m soient toujours dans des cellules voisines
+GEO_CELL_M = 101
+# Distances plus proches que cela (en relatif) d'un seuil : recalculées en scalaire pour trancher à l'identique
+THRESHOLD_RTOL = 1e-9
+
+# Changements d'attribut de support détectés sur la même clé, par ordre de priorité :
+# (action, colonne, valeur de remplacement des manquants pour la comparaison)
+SUPPORT_ATTRIBUTE_CHANGES = [
+    ('CHT', 'type_support', ''),
+    ('CHP', 'proprietaire_support', ''),
+    ('CHH', 'hauteur_support', '0'),
+]
+
+# Classes de statut pour la table des actions (tout autre statut, ou manquant : STATUT_OTHER)
+STATUT_OTHER, STATUT_PROJECT, STATUT_ACTIVE = 0, 1, 2
+STATUT_CLASSES = {
+    'Projet approuvé': STATUT_PROJECT,
+    'En service': STATUT_ACTIVE,
+    'Techniquement opérationnel': STATUT_ACTIVE,
+}
+ISO_DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+
+# Libellé des codes INSEE absents de la table
+INSEE_UNKNOWN = "00404 ERR CONV INSEE"
+
+# Sources des lignes, nommées d'après les fichiers écrits par compare.py
+DIFF_SOURCES = ['comp_added.csv', 'comp_modified.csv', 'comp_removed.csv']
+
+
+def parse_coords(coord_str):
+    """Parse 'lat , lon' format et retourne (lat, lon) en float, ou (None, None)"""
+    if pd.isna(coord_str):
+        return (None, None)
+    try:
+        # Normaliser le format et split
+        coord_str = str(coord_str).replace(' ', '')
+        parts = coord_str.split(',')
+        if len(parts) == 2:
+            return (float(parts[0]), float(parts[1]))
+    except:
+        pass
+    return (None, None)
+
+
+def parse_coords_array(coords: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Parse une colonne de coordonnées en tableaux float64 (lat, lon, lisible).
+
+    Chaque chaîne distincte n'est parsée qu'une fois avec parse_coords ; les valeurs
+    illisibles ont lisible=False (lat/lon à NaN).
+    """
+    codes, uniques = pd.factorize(coords)
+    parsed = [parse_coords(value) for value in uniques]
+    # Dernière case : valeur manquante (code -1 de factorize)
+    lat = np.array([np.nan if p[0] is None else p[0] for p in parsed] + [np.nan], dtype=np.float64)
+    lon = np.array([np.nan if p[1] is None else p[1] for p in parsed] + [np.nan], dtype=np.float64)
+    valid = np.array([p[0] is not None for p in parsed] + [False], dtype=bool)
+    return lat[codes], lon[codes], valid[codes]
+
+
+def coord_distance_meters(lat1, lon1, lat2, lon2):
+    """Approximation simple de la distance entre deux points en mètres
+    Utilise la formule de Haversine simplifiée"""
+    if lat1 is None or lat2 is None:
+        return None
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    return EARTH_RADIUS_M * c
+
+
+def haversine_meters(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray,
+                     thresholds: Tuple[float, ...] = ()) -> np.ndarray:
+    """Version NumPy de coord_distance_meters sur des tableaux (NaN là où elle échouerait).
+
+    sin/cos de NumPy peuvent différer d'un ulp de ceux de math : les distances à moins de
+    THRESHOLD_RTOL d'un des seuils sont recalculées avec coord_distance_meters.
+    """
+    with np.errstate(invalid='ignore'):
+        dlat = np.radians(lat2 - lat1)
+        dlon = np.radians(lon2 - lon1)
+        a = np.sin(dlat/2)**2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon/2)**2
+        dist = EARTH_RADIUS_M * (2 * np.arcsin(np.sqrt(a)))
+    for threshold in thresholds:
+        for i in np.flatnonzero(np.abs(dist - threshold) <= threshold * THRESHOLD_RTOL):
+            try:
+                dist[i] = coord_distance_meters(float(lat1[i]), float(lon1[i]), float(lat2[i]), float(lon2[i]))
+            except ValueError:
+                dist[i] = np.nan
+    return dist
+
+
+def neighbour_pairs(keys_rem: pd.DataFrame, lat_rem: np.ndarray, lon_rem: np.ndarray, valid_rem: np.ndarray,
+                    keys_add: pd.DataFrame, lat_add: np.ndarray, lon_add: np.ndarray, valid_add: np.ndarray,
+                    radius: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Paires (position supprimée, position ajoutée) de même clé à moins de radius mètres.
+
+    Équivaut à un pd.merge(how='inner') sur les colonnes de clé (NaN égal à NaN) suivi d'un
+    filtre haversine_meters(...) < radius, sans produit cartésien par clé : les points sont
+    rangés dans une grille 3D (cellules de GEO_CELL_M sur la sphère) et seules les 27 cellules
+    voisines sont jointes. Paires triées comme le merge (supprimées puis ajoutées dans l'ordre).
+    """
+    groups = (pd.concat([keys_rem, keys_add], ignore_index=True)
+              .groupby(list(keys_rem.columns), dropna=False, sort=False).ngroup().to_numpy())
+
+    def cells(lat, lon, valid):
+        keep = valid & np.isfinite(lat) & np.isfinite(lon)
+        lat_r, lon_r = np.radians(lat[keep]), np.radians(lon[keep])
+        xyz = EARTH_RADIUS_M * np.column_stack([np.cos(lat_r) * np.cos(lon_r), np.cos(lat_r) * np.sin(lon_r), np.sin(lat_r)])
+        return np.flatnonzero(keep), np.floor(xyz / GEO_CELL_M).astype(np.int64)
+
+    pos_rem, cell_rem = cells(lat_rem, lon_rem, valid_rem)
+    pos_add, cell_add = cells(lat_add, lon_add, valid_add)
+    added = pd.DataFrame({'g': groups[len(keys_rem):][pos_add], 'x': cell_add[:, 0], 'y': cell_add[:, 1],
+                          'z': cell_add[:, 2], 'pos_add': pos_add})
+    pairs = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                removed = pd.DataFrame({'g': groups[:len(keys_rem)][pos_rem], 'x': cell_rem[:, 0] + dx,
+                                        'y': cell_rem[:, 1] + dy, 'z': cell_rem[:, 2] + dz, 'pos_rem': pos_rem})
+                pairs.append(removed.merge(added, on=['g', 'x', 'y', 'z'])[['pos_rem', 'pos_add']])
+    pairs = pd.concat(pairs, ignore_index=True).sort_values(['pos_rem', 'pos_add'])
+    pr, pa = pairs['pos_rem'].to_numpy(), pairs['pos_add'].to_numpy()
+    near = haversine_meters(lat_rem[pr], lon_rem[pr], lat_add[pa], lon_add[pa], thresholds=(radius,)) < radius
+    return pr[near], pa[near]
+
+
+def support_code_label(value, correspondances: Dict[int, str]) -> str:
+    """Libellé d'un code de support ANFR ("21", "21.0"...), "Inconnu" si vide ou non reconnu."""
+    value = str(value).strip()
+    if not value or not value.replace('.', '').replace('-', '').isdigit():
+        return "Inconnu"
+    try:
+        return correspondances.get(int(float(value)), "Inconnu")
+    except (ValueError, OverflowError):
+        return "Inconnu"
+
+
+def dates_before(dates: pd.Series, limit: str) -> np.ndarray:
+    """dates < limit (AAAA-MM-JJ), faux pour les dates manquantes.
+
+    Les dates ISO sont analysées une fois en datetime64 ; les autres valeurs gardent la
+    comparaison de chaînes d'origine, pour un résultat identique.
+    """
+    before = np.zeros(len(dates), dtype=bool)
+    present = dates.notna().to_numpy()
+    values = dates[present].astype(str)
+    iso = values.str.fullmatch(ISO_DATE_PATTERN).to_numpy(dtype=bool, copy=True)
+    parsed = pd.to_datetime(values[iso], format='%Y-%m-%d', errors='coerce')
+    # Dates ISO impossibles (2024-02-30...) : comparées comme texte
+    iso[iso] = parsed.notna().to_numpy()
+    present_before = (values < limit).to_numpy(dtype=bool, copy=True)
+    present_before[iso] = (parsed[parsed.notna()] < pd.Timestamp(limit)).to_numpy()
+    before[present] = present_before
+    return before
+
+
+def technology_sort_key(tech: str) -> Tuple[float, int]:
+    """Clé de tri d'une technologie : famille (TECH_ORDER) puis fréquence, non reconnues en dernier."""
+    match = TECH_PATTERN.match(tech.strip())
+    if match:
+        technology = match.group(1) or match.group(3)
+        frequency = match.group(2) or match.group(4)
+        return (TECH_ORDER.get(technology, float('inf')), int(frequency))
+    return (float('inf'), 0)
+
+
+def build_tech_ranks(techs) -> Dict[str, int]:
+    """Rang entier de chaque technologie selon technology_sort_key (même rang pour des clés égales)."""
+    keys = {tech: technology_sort_key(tech) for tech in techs}
+    ranks = {key: rank for rank, key in enumerate(sorted(set(keys.values())))}
+    return {tech: ranks[key] for tech, key in keys.items()}
+
+
+def factor_classes(values: pd.Series, classes: dict) -> np.ndarray:
+    """Code de classe de chaque valeur (0 si absente de classes ou manquante), calculé par valeur distincte."""
+    codes, uniques = pd.factorize(values)
+    lookup = np.array([classes.get(value, 0) for value in uniques] + [0], dtype=np.intp)
+    return lookup[codes]
+
+
+def action_rule(source: int, statut_x: int, statut_y: int, date_changed: bool, before_limit: bool) -> str:
+    """Règle de référence des actions, évaluée une fois par combinaison pour construire ACTION_TABLE.
+
+    Args:
+        source: 0 inconnue, puis 1 + position dans DIFF_SOURCES (ajout, modification, suppression)
+        statut_x, statut_y: STATUT_OTHER, STATUT_PROJECT ou STATUT_ACTIVE (ancien, nouveau)
+        date_changed: date_activ_x != date_activ_y
+        before_limit: date_activ_y présente et antérieure à la date limite d'activation
+    """
+    if source == 1:
+        if statut_y == STATUT_ACTIVE:
+            return 'AJR' if before_limit else 'AJA'
+        return 'AJO'
+    if source == 3:
+        return 'SUP'
+    if source == 2:
+        if statut_x == STATUT_PROJECT and statut_y == STATUT_PROJECT and date_changed:
+            return 'AAV'
+        if statut_x == STATUT_PROJECT and statut_y == STATUT_ACTIVE:
+            return 'ART' if before_limit else 'ALL'
+        if statut_x == STATUT_ACTIVE and statut_y == STATUT_PROJECT:
+            return 'EXT'
+    return 'UNKNOWN'
+
+
+def build_action_table() -> Tuple[np.ndarray, np.ndarray]:
+    """Table (source, statut_x, statut_y, date_changed, before_limit) -> code d'action, et libellés."""
+    shape = (len(DIFF_SOURCES) + 1, 3, 3, 2, 2)
+    rules = {combo: action_rule(*combo) for combo in np.ndindex(*shape)}
+    actions = np.array(['UNKNOWN'] + sorted(set(rules.values()) - {'UNKNOWN'}), dtype=object)
+    codes = {action: code for code, action in enumerate(actions)}
+    table = np.zeros(shape, dtype=np.int8)
+    for combo, action in rules.items():
+        table[combo] = codes[action]
+    return table, actions
+
+
+def activation_limit_date(timestamp: str) -> str:
+    """Date (AAAA-MM-JJ) avant laquelle une activation est un rattrapage : 28 jours avant la MAJ."""
+    return (datetime.strptime(timestamp, "%d/%m/%Y à %H:%M:%S") - timedelta(days=28)).strftime("%Y-%m-%d")
+
+
+ACTION_TABLE, ACTIONS = build_action_table()
+
+
 class OptimizedProcessor:
-    def __init__(self):
-        self.insee_data: Dict[str, str] = {}
-        self.techs_new_map: Dict[Tuple[str, str], Set[str]] = {}
-        self.techs_old_map: Dict[Tuple[str, str], Set[str]] = {}
-        self.new_status_dict: Dict[Tuple[str, str], List[str]] = defaultdict(list)
-        
-        # Cache pour les calculs coûteux
-        self._zb_cache: Dict[Tuple[str, str], bool] = {}
-        self._new_cache: Dict[Tuple[str, str], bool] = {}
+    def __init__(self, timestamp: str, update_type: str):
+        self.timestamp = timestamp
+        self.update_type = update_type
+        self.activation_limit_date = activation_limit_date(timestamp)
+        # Table INSEE compilée (functions_anfr.load_insee_lookup) : codes triés, indice de libellé, libellés
+        self.insee_codes = np.array([], dtype=str)
+        self.insee_label_codes = np.array([], dtype=np.int32)
+        self.insee_labels = np.array([], dtype=str)
+        # Agrégats par (id_support, operateur), joints sur final_df pour is_zb et is_new
+        self.techs_new_map: pd.Series = pd.Series(dtype='uint64')
+        self.techs_old_map: pd.Series = pd.Series(dtype='uint64')
+        self.new_status_dict: pd.Series = pd.Series(dtype=bool)
+        # Rang de tri de chaque valeur de technologie (emr_lb_systeme) observée
+        self.tech_ranks: Dict[str, int] = {}
     
-    def load_insee_data_optimized(self, filepath: str, encoding: str = 'utf-8') -> Dict[str, str]:
-        """Charge les données INSEE de manière optimisée."""
+    def load_insee_data_optimized(self, filepath: str, encoding: str = 'utf-8') -> int:
+        """Charge la table INSEE compilée, recompilée depuis le CSV seulement si son contenu a changé.
+
+        Returns:
+            Nombre de codes INSEE connus
+        """
         try:
-            with open(filepath, mode='r', encoding=encoding) as file:
-                reader = csv.reader(file, delimiter=';')
-                # Création directe du dictionnaire optimisé
-                self.insee_data = {
-                    row[0].zfill(5): f"{row[2]} {row[1]}"
-                    for row in reader if len(row) >= 3 and row[0]
-                }
+            self.insee_codes, self.insee_label_codes, self.insee_labels = functions_anfr.load_insee_lookup(
+                filepath, encoding)
             functions_anfr.log_message("Données INSEE chargées avec succès.")
         except UnicodeDecodeError:
             functions_anfr.log_message(f"Erreur de décodage avec l'encodage {encoding}.", "ERROR")
@@ -120,13 +342,32 @@ class OptimizedProcessor:
             raise SystemExit(1)
         except Exception as e:
             functions_anfr.log_message(f"Problème lors du chargement des données INSEE - {e}", "ERROR")
-        return self.insee_data
+        return len(self.insee_codes)
     
     def conv_insee_vectorized(self, codes_insee: pd.Series) -> pd.Series:
-        """Version vectorisée de la conversion INSEE."""
-        return (codes_insee.astype(str).str.zfill(5)
-                .map(self.insee_data)
-                .fillna("00404 ERR CONV INSEE"))
+        """Version vectorisée de la conversion INSEE : recherche dichotomique, libellés en Categorical."""
+        keys = codes_insee.astype(str).str.zfill(5).to_numpy(dtype=object).astype(str)
+        n_codes = len(self.insee_codes)
+        if n_codes:
+            pos = np.minimum(np.searchsorted(self.insee_codes, keys), n_codes - 1)
+            found = self.insee_codes[pos] == keys
+        else:
+            pos = np.zeros(len(keys), dtype=np.intp)
+            found = np.zeros(len(keys), dtype=bool)
+        
+        labels = pd.Index(self.insee_labels)
+        if INSEE_UNKNOWN in labels:
+            unknown_code = labels.get_loc(INSEE_UNKNOWN)
+        else:
+            unknown_code = len(labels)
+            labels = labels.append(pd.Index([INSEE_UNKNOWN]))
+        label_codes = np.where(found, self.insee_label_codes[pos] if n_codes else unknown_code, unknown_code)
+        
+        n_unknown = int((~found).sum())
+        if n_unknown:
+            functions_anfr.log_message(f"{n_unknown} code(s) INSEE non converti(s) : \"{INSEE_UNKNOWN}\".", "WARN")
+        return pd.Series(pd.Categorical.from_codes(label_codes, categories=labels),
+                         index=codes_insee.index, name=codes_insee.name)
     
     def maj_addr_vectorized(self, df: pd.DataFrame) -> pd.Series:
         """Version vectorisée de maj_addr."""
@@ -138,9 +379,15 @@ class OptimizedProcessor:
             functions_anfr.log_message("Aucune colonne d'adresse trouvée", "WARN")
             return pd.Series(["00404 ERR ADDRESS"] * len(df), index=df.index)
         
-        addr_parts = df[existing_addr_cols].fillna('').apply(
-            lambda row: ' '.join(filter(None, row.astype(str))), axis=1
-        )
+        # Concaténation colonne par colonne, l'espace n'étant ajouté qu'entre deux parties non vides.
+        # astype(str) donne le même dtype que l'ancien apply (chaînes Arrow avec pandas 3), donc la
+        # même mise en majuscules
+        parts = [df[col].fillna('').astype(str) for col in existing_addr_cols]
+        addr_parts = parts[0]
+        for part in parts[1:]:
+            addr_parts = addr_parts.str.cat(part, sep=' ').where(
+                (addr_parts != '') & (part != ''), addr_parts + part
+            )
         
         # Ajouter adresse0 si présente
         if 'adresse0' in df.columns:
@@ -150,11 +397,12 @@ class OptimizedProcessor:
         
         # Conversion INSEE vectorisée
         if 'code_insee' in df.columns:
-            insee_converted = self.conv_insee_vectorized(df['code_insee'])
+            # Retour au texte : même dtype (et même mise en majuscules) que la concaténation d'avant
+            insee_converted = self.conv_insee_vectorized(df['code_insee']).astype(str)
             return (addr_parts + ' ' + insee_converted).str.upper()
         else:
             functions_anfr.log_message("Colonne code_insee manquante", "WARN")
-            return (addr_parts + ' 00404 ERR CONV INSEE').str.upper()
+            return (addr_parts + ' ' + INSEE_UNKNOWN).str.upper()
     
     def preprocess_csv_optimized(self, file_path: str, source: str, sep: str) -> pd.DataFrame:
         """Version optimisée du chargement CSV."""
@@ -173,14 +421,13 @@ class OptimizedProcessor:
                 'statut_y', 'date_activ_y'
             ]
 
-            df_sample = pd.read_csv(file_path, on_bad_lines="skip", dtype=str, sep=sep, engine='c')
-            available_cols = df_sample.columns.tolist()
+            # Une seule lecture : l'en-tête suffit pour lister les colonnes disponibles
+            df = pd.read_csv(file_path, on_bad_lines="skip", dtype=str, sep=sep, engine='c')
+            available_cols = df.columns.tolist()
             
             # Prendre les colonnes de base disponibles + les colonnes avec suffixe disponibles
             usecols = [col for col in base_cols + suffixed_cols if col in available_cols]
             
-            # Chargement avec les colonnes disponibles seulement
-            df = pd.read_csv(file_path, on_bad_lines="skip", dtype=str, sep=sep, engine='c')
             df['source'] = source
             
             functions_anfr.log_message(f"Chargement du fichier '{file_path}' terminé avec succès.")
@@ -191,31 +438,69 @@ class OptimizedProcessor:
         except Exception as e:
             functions_anfr.log_message(f"Erreur chargement '{file_path}' - {e}", "FATAL")
             raise SystemExit(1)
+
+    def preprocess_frame_optimized(self, df: pd.DataFrame, source: str) -> pd.DataFrame:
+        """Équivalent de preprocess_csv_optimized pour un résultat passé en mémoire par compare.py."""
+        df = functions_anfr.csv_round_trip(df)
+        df['source'] = source
+        functions_anfr.log_message(f"Données '{source}' reçues de compare.py ({len(df):,} lignes).")
+        return df
+
+    def load_diff_optimized(self, file_path: str, source: str) -> pd.DataFrame:
+        """Charge un résultat de compare.py : fichier Arrow en memory-map s'il existe, sinon le CSV."""
+        arrow_path = functions_anfr.intermediate_path(file_path)
+        if not os.path.exists(arrow_path):
+            return self.preprocess_csv_optimized(file_path, source, sep=',')
+        try:
+            return self.preprocess_frame_optimized(functions_anfr.read_intermediate(arrow_path), source)
+        except Exception as e:
+            functions_anfr.log_message(f"Erreur chargement '{arrow_path}' - {e}", "FATAL")
+            raise SystemExit(1)
     
-    @lru_cache(maxsize=1000)
     def sort_technologies_optimized(self, tech_string: str) -> str:
-        """Version optimisée et mise en cache du tri des technologies."""
+        """Tri des technologies d'une chaîne "a, b, c" (libellés contenant eux-mêmes ", " uniquement)."""
         if not tech_string or pd.isna(tech_string):
             return ""
         
-        elements = tech_string.split(", ")
-        
-        def sort_key(tech: str) -> Tuple[int, int]:
-            match = TECH_PATTERN.match(tech.strip())
-            if match:
-                technology = match.group(1) or match.group(3)
-                frequency = match.group(2) or match.group(4)
-                return (TECH_ORDER.get(technology, float('inf')), int(frequency))
-            return (float('inf'), 0)
-        
-        return ", ".join(sorted(elements, key=sort_key))
+        return ", ".join(sorted(tech_string.split(", "), key=technology_sort_key))
+    
+    def technology_ranks(self, techs: pd.Series) -> np.ndarray:
+        """Rang de chaque ligne dans self.tech_ranks, table complétée si une valeur n'y figure pas encore."""
+        codes, uniques = pd.factorize(techs)
+        missing = [tech for tech in uniques if tech not in self.tech_ranks]
+        if missing:
+            self.tech_ranks = build_tech_ranks(list(self.tech_ranks) + missing)
+        return np.array([self.tech_ranks[tech] for tech in uniques] + [-1], dtype=np.intp)[codes]
     
     def determine_action_vectorized(self, df: pd.DataFrame) -> pd.Series:
-        """Version vectorisée de determine_action."""
-        result = pd.Series(index=df.index, dtype=str)
-        
+        """Version vectorisée de determine_action : codes (source, statuts, dates) puis ACTION_TABLE."""
         # Changements détectés (CHA, CHI, CHL, et combinaisons)
         mask_cha = df['source'] == 'comp_change.csv'
+        mask_mod = df['source'] == 'comp_modified.csv'
+        
+        source = factor_classes(df['source'], {src: i + 1 for i, src in enumerate(DIFF_SOURCES)})
+        statut_y = factor_classes(df['statut_y'], STATUT_CLASSES)
+        # Chaque date distincte n'est analysée qu'une fois
+        date_codes, dates = pd.factorize(df['date_activ_y'])
+        before_limit = np.append(dates_before(pd.Series(dates), self.activation_limit_date), False)[date_codes]
+        
+        # Vérifier la présence des colonnes nécessaires aux lignes modifiées
+        required_cols = ['statut_x', 'statut_y', 'date_activ_x', 'date_activ_y']
+        missing_cols = [col for col in required_cols if col not in df.columns]
+        if missing_cols:
+            if mask_mod.any():
+                functions_anfr.log_message(f"Colonnes manquantes pour determine_action: {missing_cols}", "WARN")
+            statut_x = np.zeros(len(df), dtype=np.intp)
+            date_changed = np.zeros(len(df), dtype=np.intp)
+        else:
+            statut_x = factor_classes(df['statut_x'], STATUT_CLASSES)
+            date_changed = (df['date_activ_x'] != df['date_activ_y']).to_numpy(dtype=np.intp)
+        
+        codes = ACTION_TABLE[source, statut_x, statut_y, date_changed, before_limit.astype(np.intp)]
+        if missing_cols:
+            codes[mask_mod.to_numpy()] = 0
+        result = pd.Series(ACTIONS[codes], index=df.index, dtype=str)
+        
         # Utiliser la colonne action directement si elle existe
         if 'action' in df.columns and df[mask_cha]['action'].notna().any():
             result.loc[mask_cha] = df.loc[mask_cha, 'action']
@@ -223,111 +508,11 @@ class OptimizedProcessor:
             # Fallback si action n'est pas déjà définie
             result.loc[mask_cha] = 'CHA'
         
-        # ==========================
-        # AJO / ALL / AJA
-        # ==========================
-
-        mask_ajo = df['source'] == 'comp_added.csv'
-
-        mask_activation = (
-            mask_ajo &
-            df['statut_y'].isin([
-                "En service",
-                "Techniquement opérationnel"
-            ])
-        )
-
-        mask_activation_rt = (
-            mask_activation &
-            df['date_activ_y'].notna() &
-            (df['date_activ_y'] < ACTIVATION_LIMIT_DATE)
-        )
-
-        result.loc[mask_activation_rt] = 'AJR'
-        result.loc[
-            mask_activation &
-            ~mask_activation_rt
-        ] = 'AJA'
-
-        # Ajout seul
-        result.loc[
-            mask_ajo &
-            ~mask_activation
-        ] = 'AJO'
-
-        
-        # SUP pour comp_removed
-        mask_sup = df['source'] == 'comp_removed.csv'
-        result.loc[mask_sup] = 'SUP'
-        
-        # Logique complexe pour comp_modified
-        mask_mod = df['source'] == 'comp_modified.csv'
-        if mask_mod.any():
-            mod_df = df.loc[mask_mod].copy()
-            
-            # Vérifier la présence des colonnes nécessaires
-            required_cols = ['statut_x', 'statut_y', 'date_activ_x', 'date_activ_y']
-            missing_cols = [col for col in required_cols if col not in mod_df.columns]
-            
-            if missing_cols:
-                functions_anfr.log_message(f"Colonnes manquantes pour determine_action: {missing_cols}", "WARN")
-                result.loc[mask_mod] = "UNKNOWN"
-                return result.fillna("UNKNOWN")
-            
-            statut_x = mod_df['statut_x']
-            statut_y = mod_df['statut_y']
-            date_activ_x = mod_df['date_activ_x']
-            date_activ_y = mod_df['date_activ_y']
-            
-            # Conditions vectorisées avec gestion sécurisée des NaN
-            cond_aav = (
-                (statut_x == 'Projet approuvé') & 
-                (statut_y == 'Projet approuvé') &
-                (date_activ_x != date_activ_y)
-            )
-
-            cond_art = (
-                (statut_x == 'Projet approuvé') &
-                (statut_y.isin(['Techniquement opérationnel', 'En service'])) &
-                date_activ_y.notna() &
-                (date_activ_y < ACTIVATION_LIMIT_DATE)
-            )
-            
-            cond_all = (
-                (statut_x == 'Projet approuvé') &
-                (statut_y.isin(['Techniquement opérationnel', 'En service'])) &
-                ~cond_art
-            )
-            
-            cond_ext = (
-                (statut_x.isin(['En service', 'Techniquement opérationnel'])) &
-                (statut_y == 'Projet approuvé')
-            )
-            
-            # Appliquer les conditions avec les index corrects
-            mod_indices = mod_df.index
-            result.loc[mod_indices[cond_aav]] = 'AAV'
-            result.loc[mod_indices[cond_all & ~cond_aav]] = 'ALL'
-            result.loc[mod_indices[cond_art & ~cond_aav]] = 'ART'
-            result.loc[mod_indices[cond_ext & ~cond_aav & ~cond_all]] = 'EXT'
-        
         return result.fillna("UNKNOWN")
 
-    def extract_tech_dict_optimized(self, df: pd.DataFrame) -> Dict[Tuple[str, str], Set[str]]:
-        """Version optimisée d'extract_tech_dict."""
-        df_clean = df.dropna(subset=["sup_id", "adm_lb_nom", "emr_lb_systeme"])
-        if df_clean.empty:
-            return {}
-
-        result = defaultdict(set)
-        for sup_id, oper, tech in zip(
-            df_clean["sup_id"],
-            df_clean["adm_lb_nom"],
-            df_clean["emr_lb_systeme"]
-        ):
-            result[(sup_id, oper)].add(tech)
-        
-        return dict(result)
+    def extract_tech_dict_optimized(self, df: pd.DataFrame) -> pd.Series:
+        """Version optimisée d'extract_tech_dict : masque de bandes (bands_anfr) par (support, opérateur)."""
+        return bands_anfr.support_bands(df)["bandes"]
     
     def format_technology_with_changes(self, techs_str: str, old_value: Optional[str], change_type: str) -> str:
         """Formate le champ technologie en intégrant les anciennes valeurs pour CHA/CHI/CHL.
@@ -361,55 +546,45 @@ class OptimizedProcessor:
             return f"{techs_str} {change_label}"
         return techs_str
     
-    def build_new_status_map_optimized(self, df_old: pd.DataFrame) -> Dict[Tuple[str, str], List[str]]:
-        """Version optimisée de build_new_status_map."""
-        required_cols = ["sup_id", "adm_lb_nom", "statut"]
+    def format_old_support_values(self, values: pd.Series) -> np.ndarray:
+        """Libellés des anciennes valeurs d'attribut de support pour la colonne infos (CHT/CHP/CHH)."""
+        if values.name == 'hauteur_support':
+            return (values.fillna('0').astype(str).str.replace('.', ',', regex=False) + 'm').to_numpy()
+        
+        correspondances = (CORRESPONDANCES_TYPE_SUPPORT if values.name == 'type_support'
+                           else CORRESPONDANCES_PROPRIETAIRE_SUPPORT)
+        labels = {value: support_code_label(value, correspondances) for value in values.dropna().unique()}
+        return values.map(labels).fillna("Inconnu").to_numpy()
+    
+    def build_new_status_map_optimized(self, df_old: pd.DataFrame) -> pd.Series:
+        """Version optimisée de build_new_status_map : vrai si tous les statuts du support sont "Projet approuvé"."""
+        required_cols = ["id_support", "operateur", "statut"]
         missing_cols = [col for col in required_cols if col not in df_old.columns]
         
         if missing_cols:
             functions_anfr.log_message(f"Colonnes manquantes pour build_new_status_map: {missing_cols}", "WARN")
-            return defaultdict(list)
+            return pd.Series(dtype=bool)
         
         df_clean = df_old.dropna(subset=required_cols)
-        if df_clean.empty:
-            return defaultdict(list)
-        
-        grouped = df_clean.groupby(["sup_id", "adm_lb_nom"])["statut"].apply(list)
-        return defaultdict(list, grouped.to_dict())
-    
-    def is_zb_cached(self, support_id: str, operateur: str) -> bool:
-        """Version mise en cache de is_zb."""
-        if operateur not in ZB_OPERATEURS:
-            return False
-            
-        key = (str(support_id).strip(), operateur)
-        
-        if key in self._zb_cache:
-            return self._zb_cache[key]
-        
-        techs_new = self.techs_new_map.get(key, set())
-        techs_old = self.techs_old_map.get(key, set())
-        
-        result = (
-            (len(techs_new) > 0 and techs_new <= ZB_TECHNOS) or
-            (len(techs_old) > 0 and techs_old <= ZB_TECHNOS)
-        )
-        
-        self._zb_cache[key] = result
-        return result
+        return (df_clean["statut"] == "Projet approuvé").groupby(
+            [df_clean["id_support"], df_clean["operateur"]]).all()
     
-    def is_new_cached(self, support_id: str, operateur: str) -> bool:
-        """Version mise en cache de is_new."""
-        key = (str(support_id).strip(), operateur)
+    def support_flags_vectorized(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Calcule is_zb et is_new par jointure des agrégats par support sur (id_support, operateur)."""
+        keys = pd.MultiIndex.from_arrays([df['id_support'].astype(str).str.strip(), df['operateur']])
         
-        if key in self._new_cache:
-            return self._new_cache[key]
+        def lookup(aggregate: pd.Series, default) -> np.ndarray:
+            if aggregate.empty:
+                return np.full(len(keys), default)
+            return aggregate.reindex(keys, fill_value=default).to_numpy()
         
-        statuts = self.new_status_dict.get(key, [])
-        result = not statuts or all(stat == "Projet approuvé" for stat in statuts)
-        
-        self._new_cache[key] = result
-        return result
+        # Zone blanche : toutes les bandes du support dans ZB_TECHNOS, dans l'ancien ou le nouvel instantané
+        is_zb = (df['operateur'].isin(ZB_OPERATEURS).to_numpy() &
+                 (bands_anfr.only_in(lookup(self.techs_new_map, 0), ZB_MASK) |
+                  bands_anfr.only_in(lookup(self.techs_old_map, 0), ZB_MASK)))
+        # Nouveau site : aucun statut connu ou uniquement des projets approuvés
+        is_new = lookup(self.new_status_dict, True).astype(bool)
+        return is_zb, is_new
     
     def find_and_isolate_duplicates_optimized(self, df: pd.DataFrame, 
                                             location_threshold: float = 0.001, 
@@ -421,90 +596,110 @@ class OptimizedProcessor:
         # Pré-filtrage par grille spatiale
         coords = df['coordonnees'].str.split(', ', expand=True).astype(float)
         grid_size = location_threshold * 5  # Grille plus large pour capturer les voisins
+        grid_x = (coords.iloc[:, 0] / grid_size).astype(int).to_numpy()
+        grid_y = (coords.iloc[:, 1] / grid_size).astype(int).to_numpy()
         
-        df_work = df.copy()
-        df_work['grid_x'] = (coords.iloc[:, 0] / grid_size).astype(int)
-        df_work['grid_y'] = (coords.iloc[:, 1] / grid_size).astype(int)
+        # Lignes rangées une seule fois par cellule de grille
+        buckets: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        for pos, cell in enumerate(zip(grid_x.tolist(), grid_y.tolist())):
+            buckets[cell].append(pos)
         
         # Ajouter les grilles voisines pour éviter les effets de bord
         neighbors = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 0), (0, 1), (1, -1), (1, 0), (1, 1)]
         
-        duplicates_list = []
-        processed_pairs = set()
+        # Coordonnées converties une fois par valeur distincte, comme float() le faisait par candidat
+        parsed_coords = {}
+        for coord in df['coordonnees'].unique():
+            parsed_coords[coord] = [float(x) for x in coord.split(', ')]
+        points = np.array([parsed_coords[coord] for coord in df['coordonnees']])
+        
+        adresses = df['adresse'].to_numpy(dtype=object)
+        technologies = df['technologie'].to_numpy(dtype=object)
+        operateurs = df['operateur'].to_numpy(dtype=object)
+        actions = df['action'].to_numpy(dtype=object)
+        address_tokens: Dict[str, Set[str]] = {}
+        tech_sets: Dict[str, frozenset] = {}
+        
+        def tokens(pos: int) -> Set[str]:
+            addr = adresses[pos]
+            if addr not in address_tokens:
+                address_tokens[addr] = set(addr.lower().split())
+            return address_tokens[addr]
+        
+        def techs(pos: int) -> frozenset:
+            tech = technologies[pos]
+            if tech not in tech_sets:
+                tech_sets[tech] = frozenset(tech.split(", "))
+            return tech_sets[tech]
         
-        for _, row in df_work.iterrows():
-            if row.name in processed_pairs:
+        # Parcours glouton dans l'ordre des lignes : une ligne déjà appariée n'est plus candidate
+        processed = np.zeros(len(df), dtype=bool)
+        is_duplicate = np.zeros(len(df), dtype=bool)
+        
+        for pos in range(len(df)):
+            if processed[pos]:
                 continue
             
             # Chercher dans les grilles voisines
-            candidates = []
-            for dx, dy in neighbors:
-                grid_x, grid_y = row['grid_x'] + dx, row['grid_y'] + dy
-                mask = (df_work['grid_x'] == grid_x) & (df_work['grid_y'] == grid_y)
-                candidates.extend(df_work[mask].index.tolist())
-            
-            candidates = list(set(candidates))  # Remove duplicates
-            candidates = [c for c in candidates if c != row.name and c not in processed_pairs]
+            gx, gy = grid_x[pos], grid_y[pos]
+            candidates = [c for dx, dy in neighbors for c in buckets.get((gx + dx, gy + dy), ())
+                          if c != pos and not processed[c]]
             
             if not candidates:
                 continue
             
-            candidate_rows = df_work.loc[candidates]
-            
-            # Vérifications vectorisées sur les candidats
-            coords_row = np.array([float(x) for x in row['coordonnees'].split(', ')])
-            coords_candidates = np.array([
-                [float(x) for x in coord.split(', ')] 
-                for coord in candidate_rows['coordonnees']
-            ])
-            
             # Distance euclidienne vectorisée
-            distances = np.sqrt(np.sum((coords_candidates - coords_row) ** 2, axis=1))
+            distances = np.sqrt(np.sum((points[candidates] - points[pos]) ** 2, axis=1))
             location_matches = distances <= location_threshold
             
             if not location_matches.any():
                 continue
             
             # Vérifier la similarité d'adresse et les autres critères
-            for i, candidate_idx in enumerate(candidates):
-                if not location_matches[i]:
+            for candidate_pos, location_match in zip(candidates, location_matches):
+                if not location_match:
                     continue
                 
-                candidate = df_work.loc[candidate_idx]
-                
-                # Similarité d'adresse simple
-                addr1_tokens = set(row['adresse'].lower().split())
-                addr2_tokens = set(candidate['adresse'].lower().split())
-                intersection = addr1_tokens & addr2_tokens
-                union = addr1_tokens | addr2_tokens
-                addr_similarity = len(intersection) / len(union) if union else 0
+                # Similarité d'adresse simple (Jaccard sur les mots)
+                addr1_tokens = tokens(pos)
+                addr2_tokens = tokens(candidate_pos)
+                union = len(addr1_tokens | addr2_tokens)
+                addr_similarity = len(addr1_tokens & addr2_tokens) / union if union else 0
                 
                 if addr_similarity < address_similarity_threshold:
                     continue
                 
                 # Vérifier technologie, opérateur et action
-                tech1 = frozenset(row['technologie'].split(", "))
-                tech2 = frozenset(candidate['technologie'].split(", "))
-                
-                if (tech1 == tech2 and 
-                    row['operateur'] == candidate['operateur'] and 
-                    row['action'] != candidate['action']):
+                if (techs(pos) == techs(candidate_pos) and 
+                    operateurs[pos] == operateurs[candidate_pos] and 
+                    actions[pos] != actions[candidate_pos]):
                     
-                    duplicates_list.extend([row.name, candidate_idx])
-                    processed_pairs.update([row.name, candidate_idx])
+                    is_duplicate[[pos, candidate_pos]] = True
+                    processed[[pos, candidate_pos]] = True
         
-        if duplicates_list:
-            return df.loc[list(set(duplicates_list))]
+        if is_duplicate.any():
+            return df[is_duplicate]
         return pd.DataFrame()
     
     def merge_and_process_optimized(self, added_path: str, modified_path: str, 
-                                  removed_path: str, output_path: str) -> None:
-        """Version optimisée de merge_and_process."""
+                                  removed_path: str, output_path: str,
+                                  diffs: Optional[Dict[str, pd.DataFrame]] = None) -> None:
+        """Version optimisée de merge_and_process.
+
+        diffs: résultats de compare.py déjà en mémoire (clés DIFF_SOURCES), à la place des fichiers.
+        """
         try:
             # Chargement optimisé des fichiers
-            added_df = self.preprocess_csv_optimized(added_path, 'comp_added.csv', sep=',')
-            modified_df = self.preprocess_csv_optimized(modified_path, 'comp_modified.csv', sep=',')
-            removed_df = self.preprocess_csv_optimized(removed_path, 'comp_removed.csv', sep=',')
+            record = report_anfr.start("pretrait.load_diffs")
+            if diffs is not None:
+                added_df, modified_df, removed_df = (
+                    self.preprocess_frame_optimized(diffs[source], source) for source in DIFF_SOURCES
+                )
+            else:
+                added_df = self.load_diff_optimized(added_path, 'comp_added.csv')
+                modified_df = self.load_diff_optimized(modified_path, 'comp_modified.csv')
+                removed_df = self.load_diff_optimized(removed_path, 'comp_removed.csv')
+            report_anfr.stop(record, rows_out=len(added_df) + len(modified_df) + len(removed_df))
 
             if added_df.empty and modified_df.empty and removed_df.empty:
                 functions_anfr.log_message("Tous les fichiers sont vides.", "FATAL")
@@ -515,33 +710,14 @@ class OptimizedProcessor:
             indices_to_remove_added = []
             indices_to_remove_removed = []
             
-            def parse_coords(coord_str):
-                """Parse 'lat , lon' format et retourne (lat, lon) en float, ou (None, None)"""
-                if pd.isna(coord_str):
-                    return (None, None)
-                try:
-                    # Normaliser le format et split
-                    coord_str = str(coord_str).replace(' ', '')
-                    parts = coord_str.split(',')
-                    if len(parts) == 2:
-                        return (float(parts[0]), float(parts[1]))
-                except:
-                    pass
-                return (None, None)
-            
-            def coord_distance_meters(lat1, lon1, lat2, lon2):
-                """Approximation simple de la distance entre deux points en mètres
-                Utilise la formule de Haversine simplifiée"""
-                if lat1 is None or lat2 is None:
-                    return None
-                R = 6371000  # Rayon terrestre en mètres
-                dlat = math.radians(lat2 - lat1)
-                dlon = math.radians(lon2 - lon1)
-                a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-                c = 2 * math.asin(math.sqrt(a))
-                return R * c
-            
             if not added_df.empty and not removed_df.empty:
+                # Coordonnées parsées une seule fois par ligne, pour CHI géographique et CHL
+                if 'coordonnees' in added_df.columns and 'coordonnees' in removed_df.columns:
+                    lat_rem, lon_rem, valid_rem = parse_coords_array(removed_df['coordonnees'])
+                    lat_add, lon_add, valid_add = parse_coords_array(added_df['coordonnees'])
+
+                detected = len(indices_to_remove_added)
+                record = report_anfr.start("pretrait.detect_CHA", rows_in=len(added_df) + len(removed_df))
                 # === Détection de CHA: même ID support, opérateur, techno, coords → adresse change ===
                 # Merge sur id_support + operateur + technologie + coordonnees
                 merge_cols_cha = ['id_support', 'operateur', 'technologie', 'code_insee', 'coordonnees']
@@ -596,6 +772,10 @@ class OptimizedProcessor:
                             change_dfs['CHA'] = change_df
                             functions_anfr.log_message(f"Détecté {len(change_df)} changements CHA.")
                 
+                report_anfr.stop(record, rows_out=len(indices_to_remove_added) - detected)
+                
+                detected = len(indices_to_remove_added)
+                record = report_anfr.start("pretrait.detect_CHI_geo", rows_in=len(added_df) + len(removed_df))
                 # === Détection de CHI GÉOGRAPHIQUE: sites proches avec ID différent (fusion multiple changements) ===
                 # Cette détection capture les cas où un support change d'ID mais reste géographiquement au même endroit
                 # avec possibilité de changements d'adresse, hauteur, propriétaire, etc.
@@ -604,77 +784,65 @@ class OptimizedProcessor:
                     available_cols_chi_geo = [col for col in merge_cols_chi_geo if col in added_df.columns and col in removed_df.columns]
                     
                     if available_cols_chi_geo == merge_cols_chi_geo:
-                        # Merge large sur opérateur + techno + code_insee
-                        removed_chi_geo = removed_df[available_cols_chi_geo + ['id_support', 'coordonnees']].copy()
-                        added_chi_geo = added_df[available_cols_chi_geo + ['id_support', 'coordonnees']].copy()
-                        removed_chi_geo['_idx_rem'] = removed_df.index
-                        added_chi_geo['_idx_add'] = added_df.index
-                        
-                        matched_chi_geo = pd.merge(removed_chi_geo, added_chi_geo, on=available_cols_chi_geo, how='inner', suffixes=('_rem', '_add'))
+                        # Paires opérateur + techno + code_insee à moins de 100m, via la grille spatiale
+                        pos_rem, pos_add = neighbour_pairs(
+                            removed_df[available_cols_chi_geo], lat_rem, lon_rem, valid_rem,
+                            added_df[available_cols_chi_geo], lat_add, lon_add, valid_add,
+                            radius=100
+                        )
+                        # Même ID, pas intéressant (comparaison Python : NaN != NaN)
+                        id_diff = (removed_df['id_support'].to_numpy(dtype=object)[pos_rem] !=
+                                   added_df['id_support'].to_numpy(dtype=object)[pos_add])
+                        matched_chi_geo_filtered = pd.DataFrame({
+                            '_idx_rem': removed_df.index[pos_rem[id_diff]],
+                            '_idx_add': added_df.index[pos_add[id_diff]]
+                        })
                         
-                        if not matched_chi_geo.empty:
-                            # Filtrer sur proximité géographique (< 100m) et ID différent
-                            chi_geo_matches = []
-                            for idx, row in matched_chi_geo.iterrows():
-                                if row['id_support_rem'] == row['id_support_add']:
-                                    continue  # Même ID, pas intéressant
-                                
-                                # Calculer distance entre les deux points
-                                try:
-                                    lat1, lon1 = parse_coords(row['coordonnees_rem'])
-                                    lat2, lon2 = parse_coords(row['coordonnees_add'])
-                                    
-                                    if lat1 is not None and lat2 is not None:
-                                        dist = coord_distance_meters(lat1, lon1, lat2, lon2)
-                                        if dist is not None and dist < 100:  # Moins de 100m
-                                            chi_geo_matches.append(idx)
-                                except:
-                                    pass
+                        if not matched_chi_geo_filtered.empty:
+                            # CORRECTION : Créer un mapping idx_add -> idx_rem AVANT le filtrage
+                            mapping_add_to_rem = dict(zip(
+                                matched_chi_geo_filtered['_idx_add'],
+                                matched_chi_geo_filtered['_idx_rem']
+                            ))
+                            
+                            idx_rem = matched_chi_geo_filtered['_idx_rem'].tolist()
+                            idx_add = matched_chi_geo_filtered['_idx_add'].tolist()
                             
-                            if chi_geo_matches:
-                                matched_chi_geo_filtered = matched_chi_geo.loc[chi_geo_matches].copy()
+                            # Éviter les doublons avec CHA
+                            idx_rem_filtered = [i for i in idx_rem if i not in indices_to_remove_removed]
+                            idx_add_filtered = [i for i in idx_add if i not in indices_to_remove_added]
+                            
+                            # IMPORTANT : Garder seulement les paires cohérentes après filtrage
+                            valid_pairs = []
+                            for idx_a in idx_add_filtered:
+                                idx_r = mapping_add_to_rem.get(idx_a)
+                                if idx_r is not None and idx_r in idx_rem_filtered:
+                                    valid_pairs.append((idx_a, idx_r))
+                            
+                            if valid_pairs:
+                                idx_add_final = [pair[0] for pair in valid_pairs]
+                                idx_rem_final = [pair[1] for pair in valid_pairs]
+                                
+                                indices_to_remove_removed.extend(idx_rem_final)
+                                indices_to_remove_added.extend(idx_add_final)
                                 
-                                if not matched_chi_geo_filtered.empty:
-                                    # CORRECTION : Créer un mapping idx_add -> idx_rem AVANT le filtrage
-                                    mapping_add_to_rem = dict(zip(
-                                        matched_chi_geo_filtered['_idx_add'],
-                                        matched_chi_geo_filtered['_idx_rem']
-                                    ))
-                                    
-                                    idx_rem = matched_chi_geo_filtered['_idx_rem'].tolist()
-                                    idx_add = matched_chi_geo_filtered['_idx_add'].tolist()
-                                    
-                                    # Éviter les doublons avec CHA
-                                    idx_rem_filtered = [i for i in idx_rem if i not in indices_to_remove_removed]
-                                    idx_add_filtered = [i for i in idx_add if i not in indices_to_remove_added]
-                                    
-                                    # IMPORTANT : Garder seulement les paires cohérentes après filtrage
-                                    valid_pairs = []
-                                    for idx_a in idx_add_filtered:
-                                        idx_r = mapping_add_to_rem.get(idx_a)
-                                        if idx_r is not None and idx_r in idx_rem_filtered:
-                                            valid_pairs.append((idx_a, idx_r))
-                                    
-                                    if valid_pairs:
-                                        idx_add_final = [pair[0] for pair in valid_pairs]
-                                        idx_rem_final = [pair[1] for pair in valid_pairs]
-                                        
-                                        indices_to_remove_removed.extend(idx_rem_final)
-                                        indices_to_remove_added.extend(idx_add_final)
-                                        
-                                        change_df = added_df.loc[idx_add_final].copy()
-                                        change_df['source'] = 'comp_change.csv'
-                                        change_df['action'] = 'CHI'
-                                        
-                                        # Ajouter les anciens IDs de support (maintenant alignés)
-                                        old_ids = [removed_df.loc[idx_r, 'id_support'] for idx_r in idx_rem_final]
-                                        
-                                        change_df = change_df.reset_index(drop=True)
-                                        change_df['old_id_support'] = old_ids
-                                        
-                                        change_dfs['CHI'] = change_df
-                                        functions_anfr.log_message(f"Détecté {len(change_df)} changements CHI (géographique).")
+                                change_df = added_df.loc[idx_add_final].copy()
+                                change_df['source'] = 'comp_change.csv'
+                                change_df['action'] = 'CHI'
+                                
+                                # Ajouter les anciens IDs de support (maintenant alignés)
+                                old_ids = [removed_df.loc[idx_r, 'id_support'] for idx_r in idx_rem_final]
+                                
+                                change_df = change_df.reset_index(drop=True)
+                                change_df['old_id_support'] = old_ids
+                                
+                                change_dfs['CHI'] = change_df
+                                functions_anfr.log_message(f"Détecté {len(change_df)} changements CHI (géographique).")
+                
+                report_anfr.stop(record, rows_out=len(indices_to_remove_added) - detected)
                 
+                detected = len(indices_to_remove_added)
+                record = report_anfr.start("pretrait.detect_CHI", rows_in=len(added_df) + len(removed_df))
                 # === Détection de CHI: même opérateur, techno, coords, adresses → ID change ===
                 merge_cols_chi = ['operateur', 'technologie', 'code_insee', 'coordonnees']
                 available_cols_chi = [col for col in merge_cols_chi if col in added_df.columns and col in removed_df.columns]
@@ -725,6 +893,10 @@ class OptimizedProcessor:
                                 change_dfs['CHI'] = change_df
                                 functions_anfr.log_message(f"Détecté {len(change_df)} changements CHI.")
                 
+                report_anfr.stop(record, rows_out=len(indices_to_remove_added) - detected)
+                
+                detected = len(indices_to_remove_added)
+                record = report_anfr.start("pretrait.detect_CHL", rows_in=len(added_df) + len(removed_df))
                 # === Détection de CHL: même ID support, opérateur, techno, adresses → coordonnees changent ===
                 merge_cols_chl = ['id_support', 'operateur', 'technologie', 'adresse0', 'adresse1', 'adresse2', 'adresse3']
                 available_cols_chl = [col for col in merge_cols_chl if col in added_df.columns and col in removed_df.columns]
@@ -739,21 +911,16 @@ class OptimizedProcessor:
                     
                     if not matched_chl.empty:
                         # Vérifier coordonnées différentes
-                        coord_diff_mask = pd.Series(False, index=matched_chl.index)
-                        
-                        for idx, row in matched_chl.iterrows():
-                            lat1, lon1 = parse_coords(row['coordonnees_rem'])
-                            lat2, lon2 = parse_coords(row['coordonnees_add'])
-                            
-                            if lat1 is not None and lat2 is not None:
-                                try:
-                                    dist = coord_distance_meters(lat1, lon1, lat2, lon2)
-                                    if dist is not None and dist >= 50:  # Seuil de 50 mètres
-                                        coord_diff_mask.loc[idx] = True
-                                except:
-                                    pass
-                            elif lat1 != lat2 or lon1 != lon2:
-                                coord_diff_mask.loc[idx] = True
+                        pos_rem = removed_df.index.get_indexer(matched_chl['_idx_rem'])
+                        pos_add = added_df.index.get_indexer(matched_chl['_idx_add'])
+                        both_valid = valid_rem[pos_rem] & valid_add[pos_add]
+                        dist = haversine_meters(lat_rem[pos_rem], lon_rem[pos_rem],
+                                                lat_add[pos_add], lon_add[pos_add], thresholds=(50,))
+                        coord_diff_mask = pd.Series(
+                            (both_valid & (dist >= 50)) |  # Seuil de 50 mètres
+                            (valid_rem[pos_rem] != valid_add[pos_add]),  # Une seule des deux lisible
+                            index=matched_chl.index
+                        )
                         
                         matched_chl_filtered = matched_chl[coord_diff_mask].copy()
                         if not matched_chl_filtered.empty:
@@ -777,185 +944,60 @@ class OptimizedProcessor:
                                 
                                 change_dfs['CHL'] = change_df
                                 functions_anfr.log_message(f"Détecté {len(change_df)} changements CHL.")
+                report_anfr.stop(record, rows_out=len(indices_to_remove_added) - detected)
 
-            # === Détection de CHT: changement de type de support ===
+            # === Détection de CHT/CHP/CHH: changement de type, propriétaire ou hauteur de support ===
+            # Une seule jointure sur la clé commune, puis un filtre par attribut, dans l'ordre CHT, CHP, CHH
             if not added_df.empty and not removed_df.empty:
-                # Colonnes communes pour le merge (SANS type_support)
-                merge_cols_cht = ['id_support', 'operateur', 'technologie', 'adresse0', 'adresse1', 'adresse2', 'adresse3', 'code_insee', 'coordonnees']
-                available_cols_cht = [col for col in merge_cols_cht if col in added_df.columns and col in removed_df.columns]
+                merge_cols_attr = ['id_support', 'operateur', 'technologie', 'adresse0', 'adresse1', 'adresse2', 'adresse3', 'code_insee', 'coordonnees']
+                available_cols_attr = [col for col in merge_cols_attr if col in added_df.columns and col in removed_df.columns]
+                attr_changes = [(action, col, fill) for action, col, fill in SUPPORT_ATTRIBUTE_CHANGES
+                                if col in removed_df.columns and col in added_df.columns]
                 
-                # Vérifier que type_support existe dans les deux DataFrames
-                if (available_cols_cht == merge_cols_cht and 
-                    'type_support' in removed_df.columns and 
-                    'type_support' in added_df.columns):
-                    
-                    removed_cht = removed_df[available_cols_cht + ['type_support']].copy()
-                    added_cht = added_df[available_cols_cht + ['type_support']].copy()
-                    removed_cht['_idx_rem'] = removed_df.index
-                    added_cht['_idx_add'] = added_df.index
+                if available_cols_attr == merge_cols_attr and attr_changes:
+                    attr_cols = [col for _, col, _ in attr_changes]
+                    removed_attr = removed_df[available_cols_attr + attr_cols].copy()
+                    added_attr = added_df[available_cols_attr + attr_cols].copy()
+                    removed_attr['_idx_rem'] = removed_df.index
+                    added_attr['_idx_add'] = added_df.index
                     
-                    matched_cht = pd.merge(removed_cht, added_cht, on=available_cols_cht, how='inner', suffixes=('_rem', '_add'))
+                    with report_anfr.step("pretrait.detect_support_join", rows_in=len(added_df) + len(removed_df)) as record:
+                        matched_attr = pd.merge(removed_attr, added_attr, on=available_cols_attr, how='inner', suffixes=('_rem', '_add'))
+                        record['rows_out'] = len(matched_attr)
                     
-                    if not matched_cht.empty:
-                        # Normaliser les valeurs avant comparaison
-                        type_rem = matched_cht['type_support_rem'].fillna('').astype(str).str.strip()
-                        type_add = matched_cht['type_support_add'].fillna('').astype(str).str.strip()
-                        type_diff_mask = type_rem != type_add
+                    for action, col, fill in attr_changes:
+                        if matched_attr.empty:
+                            break
                         
-                        matched_cht_filtered = matched_cht[type_diff_mask].copy()
-                        
-                        if not matched_cht_filtered.empty:
-                            idx_rem = matched_cht_filtered['_idx_rem'].tolist()
-                            idx_add = matched_cht_filtered['_idx_add'].tolist()
-                            # Éviter les doublons
-                            idx_rem = [i for i in idx_rem if i not in indices_to_remove_removed]
-                            idx_add = [i for i in idx_add if i not in indices_to_remove_added]
+                        with report_anfr.step(f"pretrait.detect_{action}", rows_in=len(matched_attr)) as record:
+                            # Normaliser les valeurs avant comparaison
+                            attr_rem = matched_attr[f'{col}_rem'].fillna(fill).astype(str).str.strip()
+                            attr_add = matched_attr[f'{col}_add'].fillna(fill).astype(str).str.strip()
+                            matched_attr_filtered = matched_attr[attr_rem != attr_add]
                             
-                            if idx_add and idx_rem:
-                                indices_to_remove_removed.extend(idx_rem)
-                                indices_to_remove_added.extend(idx_add)
-                                
-                                change_df = added_df.loc[idx_add].copy()
-                                change_df['source'] = 'comp_change.csv'
-                                change_df['action'] = 'CHT'
-                                
-                                # Convertir et ajouter les anciens types de support
-                                old_types = []
-                                for idx_r in idx_rem:
-                                    try:
-                                        type_val = removed_df.loc[idx_r, 'type_support']
-                                        # Gérer les valeurs vides/NaN
-                                        if pd.isna(type_val) or str(type_val).strip() == '':
-                                            old_types.append("Inconnu")
-                                            continue
-                                        
-                                        type_str = str(type_val).strip()
-                                        # Convertir en int si c'est un nombre
-                                        if type_str.replace('.','').replace('-','').isdigit():
-                                            type_int = int(float(type_str))
-                                            type_converted = CORRESPONDANCES_TYPE_SUPPORT.get(type_int, "Inconnu")
-                                        else:
-                                            type_converted = "Inconnu"
-                                    except:
-                                        type_converted = "Inconnu"
-                                    old_types.append(type_converted)
-                                
-                                change_df['old_type_support'] = old_types
-                                change_dfs['CHT'] = change_df
-                                functions_anfr.log_message(f"Détecté {len(change_df)} changements CHT.")
-            
-            # === Détection de CHP: changement de propriétaire de support ===
-            if not added_df.empty and not removed_df.empty:
-                merge_cols_chp = ['id_support', 'operateur', 'technologie', 'adresse0', 'adresse1', 'adresse2', 'adresse3', 'code_insee', 'coordonnees']
-                available_cols_chp = [col for col in merge_cols_chp if col in added_df.columns and col in removed_df.columns]
-                
-                if (available_cols_chp == merge_cols_chp and 
-                    'proprietaire_support' in removed_df.columns and 
-                    'proprietaire_support' in added_df.columns):
-                    
-                    removed_chp = removed_df[available_cols_chp + ['proprietaire_support']].copy()
-                    added_chp = added_df[available_cols_chp + ['proprietaire_support']].copy()
-                    removed_chp['_idx_rem'] = removed_df.index
-                    added_chp['_idx_add'] = added_df.index
-                    
-                    matched_chp = pd.merge(removed_chp, added_chp, on=available_cols_chp, how='inner', suffixes=('_rem', '_add'))
-                    
-                    if not matched_chp.empty:
-                        # Normaliser les valeurs avant comparaison
-                        prop_rem = matched_chp['proprietaire_support_rem'].fillna('').astype(str).str.strip()
-                        prop_add = matched_chp['proprietaire_support_add'].fillna('').astype(str).str.strip()
-                        prop_diff_mask = prop_rem != prop_add
-                        
-                        matched_chp_filtered = matched_chp[prop_diff_mask].copy()
-                        
-                        if not matched_chp_filtered.empty:
-                            idx_rem = matched_chp_filtered['_idx_rem'].tolist()
-                            idx_add = matched_chp_filtered['_idx_add'].tolist()
-                            # Éviter les doublons
-                            idx_rem = [i for i in idx_rem if i not in indices_to_remove_removed]
-                            idx_add = [i for i in idx_add if i not in indices_to_remove_added]
+                            if matched_attr_filtered.empty:
+                                continue
                             
-                            if idx_add and idx_rem:
-                                indices_to_remove_removed.extend(idx_rem)
-                                indices_to_remove_added.extend(idx_add)
-                                
-                                change_df = added_df.loc[idx_add].copy()
-                                change_df['source'] = 'comp_change.csv'
-                                change_df['action'] = 'CHP'
-                                
-                                # Convertir et ajouter les anciens propriétaires
-                                old_props = []
-                                for idx_r in idx_rem:
-                                    try:
-                                        prop_val = removed_df.loc[idx_r, 'proprietaire_support']
-                                        if pd.isna(prop_val) or str(prop_val).strip() == '':
-                                            old_props.append("Inconnu")
-                                            continue
-                                        
-                                        prop_str = str(prop_val).strip()
-                                        if prop_str.replace('.','').replace('-','').isdigit():
-                                            prop_int = int(float(prop_str))
-                                            prop_converted = CORRESPONDANCES_PROPRIETAIRE_SUPPORT.get(prop_int, "Inconnu")
-                                        else:
-                                            prop_converted = "Inconnu"
-                                    except:
-                                        prop_converted = "Inconnu"
-                                    old_props.append(prop_converted)
-                                
-                                change_df['old_proprietaire_support'] = old_props
-                                change_dfs['CHP'] = change_df
-                                functions_anfr.log_message(f"Détecté {len(change_df)} changements CHP.")
-            
-            # === Détection de CHH: changement de hauteur de support ===
-            if not added_df.empty and not removed_df.empty:
-                merge_cols_chh = ['id_support', 'operateur', 'technologie', 'adresse0', 'adresse1', 'adresse2', 'adresse3', 'code_insee', 'coordonnees']
-                available_cols_chh = [col for col in merge_cols_chh if col in added_df.columns and col in removed_df.columns]
-                
-                if (available_cols_chh == merge_cols_chh and 
-                    'hauteur_support' in removed_df.columns and 
-                    'hauteur_support' in added_df.columns):
-                    
-                    removed_chh = removed_df[available_cols_chh + ['hauteur_support']].copy()
-                    added_chh = added_df[available_cols_chh + ['hauteur_support']].copy()
-                    removed_chh['_idx_rem'] = removed_df.index
-                    added_chh['_idx_add'] = added_df.index
-                    
-                    matched_chh = pd.merge(removed_chh, added_chh, on=available_cols_chh, how='inner', suffixes=('_rem', '_add'))
-                    
-                    if not matched_chh.empty:
-                        # Normaliser et comparer les hauteurs
-                        hauteur_rem = matched_chh['hauteur_support_rem'].fillna('0').astype(str).str.strip()
-                        hauteur_add = matched_chh['hauteur_support_add'].fillna('0').astype(str).str.strip()
-                        hauteur_diff_mask = hauteur_rem != hauteur_add
-                        
-                        matched_chh_filtered = matched_chh[hauteur_diff_mask].copy()
-                        
-                        if not matched_chh_filtered.empty:
-                            idx_rem = matched_chh_filtered['_idx_rem'].tolist()
-                            idx_add = matched_chh_filtered['_idx_add'].tolist()
-                            # Éviter les doublons
-                            idx_rem = [i for i in idx_rem if i not in indices_to_remove_removed]
-                            idx_add = [i for i in idx_add if i not in indices_to_remove_added]
+                            # Éviter les doublons avec les changements déjà détectés
+                            done_removed = set(indices_to_remove_removed)
+                            done_added = set(indices_to_remove_added)
+                            idx_rem = [i for i in matched_attr_filtered['_idx_rem'].tolist() if i not in done_removed]
+                            idx_add = [i for i in matched_attr_filtered['_idx_add'].tolist() if i not in done_added]
                             
-                            if idx_add and idx_rem:
-                                indices_to_remove_removed.extend(idx_rem)
-                                indices_to_remove_added.extend(idx_add)
-                                
-                                change_df = added_df.loc[idx_add].copy()
-                                change_df['source'] = 'comp_change.csv'
-                                change_df['action'] = 'CHH'
-                                
-                                # Ajouter les anciennes hauteurs (format avec virgule et 'm')
-                                old_hauteurs = []
-                                for idx_r in idx_rem:
-                                    h_val = removed_df.loc[idx_r, 'hauteur_support']
-                                    h_str = str(h_val) if pd.notna(h_val) else '0'
-                                    h_formatted = f"{h_str.replace('.', ',')}m"
-                                    old_hauteurs.append(h_formatted)
-                                
-                                change_df['old_hauteur_support'] = old_hauteurs
-                                change_dfs['CHH'] = change_df
-                                functions_anfr.log_message(f"Détecté {len(change_df)} changements CHH.")
+                            if not (idx_add and idx_rem):
+                                continue
+                            
+                            indices_to_remove_removed.extend(idx_rem)
+                            indices_to_remove_added.extend(idx_add)
+                            
+                            change_df = added_df.loc[idx_add].copy()
+                            change_df['source'] = 'comp_change.csv'
+                            change_df['action'] = action
+                            # Anciennes valeurs converties en libellés (types, propriétaires) ou en hauteur "12,5m"
+                            change_df[f'old_{col}'] = self.format_old_support_values(removed_df.loc[idx_rem, col])
+                            change_dfs[action] = change_df
+                            record['rows_out'] = len(change_df)
+                            functions_anfr.log_message(f"Détecté {len(change_df)} changements {action}.")
 
             # Retirer les doublons d'indices
             indices_to_remove_added = list(set(indices_to_remove_added))
@@ -1041,9 +1083,15 @@ class OptimizedProcessor:
             # Mise à jour des adresses vectorisée
             final_df['adresse'] = self.maj_addr_vectorized(final_df)
             
-            # Agrégation optimisée
+            # Agrégation optimisée : les bandes d'un groupe sont réunies par masque de bits
+            group_keys = ['id_support', 'operateur', 'action']
+            final_df['bandes'] = bands_anfr.band_bits(final_df['technologie'])
+            # Masque exploitable seulement si le groupe n'a que des bandes connues, chacune une fois
+            final_df['bandes_ok'] = ((final_df['bandes'] != 0) &
+                                     ((final_df['bandes'] & bands_anfr.BAND_OTHER) == 0) &
+                                     ~final_df.duplicated(subset=group_keys + ['bandes']))
             agg_dict = {
-                'technologie': lambda x: ', '.join(x),
+                'technologie': 'first',
                 'adresse': 'first',
                 'code_insee': 'first',
                 'coordonnees': 'first',
@@ -1052,12 +1100,37 @@ class OptimizedProcessor:
                 'proprietaire_support': 'first',
                 'date_activ': 'first',
                 'action': 'first',
-                'infos': 'first'  # Ajout de la colonne infos
+                'infos': 'first',  # Ajout de la colonne infos
+                'bandes': 'sum',
+                'bandes_ok': 'all'
             }
             
-            final_df = (final_df.groupby(['id_support', 'operateur', 'action'], as_index=False)
+            rows_df = final_df
+            final_df = (final_df.groupby(group_keys, as_index=False)
                        .agg(agg_dict))
             
+            # Bits distincts : la somme vaut le OU, le libellé sort déjà trié de la table des bandes
+            final_df['technologie'] = final_df['bandes'].map(bands_anfr.bands_label)
+            fallback = ~final_df['bandes_ok']
+            mask_resort = pd.Series(False, index=final_df.index)
+            if fallback.any():
+                # Bandes inconnues ou répétées : lignes triées (tri stable) par rang de technologie,
+                # la concaténation du groupby sort donc directement dans l'ordre
+                fallback_keys = pd.MultiIndex.from_frame(final_df.loc[fallback, group_keys])
+                rows_keys = pd.MultiIndex.from_frame(rows_df[group_keys])
+                rows = rows_df.loc[rows_keys.isin(fallback_keys), group_keys + ['technologie']]
+                # Valeurs contenant déjà ", " : ordre d'origine, le groupe est retrié élément par élément
+                rows['multi'] = rows['technologie'].str.contains(', ', regex=False).fillna(False).astype(bool)
+                multi_group = rows.groupby(group_keys)['multi'].transform('any').fillna(False).astype(bool)
+                rows['rang'] = np.where(multi_group, -1, self.technology_ranks(rows['technologie']))
+                joined = (rows.sort_values('rang', kind='stable')
+                          .groupby(group_keys)
+                          .agg(technologie=('technologie', ', '.join), multi=('multi', 'any'))
+                          .reindex(fallback_keys))
+                final_df.loc[fallback, 'technologie'] = joined['technologie'].to_numpy()
+                mask_resort.loc[fallback] = joined['multi'].to_numpy(dtype=bool)
+            final_df = final_df.drop(columns=['bandes', 'bandes_ok'])
+            
             # Post-traitement du champ technologie
             # Pour CHA/CHI/CHL : vider la technologie (déjà fait avant, mais on s'assure)
             # Pour les autres actions : trier les technologies normalement
@@ -1066,8 +1139,9 @@ class OptimizedProcessor:
             # Vider la technologie pour les changements
             final_df.loc[mask_change, 'technologie'] = ''
             
-            # Trier les technologies pour les autres actions
-            final_df.loc[~mask_change, 'technologie'] = final_df.loc[~mask_change, 'technologie'].apply(
+            # Trier les technologies pour les autres actions (déjà dans l'ordre, sauf valeurs contenant ", ")
+            mask_sort = ~mask_change & mask_resort
+            final_df.loc[mask_sort, 'technologie'] = final_df.loc[mask_sort, 'technologie'].apply(
                 self.sort_technologies_optimized
             )
             
@@ -1098,7 +1172,9 @@ class OptimizedProcessor:
             final_df = final_df[~duplicated]
             
             # Détection des doublons complexes
-            duplicates_df = self.find_and_isolate_duplicates_optimized(final_df)
+            with report_anfr.step("pretrait.isolate_duplicates", rows_in=len(final_df)) as record:
+                duplicates_df = self.find_and_isolate_duplicates_optimized(final_df)
+                record['rows_out'] = len(duplicates_df)
             if not duplicates_df.empty:
                 final_df = final_df[~final_df.index.isin(duplicates_df.index)]
             
@@ -1107,25 +1183,8 @@ class OptimizedProcessor:
             final_df['coordonnees'] = (coords_split.round(4).astype(str)
                                      .apply(lambda x: ','.join(x), axis=1))
             
-            # Calcul optimisé des flags is_zb et is_new
-            final_df['technologie_set'] = final_df['technologie'].apply(lambda x: frozenset(x.split(', ')))
-            
-            # Calculs par batch pour is_zb
-            unique_pairs = final_df[['id_support', 'operateur']].drop_duplicates()
-            zb_results = {}
-            new_results = {}
-            
-            for _, row in unique_pairs.iterrows():
-                key = (row['id_support'], row['operateur'])
-                zb_results[key] = self.is_zb_cached(row['id_support'], row['operateur'])
-                new_results[key] = self.is_new_cached(row['id_support'], row['operateur'])
-            
-            # Application vectorisée des résultats
-            final_df['is_zb'] = final_df.apply(lambda x: zb_results.get((x['id_support'], x['operateur']), False), axis=1)
-            final_df['is_new'] = final_df.apply(lambda x: new_results.get((x['id_support'], x['operateur']), False), axis=1)
-            
-            # Nettoyage final
-            final_df = final_df.drop('technologie_set', axis=1)
+            # Calcul vectorisé des flags is_zb et is_new
+            final_df['is_zb'], final_df['is_new'] = self.support_flags_vectorized(final_df)
             
             # Génération des fichiers par opérateur avec des filtres vectorisés
             operator_mapping = {
@@ -1136,6 +1195,7 @@ class OptimizedProcessor:
             }
             
             # Sauvegarde optimisée
+            record = report_anfr.start("pretrait.write_outputs", rows_in=len(final_df))
             final_df.to_csv(os.path.join(output_path, 'index.csv'), index=False)
             
             for filename, mask in operator_mapping.items():
@@ -1144,8 +1204,9 @@ class OptimizedProcessor:
                     operator_df.to_csv(os.path.join(output_path, filename), index=False)
             
             # Fichier avec timestamp
-            time_period = functions_anfr.get_period_code(TIMESTAMP, args.update_type)
+            time_period = functions_anfr.get_period_code(self.timestamp, self.update_type)
             final_df.to_csv(os.path.join(output_path, f"{time_period}.csv"), index=False)
+            report_anfr.stop(record, rows_out=len(final_df))
             
             functions_anfr.log_message("Fichiers finaux générés avec succès, duplications supprimées.")
             
@@ -1154,9 +1215,59 @@ class OptimizedProcessor:
             raise SystemExit(1)
 
 
-def main(no_insee, no_process, debug):
-    """Fonction principale optimisée."""
-    processor = OptimizedProcessor()
+def build_new_indexes(processor: OptimizedProcessor, df_new: pd.DataFrame, snapshots: list,
+                      has_tech_cols: bool) -> None:
+    """Index tirés du nouvel instantané (communs à toutes les périodes) et table des rangs de technologie.
+
+    snapshots: tous les instantanés chargés ; la table des rangs couvre leurs valeurs observées
+    (un rang dense sur un sur-ensemble ordonne chaque paire de la même façon).
+    """
+    tech_values = set()
+    for df in snapshots:
+        if "technologie" in df.columns:
+            tech_values.update(df["technologie"].dropna().unique())
+    processor.tech_ranks = build_tech_ranks(tech_values)
+    
+    if has_tech_cols:
+        processor.techs_new_map = processor.extract_tech_dict_optimized(df_new)
+        functions_anfr.log_message(f"✓ Index tech NEW créé ({len(processor.techs_new_map):,} entrées)", "INFO")
+    else:
+        processor.techs_new_map = pd.Series(dtype='uint64')
+
+
+def build_old_indexes(processor: OptimizedProcessor, df_old: pd.DataFrame, has_tech_cols: bool) -> None:
+    """Index tirés de l'instantané de référence : technologies et statuts (is_new) par support."""
+    if has_tech_cols:
+        processor.techs_old_map = processor.extract_tech_dict_optimized(df_old)
+        functions_anfr.log_message(f"✓ Index tech OLD créé ({len(processor.techs_old_map):,} entrées)", "INFO")
+        
+        # Pour new_status_dict, vérifier aussi la présence de 'statut'
+        if "statut" in df_old.columns:
+            processor.new_status_dict = processor.build_new_status_map_optimized(df_old)
+            functions_anfr.log_message(f"✓ Index statuts créé ({len(processor.new_status_dict):,} entrées)", "INFO")
+        else:
+            functions_anfr.log_message("Colonne 'statut' manquante dans OLD_CSV pour is_new", "WARN")
+            processor.new_status_dict = pd.Series(dtype=bool)
+    else:
+        processor.techs_old_map = pd.Series(dtype='uint64')
+        processor.new_status_dict = pd.Series(dtype=bool)
+
+
+def main(no_insee, no_process, debug, update_type, timestamp=None, old_csv_path=None, new_csv_path=None,
+         snapshots=None, diffs=None):
+    """Fonction principale optimisée.
+
+    Lancé par core.py en mode in-process, reçoit directement de compare.py le timestamp, les
+    chemins, les instantanés chargés (snapshots = (ancien, nouveau)) et les résultats (diffs).
+    Sinon, tout est relu depuis files/compared.
+    """
+    if timestamp is None:
+        try:
+            timestamp, old_csv_path, new_csv_path = functions_anfr.read_compare_timestamp()
+        except (FileNotFoundError, IndexError) as e:
+            functions_anfr.log_message(f"Erreur lecture timestamp: {e}", "FATAL")
+            raise SystemExit(1)
+    processor = OptimizedProcessor(timestamp, update_type)
     
     path_app = os.path.dirname(os.path.abspath(__file__))
     added_path = os.path.join(path_app, 'files', 'compared', 'comp_added.csv')
@@ -1168,19 +1279,30 @@ def main(no_insee, no_process, debug):
     # Chargement des données une seule fois au début
     functions_anfr.log_message("Début du chargement des fichiers CSV principaux...", "INFO")
     try:
-        # Chargement complet pour extract_tech_dict et build_new_status_map
-        functions_anfr.log_message(f"Chargement de {os.path.basename(OLD_CSV_PATH)}...", "INFO")
-        sep_o = functions_anfr.detect_separator(OLD_CSV_PATH)
-        df_old = pd.read_csv(OLD_CSV_PATH, on_bad_lines="skip", dtype=str, sep=sep_o, engine='c')
-        functions_anfr.log_message(f"✓ {os.path.basename(OLD_CSV_PATH)} chargé ({len(df_old):,} lignes)", "INFO")
-        
-        functions_anfr.log_message(f"Chargement de {os.path.basename(NEW_CSV_PATH)}...", "INFO")
-        sep_n = functions_anfr.detect_separator(NEW_CSV_PATH)
-        df_new = pd.read_csv(NEW_CSV_PATH, on_bad_lines="skip", dtype=str, sep=sep_n, engine='c')
-        functions_anfr.log_message(f"✓ {os.path.basename(NEW_CSV_PATH)} chargé ({len(df_new):,} lignes)", "INFO")
+        # Seules les colonnes utiles aux index tech/statuts sont lues depuis le cache colonnaire
+        snapshot_cols = ["id_support", "operateur", "technologie", "statut"]
+        if snapshots is not None:
+            df_old, df_new = (df[snapshot_cols] for df in snapshots)
+            functions_anfr.log_message("Instantanés reçus de compare.py, pas de rechargement.", "INFO")
+        elif not os.path.exists(old_csv_path):
+            # Diff composé (mensu/trim sans copie complète) : référence reconstituée depuis le nouvel instantané
+            functions_anfr.log_message(f"{os.path.basename(old_csv_path)} absent, référence reconstituée depuis les résultats.", "INFO")
+            with report_anfr.step("pretrait.load_snapshots") as record:
+                df_new = functions_anfr.load_snapshot(new_csv_path)
+                df_old = deltas_anfr.reference_snapshot(
+                    df_new, *deltas_anfr.read_compared(os.path.dirname(added_path)))[snapshot_cols]
+                df_new = df_new[snapshot_cols]
+                record['rows_out'] = len(df_old) + len(df_new)
+        else:
+            functions_anfr.log_message(f"Chargement de {os.path.basename(old_csv_path)} et {os.path.basename(new_csv_path)}...", "INFO")
+            with report_anfr.step("pretrait.load_snapshots") as record:
+                df_old, df_new = functions_anfr.load_snapshots([old_csv_path, new_csv_path], columns=snapshot_cols)
+                record['rows_out'] = len(df_old) + len(df_new)
+        functions_anfr.log_message(f"✓ {os.path.basename(old_csv_path)} chargé ({len(df_old):,} lignes)", "INFO")
+        functions_anfr.log_message(f"✓ {os.path.basename(new_csv_path)} chargé ({len(df_new):,} lignes)", "INFO")
         
         # Vérifier les colonnes nécessaires pour tech extraction
-        required_tech_cols = ["sup_id", "adm_lb_nom", "emr_lb_systeme"]
+        required_tech_cols = ["id_support", "operateur", "technologie"]
         old_has_tech_cols = all(col in df_old.columns for col in required_tech_cols)
         new_has_tech_cols = all(col in df_new.columns for col in required_tech_cols)
         
@@ -1195,42 +1317,74 @@ def main(no_insee, no_process, debug):
 
     # Préparation des données tech et status une seule fois
     functions_anfr.log_message("Préparation des index technologie et statuts...", "INFO")
-    
-    if new_has_tech_cols:
-        processor.techs_new_map = processor.extract_tech_dict_optimized(df_new)
-        functions_anfr.log_message(f"✓ Index tech NEW créé ({len(processor.techs_new_map):,} entrées)", "INFO")
-    else:
-        processor.techs_new_map = {}
-        
-    if old_has_tech_cols:
-        processor.techs_old_map = processor.extract_tech_dict_optimized(df_old)
-        functions_anfr.log_message(f"✓ Index tech OLD créé ({len(processor.techs_old_map):,} entrées)", "INFO")
-        
-        # Pour new_status_dict, vérifier aussi la présence de 'statut'
-        if "statut" in df_old.columns:
-            processor.new_status_dict = processor.build_new_status_map_optimized(df_old)
-            functions_anfr.log_message(f"✓ Index statuts créé ({len(processor.new_status_dict):,} entrées)", "INFO")
-        else:
-            functions_anfr.log_message("Colonne 'statut' manquante dans OLD_CSV pour is_new", "WARN")
-            processor.new_status_dict = defaultdict(list)
-    else:
-        processor.techs_old_map = {}
-        processor.new_status_dict = defaultdict(list)
+    record = report_anfr.start("pretrait.build_indexes", rows_in=len(df_old) + len(df_new))
+    build_new_indexes(processor, df_new, [df_old, df_new], new_has_tech_cols)
+    build_old_indexes(processor, df_old, old_has_tech_cols)
+    report_anfr.stop(record, rows_out=len(processor.techs_new_map) + len(processor.techs_old_map))
 
     # Chargement INSEE optimisé
     if not no_insee:
-        processor.load_insee_data_optimized(insee_path, encoding='ISO-8859-1')
+        with report_anfr.step("pretrait.load_insee") as record:
+            record['rows_out'] = processor.load_insee_data_optimized(insee_path, encoding='ISO-8859-1')
     else:
         functions_anfr.log_message("Chargement INSEE sauté : demandé par argument", "WARN")
 
     # Traitement principal
     if not no_process:
-        processor.merge_and_process_optimized(added_path, modified_path, removed_path, pretraite_path)
+        with report_anfr.step("pretrait.merge_and_process"):
+            processor.merge_and_process_optimized(added_path, modified_path, removed_path, pretraite_path, diffs)
         functions_anfr.log_message("Prétraitement terminé")
     else:
         functions_anfr.log_message("Prétraitement sauté : demandé par argument", "WARN")
 
 
+
+def main_periods(no_insee, no_process, debug, timestamp=None, new_csv_path=None, snapshot_new=None, periods=None):
+    """Prétraitement du mode multi-périodes (core.py --with-periods), à partir de compare.main_periods.
+
+    Les index du nouvel instantané, la table des rangs et le référentiel INSEE sont construits une
+    seule fois ; chaque période ne recalcule que les index de sa référence. Toutes les périodes
+    écrivent dans files/pretraite (codes de période distincts), la principale en dernier pour que
+    index.csv et les fichiers opérateurs soient les siens.
+    """
+    if not periods:
+        functions_anfr.log_message("Mode multi-périodes : aucun résultat de compare.py à prétraiter.", "FATAL")
+        raise SystemExit(1)
+    path_app = os.path.dirname(os.path.abspath(__file__))
+    insee_path = os.path.join(path_app, 'files', 'cc_insee', 'cc_insee.csv')
+    pretraite_path = os.path.join(path_app, 'files', 'pretraite')
+    snapshot_cols = ["id_support", "operateur", "technologie", "statut"]
+    required_tech_cols = ["id_support", "operateur", "technologie"]
+
+    primary = next(iter(periods))
+    df_new = snapshot_new[snapshot_cols]
+    olds = {period: data['snapshot_old'][snapshot_cols] for period, data in periods.items()}
+
+    shared = OptimizedProcessor(timestamp, primary)
+    with report_anfr.step("pretrait.build_new_indexes", rows_in=len(df_new)) as record:
+        build_new_indexes(shared, df_new, [df_new, *olds.values()],
+                          all(col in df_new.columns for col in required_tech_cols))
+        record['rows_out'] = len(shared.techs_new_map)
+    if not no_insee:
+        with report_anfr.step("pretrait.load_insee") as record:
+            record['rows_out'] = shared.load_insee_data_optimized(insee_path, encoding='ISO-8859-1')
+    else:
+        functions_anfr.log_message("Chargement INSEE sauté : demandé par argument", "WARN")
+
+    for period in [*list(periods)[1:], primary]:
+        functions_anfr.log_message(f"Prétraitement {period} (référence {os.path.basename(periods[period]['old_csv_path'])})...")
+        processor = copy.copy(shared)
+        processor.update_type = period
+        with report_anfr.step(f"pretrait.build_old_indexes_{period}", rows_in=len(olds[period])) as record:
+            build_old_indexes(processor, olds[period], all(col in olds[period].columns for col in required_tech_cols))
+            record['rows_out'] = len(processor.techs_old_map)
+        if not no_process:
+            with report_anfr.step(f"pretrait.merge_and_process_{period}"):
+                processor.merge_and_process_optimized(None, None, None, pretraite_path, periods[period]['diffs'])
+            functions_anfr.log_message(f"Prétraitement {period} terminé")
+        else:
+            functions_anfr.log_message("Prétraitement sauté : demandé par argument", "WARN")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Control which functions to skip.")
 
@@ -1242,7 +1396,10 @@ if __name__ == "__main__":
                        help="Ne pas effectuer le traitement des données.")
     parser.add_argument('--debug', action='store_true', 
                        help="Afficher les messages de debug.")
+    parser.add_argument('--profile', action='store_true',
+                       help="Profiler l'étape (cProfile, tracemalloc) : fichiers à côté du rapport d'exécution.")
     
     args = parser.parse_args()
 
-    main(no_insee=args.no_insee, no_process=args.no_process, debug=args.debug)
\ No newline at end of file
+    with report_anfr.profiled("pretrait", args.profile):
+        main(no_insee=args.no_insee, no_process=args.no_process, debug=args.debug, update_type=args.update_type)
\ No newline at end of file
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""Rapport de performance d'une exécution de core.py (un JSON par exécution dans files/reports).
+
+core.py ouvre le rapport et publie son chemin dans ANFR_RUN_REPORT : chaque étape, qu'elle
+tourne dans le même processus ou dans un script lancé par subprocess, y ajoute ses mesures
+(temps écoulé, temps CPU, pic de mémoire résidente, lignes en entrée et en sortie) à la sortie
+du processus. Sans cette variable, les mesures restent en mémoire et rien n'est écrit.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "files", "reports")
+REPORT_ENV = "ANFR_RUN_REPORT"
+REPORT_VERSION = 1
+
+# Profilage (--profile) : fonctions les plus coûteuses au journal, allocations gardées dans le fichier
+PROFILE_TOP = 15
+PROFILE_FRAMES = 10
+
+_LOCK = threading.Lock()
+_pending = []
+_run_started = None
+
+
+def _cpu_seconds() -> float:
+    """CPU utilisateur + système de ce processus et de ses enfants terminés (0 si non mesurable)."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _peak_rss_mb() -> float:
+    """Pic de mémoire résidente du processus ou d'un enfant terminé, en Mo (0 si non mesurable)."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    factor = 1 if sys.platform == "darwin" else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * factor / 2 ** 20, 1)
+
+
+def start(name: str, rows_in: int = None) -> dict:
+    """Ouvre la mesure d'une étape ; à refermer avec stop (ou utiliser step)."""
+    return {
+        'name': name,
+        'pid': os.getpid(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'rows_in': rows_in,
+        'rows_out': None,
+        '_wall': time.perf_counter(),
+        '_cpu': _cpu_seconds(),
+    }
+
+
+def stop(record: dict, rows_out: int = None) -> dict:
+    """Referme la mesure et la met en attente d'écriture dans le rapport."""
+    record['wall_s'] = round(time.perf_counter() - record.pop('_wall'), 3)
+    record['cpu_s'] = round(_cpu_seconds() - record.pop('_cpu'), 3)
+    record['peak_rss_mb'] = _peak_rss_mb()
+    if rows_out is not None:
+        record['rows_out'] = rows_out
+    with _LOCK:
+        _pending.append(record)
+    return record
+
+
+@contextmanager
+def step(name: str, rows_in: int = None):
+    """Mesure le bloc ; renseigner record['rows_out'] dans le bloc pour les lignes produites.
+
+    Le temps CPU est celui du processus entier : pour des étapes parallèles (threads), il se cumule.
+    """
+    record = start(name, rows_in)
+    try:
+        yield record
+    finally:
+        stop(record)
+
+
+def rows(df) -> int:
+    """Nombre de lignes d'un DataFrame éventuellement absent."""
+    return None if df is None else len(df)
+
+
+def _read(report_path: str) -> dict:
+    with open(report_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write(report_path: str, report: dict) -> None:
+    tmp_path = f"{report_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, report_path)
+
+
+def flush() -> None:
+    """Ajoute les mesures en attente au rapport de l'exécution en cours (s'il y en a un)."""
+    report_path = os.environ.get(REPORT_ENV)
+    with _LOCK:
+        records, _pending[:] = list(_pending), []
+    if not report_path or not records or not os.path.exists(report_path):
+        return
+    report = _read(report_path)
+    report['steps'].extend(records)
+    _write(report_path, report)
+
+
+atexit.register(flush)
+
+
+def begin_run(update_type: str, options: dict, reports_dir: str = REPORTS_DIR) -> str:
+    """Crée le rapport de l'exécution et le rend visible des scripts lancés ensuite (ANFR_RUN_REPORT)."""
+    global _run_started
+    os.makedirs(reports_dir, exist_ok=True)
+    now = datetime.now()
+    report_path = os.path.join(reports_dir, f"{now.strftime('%Y%m%d_%H%M%S')}_{update_type}.json")
+    _write(report_path, {
+        'version': REPORT_VERSION,
+        'update_type': update_type,
+        'started': now.isoformat(timespec='seconds'),
+        'options': options,
+        'steps': [],
+    })
+    os.environ[REPORT_ENV] = report_path
+    _run_started = start("core.total")
+    return report_path
+
+
+def end_run(status: str = "ok") -> None:
+    """Clôt le rapport : mesure globale de core.py (enfants compris) et statut final."""
+    if _run_started is None:
+        return
+    stop(_run_started)
+    flush()
+    report_path = os.environ.get(REPORT_ENV)
+    if report_path and os.path.exists(report_path):
+        report = _read(report_path)
+        report['finished'] = datetime.now().isoformat(timespec='seconds')
+        report['status'] = status
+        _write(report_path, report)
+
+
+def profile_dir(reports_dir: str = REPORTS_DIR) -> str:
+    """Dossier des profils : à côté du rapport de l'exécution en cours, sinon daté dans files/reports."""
+    report_path = os.environ.get(REPORT_ENV)
+    if report_path:
+        return os.path.splitext(report_path)[0] + "_profile"
+    return os.path.join(reports_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_profile")
+
+
+def profiled(name: str, enabled: bool = True):
+    """Profile le bloc (cProfile et tracemalloc) si enabled ; sinon contexte vide, sans aucun coût."""
+    return _profiled(name) if enabled else nullcontext()
+
+
+@contextmanager
+def _profiled(name: str, top: int = PROFILE_TOP):
+    """Écrit <name>.prof (pstats) et <name>_alloc.txt, et journalise les fonctions les plus coûteuses.
+
+    cProfile ne suit que le thread qui l'active : le travail des pools de threads (chargement
+    parallèle des instantanés) apparaît comme l'attente de leurs résultats.
+    """
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+    import functions_anfr
+
+    out_dir = profile_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    tracemalloc.start(PROFILE_FRAMES)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        prof_path = os.path.join(out_dir, f"{name}.prof")
+        profiler.dump_stats(prof_path)
+        alloc_path = os.path.join(out_dir, f"{name}_alloc.txt")
+        with open(alloc_path, 'w', encoding='utf-8') as f:
+            f.write(f"Pic Python suivi : {peak / 1024 ** 2:.1f} Mo, encore alloué en fin d'étape : {current / 1024 ** 2:.1f} Mo\n\n")
+            for stat in snapshot.statistics('traceback')[:top]:
+                f.write(f"{stat.size / 1024 ** 2:.1f} Mo en {stat.count} blocs\n")
+                f.write("\n".join(f"    {line}" for line in stat.traceback.format()) + "\n")
+
+        stats = io.StringIO()
+        pstats.Stats(profiler, stream=stats).sort_stats('tottime').print_stats(top)
+        functions_anfr.log_message(
+            f"Profil {name} ({prof_path}, pic Python {peak / 1024 ** 2:.1f} Mo) - fonctions les plus coûteuses :\n"
+            + _hot_functions(stats.getvalue())
+        )
+
+
+def _hot_functions(printed_stats: str) -> str:
+    """Ne garde de la sortie pstats que le tableau des fonctions."""
+    lines = printed_stats.splitlines()
+    start = next((i for i, line in enumerate(lines) if line.lstrip().startswith("ncalls")), 0)
+    return "\n".join(line for line in lines[start:] if line.strip())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""Schéma des colonnes à faible cardinalité des instantanés ANFR, chargées en Categorical.
+
+Les deux instantanés d'une comparaison reçoivent exactement les mêmes catégories
+(valeurs connues de SCHEMA_VERSION complétées par celles observées), triées comme des
+chaînes : jointures, groupby et masques travaillent sur les codes entiers, et les tris
+donnent le même ordre qu'avant sur le texte.
+"""
+import pandas as pd
+
+import bands_anfr
+
+# À incrémenter à chaque modification des ensembles de valeurs connues
+SCHEMA_VERSION = 1
+
+# Colonne -> valeurs toujours présentes dans les catégories (les autres sont ajoutées à la volée)
+CATEGORY_SETS = {
+    'operateur': ("BOUYGUES TELECOM", "FREE MOBILE", "ORANGE", "SFR", "SRR", "TELCO OI"),
+    'technologie': bands_anfr.BANDS,
+    'statut': ("En service", "Projet approuvé", "Techniquement opérationnel"),
+    'type_support': (),
+    'proprietaire_support': (),
+    'code_insee': (),
+}
+CATEGORICAL_COLUMNS = list(CATEGORY_SETS)
+
+
+def harmonised_dtypes(frames: list) -> dict:
+    """Types Categorical communs à tous les DataFrames, pour chaque colonne du schéma présente."""
+    dtypes = {}
+    for col in CATEGORICAL_COLUMNS:
+        series = [df[col] for df in frames if col in df.columns]
+        if not series:
+            continue
+        values = set(CATEGORY_SETS[col])
+        for s in series:
+            values.update(s.cat.categories if isinstance(s.dtype, pd.CategoricalDtype) else s.dropna().unique())
+        dtypes[col] = pd.CategoricalDtype(sorted(values))
+    return dtypes
+
+
+def to_categorical(frames: list) -> list:
+    """Convertit les colonnes du schéma en Categorical partagés entre les DataFrames donnés."""
+    dtypes = harmonised_dtypes(frames)
+    return [df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns}) for df in frames]
+
+
+def to_plain(df: pd.DataFrame) -> pd.DataFrame:
+    """Revient au texte (NaN conservés) pour les colonnes Categorical, avant écriture ou passage à pretrait."""
+    if df is None:
+        return None
+    plain = {col: df[col].cat.categories.dtype for col in df.columns
+             if isinstance(df[col].dtype, pd.CategoricalDtype)}
+    return df.astype(plain) if plain else df
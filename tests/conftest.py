@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Les modules du dépôt sont à plat à la racine
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
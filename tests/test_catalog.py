@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+import catalog_anfr
+
+
+def old_catalog(db_path, anchors_ddl):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(f"""
+        CREATE TABLE snapshots (directory TEXT, filename TEXT);
+        CREATE TABLE ignored (fingerprint TEXT PRIMARY KEY, filename TEXT NOT NULL);
+        {anchors_ddl};
+        PRAGMA user_version = {catalog_anfr.CATALOG_VERSION - 1};
+    """)
+    conn.close()
+
+
+def test_version_bump_keeps_anchors_and_rebuilds_the_rest(tmp_path):
+    db_path = str(tmp_path / "snapshots.sqlite")
+    old_catalog(db_path, "CREATE TABLE anchors (directory TEXT NOT NULL, period TEXT NOT NULL, "
+                         "filename TEXT NOT NULL, PRIMARY KEY (directory, period))")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO anchors VALUES (?, ?, ?)", (str(tmp_path), "09_2026", "20260901120000_observatoire.csv"))
+    conn.close()
+
+    catalog = catalog_anfr.SnapshotCatalog(db_path)
+    assert catalog.anchor(str(tmp_path), "09_2026") == "20260901120000_observatoire.csv"
+
+    conn = sqlite3.connect(db_path)
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(snapshots)")]
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    assert tables == {"snapshots", "anchors"}
+    assert "canonical_fingerprint" in columns
+    assert version == catalog_anfr.CATALOG_VERSION
+
+
+def test_version_bump_refuses_an_unmigrated_durable_table(tmp_path):
+    db_path = str(tmp_path / "snapshots.sqlite")
+    old_catalog(db_path, "CREATE TABLE anchors (directory TEXT, period TEXT)")
+    with pytest.raises(sqlite3.DatabaseError):
+        catalog_anfr.SnapshotCatalog(db_path).anchored(str(tmp_path))
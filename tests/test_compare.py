@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+import compare
+import schema_anfr
+
+
+def snapshot(n, seed):
+    """Instantané synthétique : peu de supports pour avoir des paires, clés Categorical manquantes."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({col: ["x"] * n for col in compare.ID_COLUMNS}, dtype="str")
+    df['id_support'] = [str(v) for v in rng.integers(0, 60, n)]
+    df['operateur'] = pd.Series(rng.choice(["ORANGE", "SFR", None], n), dtype="str")
+    df['technologie'] = pd.Series(rng.choice(["LTE 800", "GSM 900", None], n), dtype="str")
+    df['statut'] = rng.choice(["En service", "Projet approuvé"], n)
+    df['date_activ'] = pd.Series(rng.choice(["2026-01-01", "2026-02-01", None], n), dtype="str")
+    return df
+
+
+def test_engines_identical_with_missing_categorical_keys():
+    df_old, df_current = schema_anfr.to_categorical([snapshot(400, 1), snapshot(400, 2)])
+    assert df_old['operateur'].isna().any()
+
+    by_hash = compare.compare_data(df_old, df_current, engine="hash", with_dates=True)
+    by_merge = compare.compare_data(df_old, df_current, engine="merge", with_dates=True)
+
+    for hashed, merged in zip(by_hash, by_merge):
+        assert not hashed.empty
+        assert hashed.to_csv(index=False) == merged.to_csv(index=False)
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import compare
+import deltas_anfr
+
+NAMES = [f"202609{day:02d}120000_observatoire.csv" for day in (3, 10, 17, 24)]
+
+
+def chain(seed=0, n=300):
+    """Instantanés successifs : ajouts, suppressions, changements de statut et de date seule."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({col: ["x"] * n for col in compare.ID_COLUMNS}, dtype="str")
+    df['id_support'] = [str(i) for i in range(n)]
+    df['statut'] = rng.choice(["En service", "Projet approuvé"], n)
+    df['date_activ'] = "2026-01-01"
+    frames, next_id = [df], n
+    for _ in NAMES[1:]:
+        df = frames[-1].copy()
+        changed = rng.random(len(df)) < 0.1
+        df.loc[changed, 'statut'] = rng.choice(["En service", "Projet approuvé"], changed.sum())
+        dated = rng.random(len(df)) < 0.1
+        df.loc[dated, 'date_activ'] = rng.choice(["2026-02-01", "2026-03-01"], dated.sum())
+        df = df[rng.random(len(df)) > 0.05]
+        added = df.sample(15, random_state=int(rng.integers(1 << 31))).assign(
+            id_support=[str(i) for i in range(next_id, next_id + 15)])
+        next_id += 15
+        frames.append(pd.concat([df, added], ignore_index=True))
+    return frames
+
+
+def archive(frames, deltas_dir):
+    for old, new, df_old, df_new in zip(NAMES, NAMES[1:], frames, frames[1:]):
+        deltas_anfr.archive_delta(old, new, compare.compare_data(df_old, df_new, with_dates=True), str(deltas_dir))
+
+
+def test_composed_diff_equals_direct_compare(tmp_path):
+    frames = chain()
+    archive(frames, tmp_path)
+
+    delta_paths = deltas_anfr.delta_chain(NAMES[0], NAMES[-1], str(tmp_path))
+    assert len(delta_paths) == len(NAMES) - 1
+    composed = compare.compose_diffs([deltas_anfr.read_delta(path) for path in delta_paths])
+    direct = compare.compare_data(frames[0], frames[-1])
+
+    for net, expected in zip(composed, direct):
+        assert not expected.empty
+        assert net.to_csv(index=False) == expected.to_csv(index=False)
+
+
+def test_compose_falls_back_on_broken_chain_or_duplicates(tmp_path, monkeypatch):
+    archive(chain(), tmp_path)
+    delta_chain = deltas_anfr.delta_chain
+    monkeypatch.setattr(deltas_anfr, "delta_chain", lambda start, end: delta_chain(start, end, str(tmp_path)))
+    assert compare.compose_period_diff(NAMES[0], NAMES[-1]) is not None
+
+    # Identité dupliquée dans un diff : pas de composition exacte possible
+    middle = deltas_anfr.delta_path(NAMES[1], NAMES[2], str(tmp_path))
+    rows = deltas_anfr.read_delta(middle)
+    pd.concat([rows, rows.head(1)]).to_csv(middle, index=False)
+    assert compare.compose_period_diff(NAMES[0], NAMES[-1]) is None
+
+    # Maillon manquant
+    os.remove(middle)
+    assert compare.compose_period_diff(NAMES[0], NAMES[-1]) is None
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import functions_anfr
+
+PAYLOAD = os.urandom(300_000)
+ETAG = '"v1"'
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Serveur de test : coupe la première réponse à mi-corps, puis honore (ou ignore) les Range."""
+    honour_range = True
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        first = len(self.server.requests) == 1
+        start = 0
+        range_header = self.headers.get('Range')
+        if self.honour_range and range_header and self.headers.get('If-Range') == ETAG:
+            start = int(range_header.removeprefix("bytes=").rstrip("-"))
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(PAYLOAD) - 1}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(len(PAYLOAD) - start))
+        self.end_headers()
+        body = PAYLOAD[start:]
+        # Première réponse : connexion coupée après un tiers du corps
+        self.wfile.write(body[:len(body) // 3] if first else body)
+        self.wfile.flush()
+        if first:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=["range", "no-range"])
+def server(request):
+    handler = type("Handler", (FlakyHandler,), {'honour_range': request.param})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_resumes_after_cut(server, tmp_path):
+    httpd = server
+    url = f"http://127.0.0.1:{httpd.server_address[1]}/observatoire.csv"
+    save_path = str(tmp_path / "observatoire.csv")
+
+    # Petits blocs : une partie de la première réponse est écrite dans le .part avant la coupure
+    path, digest = functions_anfr.download_file(url, save_path, delay=0, timeout=10, chunk_size=8192)
+
+    assert path == save_path
+    with open(save_path, 'rb') as f:
+        assert f.read() == PAYLOAD
+    assert digest == hashlib.sha256(PAYLOAD).hexdigest()
+    assert not os.path.exists(save_path + ".part")
+
+    first, retry = httpd.requests
+    assert 'Range' not in first
+    # Deuxième tentative : reprise à l'octet écrit, validée par l'ETag de la première réponse ;
+    # sans Range honoré, le serveur renvoie 200 et le fichier est réécrit depuis le début
+    offset = int(retry['Range'].removeprefix("bytes=").rstrip("-"))
+    assert 0 < offset <= len(PAYLOAD) // 3
+    assert retry['If-Range'] == ETAG
@@ -0,0 +1,64 @@
+import functools
+import os
+
+import pytest
+
+import catalog_anfr
+import functions_anfr
+
+HEADER = "Opérateur;ID Support;Statut\n"
+ROWS = ["ORANGE;1;En service\n", "SFR;2;Projet approuvé\n", "FREE MOBILE;3;En service\n"]
+
+
+def write(path, header=HEADER, rows=ROWS, newline="\n"):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write((header + "".join(rows)).replace("\n", newline))
+    return str(path)
+
+
+@pytest.fixture
+def catalog(tmp_path, monkeypatch):
+    # Tout catalogue créé sans chemin explicite (ignore_snapshot...) utilise celui du test
+    monkeypatch.setattr(catalog_anfr, "SnapshotCatalog",
+                        functools.partial(catalog_anfr.SnapshotCatalog, str(tmp_path / "snapshots.sqlite")))
+    return catalog_anfr.SnapshotCatalog()
+
+
+def test_raw_form_ignores_header_layout_and_line_endings(tmp_path, catalog):
+    reference = write(tmp_path / "20261001120000_observatoire.csv")
+    new = write(tmp_path / "20261008120000_observatoire.csv",
+                header='\ufeff"OPÉRATEUR";"ID Support "; statut\n', newline="\r\n")
+    assert functions_anfr.matching_snapshot(new, [reference], catalog=catalog) == os.path.basename(reference)
+
+
+def test_canonical_form_ignores_row_order(tmp_path, catalog):
+    reference = write(tmp_path / "20261001120000_observatoire.csv")
+    new = write(tmp_path / "20261008120000_observatoire.csv", rows=ROWS[::-1])
+    assert functions_anfr.matching_snapshot(new, [reference], catalog=catalog) is None
+    assert functions_anfr.matching_snapshot(new, [reference], canonical=True, catalog=catalog) == os.path.basename(reference)
+
+
+def test_differing_reference_is_never_matched(tmp_path, catalog):
+    assert functions_anfr.matching_snapshot(
+        write(tmp_path / "20261008120000_observatoire.csv"),
+        [write(tmp_path / "20261001120000_observatoire.csv", rows=ROWS[:2]), None, str(tmp_path / "absent.csv")],
+        canonical=True, catalog=catalog) is None
+
+
+def test_ignored_weekly_does_not_empty_a_period_update(tmp_path, catalog):
+    weekly = write(tmp_path / "20261001120000_observatoire.csv")
+    ignored = write(tmp_path / "20261008120000_observatoire.csv")
+    # MAJ hebdo vide : identique à la précédente, ignorée puis supprimée
+    assert functions_anfr.matching_snapshot(ignored, [weekly], catalog=catalog) == os.path.basename(weekly)
+    functions_anfr.ignore_snapshot(ignored, str(tmp_path / "ignores.txt"))
+    os.remove(ignored)
+
+    # La MAJ mensuelle retélécharge le même contenu : la référence du mois, elle, diffère
+    redownloaded = write(tmp_path / "20261008120000_observatoire.csv")
+    period_reference = write(tmp_path / "09_2026.csv", rows=ROWS[1:])
+    assert functions_anfr.matching_snapshot(redownloaded, [period_reference], canonical=True, catalog=catalog) is None
+
+    # Une MAJ hebdo qui revient à ce contenu après un changement n'est pas vide non plus
+    changed = write(tmp_path / "20261015120000_observatoire.csv", rows=ROWS[:2])
+    reverted = write(tmp_path / "20261022120000_observatoire.csv")
+    assert functions_anfr.matching_snapshot(reverted, [changed], catalog=catalog) is None
@@ -0,0 +1,61 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import pretrait
+
+TIMESTAMP = "17/10/2026 à 12:00:00"
+SOURCES = pretrait.DIFF_SOURCES + ['autre.csv']
+STATUTS = [None, "Autre", "Projet approuvé", "En service", "Techniquement opérationnel"]
+# Manquante, avant et après la date limite (2026-09-19), valeur non ISO
+DATES = [None, "2026-01-01", "2026-09-30", "inconnue"]
+
+
+def legacy_actions(df: pd.DataFrame, limit: str) -> pd.Series:
+    """Cascade if/elif d'avant ACTION_TABLE (hors comp_change.csv), recopiée telle quelle."""
+    result = pd.Series(index=df.index, dtype=str)
+    active = ["En service", "Techniquement opérationnel"]
+
+    mask_ajo = df['source'] == 'comp_added.csv'
+    mask_activation = mask_ajo & df['statut_y'].isin(active)
+    mask_activation_rt = mask_activation & df['date_activ_y'].notna() & (df['date_activ_y'] < limit)
+    result.loc[mask_activation_rt] = 'AJR'
+    result.loc[mask_activation & ~mask_activation_rt] = 'AJA'
+    result.loc[mask_ajo & ~mask_activation] = 'AJO'
+
+    result.loc[df['source'] == 'comp_removed.csv'] = 'SUP'
+
+    mod_df = df.loc[df['source'] == 'comp_modified.csv']
+    statut_x, statut_y = mod_df['statut_x'], mod_df['statut_y']
+    date_activ_x, date_activ_y = mod_df['date_activ_x'], mod_df['date_activ_y']
+    cond_aav = (statut_x == 'Projet approuvé') & (statut_y == 'Projet approuvé') & (date_activ_x != date_activ_y)
+    cond_art = ((statut_x == 'Projet approuvé') & statut_y.isin(active) &
+                date_activ_y.notna() & (date_activ_y < limit))
+    cond_all = (statut_x == 'Projet approuvé') & statut_y.isin(active) & ~cond_art
+    cond_ext = statut_x.isin(active) & (statut_y == 'Projet approuvé')
+    mod_indices = mod_df.index
+    result.loc[mod_indices[cond_aav]] = 'AAV'
+    result.loc[mod_indices[cond_all & ~cond_aav]] = 'ALL'
+    result.loc[mod_indices[cond_art & ~cond_aav]] = 'ART'
+    result.loc[mod_indices[cond_ext & ~cond_aav & ~cond_all]] = 'EXT'
+    return result.fillna("UNKNOWN")
+
+
+def test_action_table_matches_legacy_cascade():
+    df = pd.DataFrame(list(itertools.product(SOURCES, STATUTS, STATUTS, DATES, DATES)),
+                      columns=['source', 'statut_x', 'statut_y', 'date_activ_x', 'date_activ_y'], dtype="str")
+    processor = pretrait.OptimizedProcessor(TIMESTAMP, "hebdo")
+
+    expected = legacy_actions(df, processor.activation_limit_date)
+    actual = processor.determine_action_vectorized(df)
+    pd.testing.assert_series_equal(actual, expected, check_dtype=False)
+
+    # Chaque case de la table est atteinte par au moins une ligne
+    source = pretrait.factor_classes(df['source'], {src: i + 1 for i, src in enumerate(pretrait.DIFF_SOURCES)})
+    statut_x = pretrait.factor_classes(df['statut_x'], pretrait.STATUT_CLASSES)
+    statut_y = pretrait.factor_classes(df['statut_y'], pretrait.STATUT_CLASSES)
+    date_changed = (df['date_activ_x'] != df['date_activ_y']).to_numpy(dtype=np.intp)
+    before_limit = pretrait.dates_before(df['date_activ_y'], processor.activation_limit_date).astype(np.intp)
+    reached = set(zip(source, statut_x, statut_y, date_changed, before_limit))
+    assert reached == set(np.ndindex(*pretrait.ACTION_TABLE.shape))